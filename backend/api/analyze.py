@@ -1,17 +1,24 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
 from typing import List
 from datetime import datetime
+import asyncio
 import uuid
 import logging
 import traceback
 import json
+from functools import partial
 
-from core.pdf_parser import extract_metadata
+from core.pipeline import parse_stored_pdf, run_llm, run_db
+from core.llm_gateway import start_ledger
 from core.ai_engine import analyze_text_with_medgemma
+from core.report_snapshot import build_snapshot, dump_snapshot
 from core.comparator import (compare_with_previous_reports, compare_with_latest_report_of_type,
-                                    compare_with_previous_report_by_title, compare_with_latest_report_by_title_only)
+                                    compare_with_previous_report_by_title, compare_with_latest_report_by_title_only,
+                                    load_latest_pair, compare_report_pair, load_title_only_comparison,
+                                    compare_title_only)
 from db import crud
-from db.session import get_db
+from db.session import get_db, SessionLocal, release_connection
 from db.models import Report
 from sqlalchemy.orm import Session
 
@@ -21,6 +28,10 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Analisi in streaming in corso: l'event loop tiene solo riferimenti deboli ai task,
+# senza questo insieme un'analisi il cui client si è disconnesso potrebbe essere raccolta
+_stream_tasks: set[asyncio.Task] = set()
+
 def extract_key_values_from_text(text, report_type):
     """Extract key values from text based on report type for comparison"""
     import re
@@ -182,8 +193,9 @@ def check_duplicate_report(db: Session, meta, extracted_text: str):
             print(f"🔍 No key values extracted for duplicate check")
             return None, False
         
-        # Get reports with EXACT match on CF + Date + Type (potential duplicates)
-        existing_reports = db.query(Report).filter(
+        # Get reports with EXACT match on CF + Date + Type (potential duplicates);
+        # only the id and the text are needed to compare the content
+        existing_reports = db.query(Report.id, Report.report_date, Report.extracted_text).filter(
             Report.report_type == report_type,
             Report.patient_cf == codice_fiscale,
             Report.report_date == report_date  # Same CF + Date + Type
@@ -193,11 +205,13 @@ def check_duplicate_report(db: Session, meta, extracted_text: str):
         print(f"🔍 Duplicate check: Found {len(existing_reports)} reports with same CF/Date/Type")
         
         # Check for content similarity only among reports with same CF + Date + Type
-        for report in existing_reports:
-            print(f"   Checking report ID {report.id} from {report.report_date}")
-            is_duplicate = reports_have_identical_values(report, extracted_text, report_type)
+        for candidate in existing_reports:
+            print(f"   Checking report ID {candidate.id} from {candidate.report_date}")
+            is_duplicate = reports_have_identical_values(candidate, extracted_text, report_type)
             print(f"   Result: {'DUPLICATE' if is_duplicate else 'DIFFERENT'}")
             if is_duplicate:
+                # Full record only for the duplicate, whose analysis is returned
+                report = db.get(Report, candidate.id)
                 print(f"   🚨 DUPLICATE FOUND: Same CF + Date + Type + Content as report saved on {report.created_at}")
                 return report, True
         
@@ -209,79 +223,350 @@ def check_duplicate_report(db: Session, meta, extracted_text: str):
         return None, False
 
 
+async def _save_file(f: UploadFile) -> dict:
+    """Stream an upload to storage while hashing it: its bytes are never held in memory."""
+    try:
+        path, digest = await crud.save_upload(f)
+        return {'filename': f.filename, 'file_path': path, 'digest': digest}
+    except Exception as file_error:
+        logger.error(f"Error reading file {f.filename}: {str(file_error)}")
+        return {
+            'filename': f.filename,
+            'error': True,
+            'error_message': f"Errore nella lettura del file: {str(file_error)}"
+        }
+
+async def _parse_file(saved: dict) -> dict:
+    """Extract the metadata of a stored upload (cache or parsing pool)."""
+    if saved.get('error'):
+        return saved
+    filename, path = saved['filename'], saved['file_path']
+    logger.info(f"Extracting metadata from: {filename}")
+    
+    try:
+        meta = await parse_stored_pdf(path, saved['digest'])
+        full_text = meta["full_text"]
+        logger.info(f"Extracted from {filename}: CF={meta.get('codice_fiscale', 'None')}, Date={meta.get('report_date', 'None')}")
+        
+        return {
+            'filename': filename,
+            'file_path': path,
+            'metadata': meta,
+            'full_text': full_text
+        }
+        
+    except Exception as pdf_error:
+        crud.delete_pdf(path)
+        logger.error(f"Error extracting PDF metadata from {filename}: {str(pdf_error)}")
+        logger.error(traceback.format_exc())
+        # Add error result immediately
+        return {
+            'filename': filename,
+            'error': True,
+            'error_message': f"Errore nell'elaborazione del PDF: {str(pdf_error)}"
+        }
+
+async def _ingest_file(f: UploadFile) -> dict:
+    """Stream an upload to storage and extract its metadata."""
+    return await _parse_file(await _save_file(f))
+
+def _report_sort_date(file_data):
+    try:
+        date_str = file_data['metadata'].get('report_date')
+        if date_str:
+            # Parse date to ensure proper sorting
+            date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
+            for fmt in date_formats:
+                try:
+                    return datetime.strptime(date_str, fmt)
+                except ValueError:
+                    continue
+        # If no valid date, use current time
+        return datetime.utcnow()
+    except:
+        return datetime.utcnow()
+
+def _run_ai_analysis(meta, full_text, on_token=None) -> dict:
+    """
+    Run AI analysis - choose appropriate method based on report type and values (blocking).
+    on_token, if given, receives the model output as it is generated.
+    """
+    lab_values = meta.get('laboratory_values', {})
+    
+    if lab_values and len(lab_values) > 0:
+        logger.info(f"Laboratory report detected with {len(lab_values)} values - using specialized analysis")
+        from core.ai_engine import analyze_laboratory_report
+        ai = analyze_laboratory_report(meta, on_token=on_token)
+    else:
+        logger.info("Standard medical report - using general text analysis")
+        ai = analyze_text_with_medgemma(full_text, on_token=on_token)
+        
+    logger.info(f"AI analysis complete: {ai.get('classification', 'Unknown')}")
+    
+    # Debug: Check if diagnosis contains comparison words that should be in comparison section
+    diagnosis_text = ai.get('diagnosis', '')
+    comparison_words = ['miglioramento', 'peggioramento', 'precedente', 'controllo', 'rispetto', 'confronto']
+    has_comparison = any(word in diagnosis_text.lower() for word in comparison_words)
+    if has_comparison:
+        logger.warning(f"⚠️ AI diagnosis contains comparison words: {diagnosis_text[:100]}...")
+    else:
+        logger.info(f"✅ AI diagnosis is clean (no comparison text): {diagnosis_text[:100]}...")
+    return ai
+
+def _store_analysis(db: Session, file_info: dict, ai: dict) -> dict:
+    """
+    Save an analyzed report (duplicate check, DB record) and build its result
+    (blocking, runs in the DB stage). Sets file_info['stored'] once a DB record
+    references the stored PDF, and file_info['comparison'] to (report id or None,
+    model call) when the comparison with the previous report is still to be run.
+    """
+    filename = file_info['filename']
+    meta = file_info['metadata']
+    full_text = file_info['full_text']
+    
+    # Check if Codice Fiscale was found anywhere in the document
+    codice_fiscale = meta.get("codice_fiscale")
+    logger.info(f"🔍 CF extraction result for {filename}: '{codice_fiscale}'")
+    
+    if not codice_fiscale:
+        logger.warning(f"⚠️ No Codice Fiscale found in report {filename} - report will NOT be saved")
+        
+        # Get the exact report title
+        report_type = meta.get("report_type")
+        logger.info(f"Using report title: {report_type}")
+        
+        # Try to compare with latest report of the same title (for unsaved reports);
+        # the model call runs afterwards in the LLM stage (see _save_and_compare)
+        try:
+            logger.info(f"Attempting to compare with previous reports with title '{report_type}'")
+            loaded = load_title_only_comparison(db, report_type)
+            if loaded is not None:
+                file_info['comparison'] = (None, partial(compare_title_only, loaded, full_text))
+                release_connection(db)
+        except Exception as e:
+            logger.error(f"Error in comparison: {str(e)}")
+        
+        # Create response object for unsaved report
+        return {
+            "salvato"            : False,
+            "messaggio"          : "Codice Fiscale assente – referto analizzato ma NON salvato.",
+            "diagnosi_ai"        : ai["diagnosis"],
+            "classificazione_ai" : ai["classification"],
+            "codice_fiscale"     : None,
+            "tipo_referto"       : report_type,
+            "nome_file"          : filename,
+            "nome_paziente"      : meta.get("patient_name"),
+            "data_referto"       : meta.get("report_date")
+        }
+
+    # Process report with Codice Fiscale - always save if CF is found
+    logger.info(f"✅ Codice Fiscale found: {codice_fiscale} - proceeding to save report")
+    try:
+        # Normalize date format
+        try:
+            if meta["report_date"]:
+                # Support various date formats (dd/mm/yyyy, dd-mm-yyyy, etc)
+                parsed_date = None
+                date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
+                
+                for fmt in date_formats:
+                    try:
+                        parsed_date = datetime.strptime(meta["report_date"], fmt)
+                        break
+                    except ValueError:
+                        continue
+                        
+                report_dt = parsed_date if parsed_date else datetime.utcnow()
+            else:
+                report_dt = datetime.utcnow()
+        except Exception as e:
+            logger.warning(f"⚠️ Date parsing error: {e}")
+            report_dt = datetime.utcnow()
+
+        # The PDF is already in storage (streamed during ingestion)
+        path = file_info['file_path']
+        
+        # Get report title and category from metadata
+        report_type = meta["report_type"]
+        report_category = meta.get("report_category", "laboratory")
+        logger.info(f"Using report title for database storage: {report_type} (category: {report_category})")
+        
+        # *** CHECK FOR DUPLICATE REPORTS BEFORE SAVING ***
+        logger.info(f"Checking for duplicate reports")
+        # Create a proper meta dict for duplicate checking
+        check_meta = {
+            'report_type': report_type,
+            'codice_fiscale': codice_fiscale,
+            'report_date': report_dt  # Add report date for duplicate checking
+        }
+        duplicate_report, is_duplicate = check_duplicate_report(db, check_meta, full_text)
+        
+        if is_duplicate and duplicate_report:
+            logger.info(f"Duplicate report detected - ID: {duplicate_report.id}")
+            result_obj = {
+                "salvato"            : False,
+                "messaggio"          : f"Errore nel salvataggio del referto: Documento già presente nel database (salvato il {duplicate_report.created_at.strftime('%d/%m/%Y %H:%M')}), ma risultati analisi forniti",
+                "status"             : "duplicate",
+                "diagnosi_ai"        : duplicate_report.ai_diagnosis,
+                "classificazione_ai" : duplicate_report.ai_classification,
+                "codice_fiscale"     : codice_fiscale,
+                "tipo_referto"       : report_type,
+                "nome_file"          : filename,
+                "nome_paziente"      : meta.get("patient_name"),
+                "data_referto"       : meta.get("report_date"),
+                "original_save_date" : duplicate_report.created_at.strftime('%d/%m/%Y %H:%M')
+            }
+            
+            # Add comparison if exists
+            if duplicate_report.comparison_to_previous:
+                result_obj["situazione"] = duplicate_report.comparison_to_previous
+                result_obj["spiegazione"] = duplicate_report.comparison_explanation
+            
+            return result_obj  # Skip to next file without saving
+        
+        # *** IMPORTANT: Check for previous reports BEFORE saving the new one ***
+        # The two latest are enough: with the new report they give the pair to compare
+        logger.info(f"Looking for previous reports before saving new one")
+        previous_reports = crud.get_latest_reports_by_title(db, codice_fiscale, report_type, limit=2)
+        
+        try:
+            rec = crud.create_report(
+                db               = db,
+                patient_cf       = codice_fiscale,
+                patient_name     = meta["patient_name"],
+                report_type      = report_type,
+                report_date      = report_dt,
+                file_path        = path,
+                extracted_text   = full_text,
+                ai_diagnosis     = ai["diagnosis"],
+                ai_classification= ai["classification"],
+                structured_snapshot= dump_snapshot(build_snapshot(meta, ai, full_text)),
+            )
+            logger.info(f"✅ Report saved successfully with ID: {rec.id}")
+            db.commit()  # Ensure commit
+            file_info['stored'] = True
+        except Exception as e:
+            logger.error(f"Error saving report: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
+
+        # Compare with previous report by title (using the pre-fetched reports): the
+        # pair is loaded here, the model call runs afterwards in the LLM stage
+        logger.info(f"Comparing with previous reports")
+        cmp = None
+        try:
+            if previous_reports:
+                logger.info(f"Found previous report, loading it for the comparison")
+                pair = load_latest_pair(previous_reports + [rec])
+                file_info['comparison'] = (rec.id, partial(compare_report_pair, *pair))
+                # The connection is released while the model compares (DB_SESSION_SCOPE=operation)
+                release_connection(db)
+            else:
+                logger.info(f"No previous report found for this patient and report type")
+                cmp = {
+                    "status": "nessun confronto disponibile",
+                    "explanation": "Non esiste un referto precedente con lo stesso titolo per il paziente."
+                }
+                crud.update_report_comparison(db, rec.id, cmp)
+                logger.info(f"Comparison status: {cmp['status']}")
+        except Exception as e:
+            logger.error(f"Error in comparison: {str(e)}")
+            logger.error(traceback.format_exc())
+            cmp = {
+                "status": "errore",
+                "explanation": f"Errore nella comparazione: {str(e)}"
+            }
+
+        result_obj = {
+            "salvato"            : True,
+            "messaggio"          : "Referto salvato con successo.",
+            "report_id"          : str(rec.id),
+            "diagnosi_ai"        : ai["diagnosis"],
+            "classificazione_ai" : ai["classification"],
+            "codice_fiscale"     : codice_fiscale,
+            "nome_paziente"      : meta["patient_name"],
+            "tipo_referto"       : meta["report_type"],
+            "data_referto"       : meta["report_date"],
+        }
+        if cmp is not None:
+            result_obj["situazione"] = cmp["status"]
+            result_obj["spiegazione"] = cmp["explanation"]
+        logger.info(f"✅ Added result to response: salvato=True, CF={codice_fiscale}")
+        return result_obj
+    
+    
+    except Exception as save_error:
+        logger.error(f"❌ Error saving report with CF {codice_fiscale}: {str(save_error)}")
+        logger.error(traceback.format_exc())
+        result_obj = {
+            "salvato": False,
+            "messaggio": f"Errore nel salvataggio del referto: {str(save_error)}",
+            "diagnosi_ai": ai["diagnosis"],
+            "classificazione_ai": ai["classification"],
+            "codice_fiscale": codice_fiscale,
+            "nome_paziente": meta.get("patient_name"),
+            "tipo_referto": meta.get("report_type"),
+            "data_referto": meta.get("report_date"),
+        }
+        logger.info(f"⚠️ Added error result to response: salvato=False, CF={codice_fiscale}")
+        return result_obj
+
+async def _save_and_compare(db: Session, file_info: dict, ai: dict) -> dict:
+    """
+    Save an analyzed report and compare it with the previous one: the database
+    work runs in the DB stage, the comparison model call in the LLM stage.
+    """
+    result = await run_db(_store_analysis, db, file_info, ai)
+    comparison = file_info.pop('comparison', None)
+    if comparison is None:
+        return result
+    
+    report_id, compare = comparison
+    try:
+        cmp = await run_llm(compare)
+        if report_id is not None:
+            await run_db(crud.update_report_comparison, db, report_id, cmp)
+        logger.info(f"Comparison status: {cmp['status']}")
+    except Exception as e:
+        logger.error(f"Error in comparison: {str(e)}")
+        logger.error(traceback.format_exc())
+        cmp = {
+            "status": "errore",
+            "explanation": f"Errore nella comparazione: {str(e)}"
+        }
+    
+    # Without a saved report only an actual comparison is shown (comparison section only)
+    if result.get("salvato") or cmp["status"] not in ["nessun confronto disponibile", "errore"]:
+        result["situazione"] = cmp["status"]
+        result["spiegazione"] = cmp["explanation"]
+    return result
+
+
 @router.post("/", summary="Analizza uno o più referti PDF")
 async def analyze_documents(
     request: Request,
     files: List[UploadFile] = File(...),
-    db=Depends(get_db)
+    db=Depends(get_db),
+    debug: bool = False
 ):
     if not (1 <= len(files) <= 5):
         raise HTTPException(400, "Seleziona da 1 a 5 file PDF.")
     
     logger.info(f"Analyzing {len(files)} file(s)")
     
-    # Step 1: Extract metadata from all files first
-    file_data = []
-    for f in files:
-        logger.info(f"Extracting metadata from: {f.filename}")
-        
-        try:
-            # Read the file
-            file_bytes = await f.read()
-            
-            # Extract metadata and text from PDF
-            try:
-                meta = extract_metadata(file_bytes)
-                full_text = meta["full_text"]
-                logger.info(f"Extracted from {f.filename}: CF={meta.get('codice_fiscale', 'None')}, Date={meta.get('report_date', 'None')}")
-                
-                file_data.append({
-                    'filename': f.filename,
-                    'file_bytes': file_bytes,
-                    'metadata': meta,
-                    'full_text': full_text
-                })
-                
-            except Exception as pdf_error:
-                logger.error(f"Error extracting PDF metadata from {f.filename}: {str(pdf_error)}")
-                logger.error(traceback.format_exc())
-                # Add error result immediately
-                file_data.append({
-                    'filename': f.filename,
-                    'error': True,
-                    'error_message': f"Errore nell'elaborazione del PDF: {str(pdf_error)}"
-                })
-                
-        except Exception as file_error:
-            logger.error(f"Error reading file {f.filename}: {str(file_error)}")
-            file_data.append({
-                'filename': f.filename,
-                'error': True,
-                'error_message': f"Errore nella lettura del file: {str(file_error)}"
-            })
+    # Every model invocation of this request is recorded (and deduplicated) here
+    ledger = start_ledger()
+    
+    # Step 1: Stream all files to storage and extract their metadata concurrently
+    # (parsing runs in the process pool, see core.pipeline)
+    file_data = await asyncio.gather(*(_ingest_file(f) for f in files))
     
     # Step 2: Sort files by report date (chronological order)
     valid_files = [fd for fd in file_data if not fd.get('error', False)]
     error_files = [fd for fd in file_data if fd.get('error', False)]
     
     # Sort valid files by report date
-    def get_sort_date(file_data):
-        try:
-            date_str = file_data['metadata'].get('report_date')
-            if date_str:
-                # Parse date to ensure proper sorting
-                date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
-                for fmt in date_formats:
-                    try:
-                        return datetime.strptime(date_str, fmt)
-                    except ValueError:
-                        continue
-            # If no valid date, use current time
-            return datetime.utcnow()
-        except:
-            return datetime.utcnow()
-    
-    valid_files.sort(key=get_sort_date)
+    valid_files.sort(key=_report_sort_date)
     
     logger.info(f"Processing {len(valid_files)} valid files in chronological order:")
     for i, fd in enumerate(valid_files):
@@ -299,255 +584,187 @@ async def analyze_documents(
             "filename": error_file['filename']
         })
     
-    # Process valid files in chronological order
-    for file_info in valid_files:
-        filename = file_info['filename']
-        file_bytes = file_info['file_bytes']
-        meta = file_info['metadata']
-        full_text = file_info['full_text']
-        
-        logger.info(f"Processing file in chronological order: {filename}")
+    try:
+        # AI analysis of all files runs concurrently (it does not depend on the
+        # other reports of the batch); an exception is kept as that file's result
+        ai_results = await asyncio.gather(
+            *(run_llm(_run_ai_analysis, fi['metadata'], fi['full_text']) for fi in valid_files),
+            return_exceptions=True
+        )
         
-        try:
-            # Run AI analysis - choose appropriate method based on report type and values
+        # Process valid files in chronological order: each save completes before the
+        # next file is handled, so comparisons always see the previous reports
+        for file_info, ai in zip(valid_files, ai_results):
+            filename = file_info['filename']
+            meta = file_info['metadata']
+            
+            logger.info(f"Processing file in chronological order: {filename}")
+            
             try:
-                lab_values = meta.get('laboratory_values', {})
-                
-                if lab_values and len(lab_values) > 0:
-                    logger.info(f"Laboratory report detected with {len(lab_values)} values - using specialized analysis")
-                    from core.ai_engine import analyze_laboratory_report
-                    ai = analyze_laboratory_report(meta)
-                else:
-                    logger.info("Using text-based analysis")
-                    ai = analyze_text_with_medgemma(full_text)
-                    logger.info("Standard medical report - using general text analysis")
-                    ai = analyze_text_with_medgemma(full_text)
-                    
-                logger.info(f"AI analysis complete: {ai.get('classification', 'Unknown')}")
+                if isinstance(ai, BaseException):
+                    ai_error = ai
+                    logger.error(f"Error in AI analysis: {str(ai_error)}")
+                    logger.error("".join(traceback.format_exception(ai_error)))
+                    risultati.append({
+                        "salvato": False,
+                        "messaggio": f"Errore nell'analisi AI: {str(ai_error)}",
+                        "filename": filename,
+                        "codice_fiscale": meta.get("codice_fiscale"),
+                        "nome_paziente": meta.get("patient_name"),
+                    })
+                    continue
                 
-                # Debug: Check if diagnosis contains comparison words that should be in comparison section
-                diagnosis_text = ai.get('diagnosis', '')
-                comparison_words = ['miglioramento', 'peggioramento', 'precedente', 'controllo', 'rispetto', 'confronto']
-                has_comparison = any(word in diagnosis_text.lower() for word in comparison_words)
-                if has_comparison:
-                    logger.warning(f"⚠️ AI diagnosis contains comparison words: {diagnosis_text[:100]}...")
-                else:
-                    logger.info(f"✅ AI diagnosis is clean (no comparison text): {diagnosis_text[:100]}...")
-            except Exception as ai_error:
-                logger.error(f"Error in AI analysis: {str(ai_error)}")
+                risultati.append(await _save_and_compare(db, file_info, ai))
+            
+            except Exception as general_error:
+                logger.error(f"General error processing file {filename}: {str(general_error)}")
                 logger.error(traceback.format_exc())
                 risultati.append({
                     "salvato": False,
-                    "messaggio": f"Errore nell'analisi AI: {str(ai_error)}",
-                    "filename": filename,
-                    "codice_fiscale": meta.get("codice_fiscale"),
-                    "nome_paziente": meta.get("patient_name"),
+                    "messaggio": f"Errore generico: {str(general_error)}",
+                    "filename": filename
                 })
-                continue
-                
-            # Check if Codice Fiscale was found anywhere in the document
-            codice_fiscale = meta.get("codice_fiscale")
-            logger.info(f"🔍 CF extraction result for {filename}: '{codice_fiscale}'")
+    finally:
+        # Stored PDFs of reports that were not saved are not referenced by any record
+        for file_info in valid_files:
+            if not file_info.get('stored'):
+                crud.delete_pdf(file_info['file_path'])
             
-            if not codice_fiscale:
-                logger.warning(f"⚠️ No Codice Fiscale found in report {filename} - report will NOT be saved")
-                
-                # Get the exact report title
-                report_type = meta.get("report_type")
-                logger.info(f"Using report title: {report_type}")
-                
-                # Try to compare with latest report of the same title (for unsaved reports)
-                cmp = None
-                try:
-                    logger.info(f"Attempting to compare with previous reports with title '{report_type}'")
-                    cmp = compare_with_latest_report_by_title_only(
-                        db=db,
-                        report_type=report_type,
-                        new_text=full_text
-                    )
-                    logger.info(f"Comparison status: {cmp.get('status', 'unknown')}")
-                except Exception as e:
-                    logger.error(f"Error in comparison: {str(e)}")
-                    cmp = {
-                        "status": "errore",
-                        "explanation": f"Errore nella comparazione: {str(e)}"
-                    }
-                
-                # Create response object for unsaved report
-                result_obj = {
-                    "salvato"            : False,
-                    "messaggio"          : "Codice Fiscale assente – referto analizzato ma NON salvato.",
-                    "diagnosi_ai"        : ai["diagnosis"],
-                    "classificazione_ai" : ai["classification"],
-                    "codice_fiscale"     : None,
-                    "tipo_referto"       : report_type,
-                    "nome_file"          : filename,
-                    "nome_paziente"      : meta.get("patient_name"),
-                    "data_referto"       : meta.get("report_date")
-                }
-                
-                # Add comparison results if available (for comparison section only)
-                if cmp and cmp.get("status") not in ["nessun confronto disponibile", "errore"]:
-                    result_obj["situazione"] = cmp.get("status")
-                    result_obj["spiegazione"] = cmp.get("explanation")
-                
-                risultati.append(result_obj)
-                continue
-
-            # Process report with Codice Fiscale - always save if CF is found
-            logger.info(f"✅ Codice Fiscale found: {codice_fiscale} - proceeding to save report")
-            try:
-                # Normalize date format
-                try:
-                    if meta["report_date"]:
-                        # Support various date formats (dd/mm/yyyy, dd-mm-yyyy, etc)
-                        parsed_date = None
-                        date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
-                        
-                        for fmt in date_formats:
-                            try:
-                                parsed_date = datetime.strptime(meta["report_date"], fmt)
-                                break
-                            except ValueError:
-                                continue
-                                
-                        report_dt = parsed_date if parsed_date else datetime.utcnow()
-                    else:
-                        report_dt = datetime.utcnow()
-                except Exception as e:
-                    logger.warning(f"⚠️ Date parsing error: {e}")
-                    report_dt = datetime.utcnow()
+    # Return all results
+    llm_summary = ledger.summary()
+    logger.info(f"Analysis complete, returning {len(risultati)} results "
+                f"(LLM: {llm_summary['model_calls']} calls, {llm_summary['deduplicated']} deduplicated, "
+                f"{llm_summary['total_latency_ms']} ms)")
+    response = {"risultati": risultati}
+    if debug:
+        response["llm_ledger"] = llm_summary
+    return response
 
-                # Save to disk & DB
-                logger.info(f"Saving PDF to disk and creating DB record")
-                path = crud.save_pdf(filename, file_bytes)
-                
-                # Get report title and category from metadata
-                report_type = meta["report_type"]
-                report_category = meta.get("report_category", "laboratory")
-                logger.info(f"Using report title for database storage: {report_type} (category: {report_category})")
-                
-                # *** CHECK FOR DUPLICATE REPORTS BEFORE SAVING ***
-                logger.info(f"Checking for duplicate reports")
-                # Create a proper meta dict for duplicate checking
-                check_meta = {
-                    'report_type': report_type,
-                    'codice_fiscale': codice_fiscale,
-                    'report_date': report_dt  # Add report date for duplicate checking
-                }
-                duplicate_report, is_duplicate = check_duplicate_report(db, check_meta, full_text)
-                
-                if is_duplicate and duplicate_report:
-                    logger.info(f"Duplicate report detected - ID: {duplicate_report.id}")
-                    result_obj = {
-                        "salvato"            : False,
-                        "messaggio"          : f"Errore nel salvataggio del referto: Documento già presente nel database (salvato il {duplicate_report.created_at.strftime('%d/%m/%Y %H:%M')}), ma risultati analisi forniti",
-                        "status"             : "duplicate",
-                        "diagnosi_ai"        : duplicate_report.ai_diagnosis,
-                        "classificazione_ai" : duplicate_report.ai_classification,
-                        "codice_fiscale"     : codice_fiscale,
-                        "tipo_referto"       : report_type,
-                        "nome_file"          : filename,
-                        "nome_paziente"      : meta.get("patient_name"),
-                        "data_referto"       : meta.get("report_date"),
-                        "original_save_date" : duplicate_report.created_at.strftime('%d/%m/%Y %H:%M')
-                    }
-                    
-                    # Add comparison if exists
-                    if duplicate_report.comparison_to_previous:
-                        result_obj["situazione"] = duplicate_report.comparison_to_previous
-                        result_obj["spiegazione"] = duplicate_report.comparison_explanation
-                    
-                    risultati.append(result_obj)
-                    continue  # Skip to next file without saving
-                
-                # *** IMPORTANT: Check for previous report BEFORE saving the new one ***
-                logger.info(f"Looking for previous reports before saving new one")
-                previous_report_text = crud.get_most_recent_report_text_by_title(db, codice_fiscale, report_type)
-                
-                try:
-                    rec = crud.create_report(
-                        db               = db,
-                        patient_cf       = codice_fiscale,
-                        patient_name     = meta["patient_name"],
-                        report_type      = report_type,
-                        report_date      = report_dt,
-                        file_path        = path,
-                        extracted_text   = full_text,
-                        ai_diagnosis     = ai["diagnosis"],
-                        ai_classification= ai["classification"],
-                    )
-                    logger.info(f"✅ Report saved successfully with ID: {rec.id}")
-                    db.commit()  # Ensure commit
-                except Exception as e:
-                    logger.error(f"Error saving report: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    raise
 
-                # Compare with previous report by title (using pre-fetched text)
-                logger.info(f"Comparing with previous reports")
-                try:
-                    if previous_report_text:
-                        logger.info(f"Found previous report, performing comparison")
-                        from core.comparator import _perform_comparison_chronological
-                        cmp = _perform_comparison_chronological(db, codice_fiscale, report_type, previous_report_text, full_text)
-                    else:
-                        logger.info(f"No previous report found for this patient and report type")
-                        cmp = {
-                            "status": "nessun confronto disponibile",
-                            "explanation": "Non esiste un referto precedente con lo stesso titolo per il paziente."
-                        }
-                    
-                    crud.update_report_comparison(db, rec.id, cmp)
-                    logger.info(f"Comparison status: {cmp['status']}")
-                except Exception as e:
-                    logger.error(f"Error in comparison: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    cmp = {
-                        "status": "errore",
-                        "explanation": f"Errore nella comparazione: {str(e)}"
-                    }
+def _sse(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
 
-                risultati.append({
-                    "salvato"            : True,
-                    "messaggio"          : "Referto salvato con successo.",
-                    "report_id"          : str(rec.id),
-                    "diagnosi_ai"        : ai["diagnosis"],
-                    "classificazione_ai" : ai["classification"],
-                    "codice_fiscale"     : codice_fiscale,
-                    "nome_paziente"      : meta["patient_name"],
-                    "tipo_referto"       : meta["report_type"],
-                    "data_referto"       : meta["report_date"],
-                    "situazione"         : cmp["status"],
-                    "spiegazione"        : cmp["explanation"],
-                })
-                logger.info(f"✅ Added result to response: salvato=True, CF={codice_fiscale}")
-            
-            
-            except Exception as save_error:
-                logger.error(f"❌ Error saving report with CF {codice_fiscale}: {str(save_error)}")
-                logger.error(traceback.format_exc())
-                risultati.append({
+async def _stream_analysis(saved_files: list[dict], emit, debug: bool):
+    """
+    Analyze a batch, reporting progress through emit(event, data) as soon as it
+    is available: metadata per file as it is parsed, diagnosis tokens while the
+    model generates them, then each saved result (with its comparison) in
+    chronological order. Token events carry the raw JSON fragments of the
+    structured model response (progress only); the validated diagnosis is the
+    "diagnosis" event.
+    """
+    ledger = start_ledger()
+    loop = asyncio.get_running_loop()
+    # Sessione propria: la risposta continua dopo la fine dell'handler
+    db = SessionLocal()
+    valid_files: list[dict] = []
+    
+    async def parse(saved):
+        file_info = await _parse_file(saved)
+        if file_info.get('error'):
+            emit("error", {"nome_file": file_info['filename'], "messaggio": file_info['error_message']})
+            return
+        valid_files.append(file_info)
+        meta = {k: v for k, v in file_info['metadata'].items() if k != 'full_text'}
+        emit("metadata", {"nome_file": file_info['filename'], "metadata": meta})
+    
+    def token_sink(filename):
+        # Chiamato dai thread del client LLM
+        return lambda text: loop.call_soon_threadsafe(emit, "token", {"nome_file": filename, "testo": text})
+    
+    async def analyze(file_info):
+        ai = await run_llm(_run_ai_analysis, file_info['metadata'], file_info['full_text'],
+                           token_sink(file_info['filename']))
+        emit("diagnosis", {
+            "nome_file": file_info['filename'],
+            "diagnosi_ai": ai["diagnosis"],
+            "classificazione_ai": ai["classification"],
+        })
+        return ai
+    
+    try:
+        await asyncio.gather(*(parse(saved) for saved in saved_files))
+        valid_files.sort(key=_report_sort_date)
+        
+        # AI analyses run concurrently; each report is saved (and compared) in
+        # chronological order as soon as its own analysis and the earlier saves are done
+        ai_tasks = [asyncio.ensure_future(analyze(fi)) for fi in valid_files]
+        for file_info, ai_task in zip(valid_files, ai_tasks):
+            filename = file_info['filename']
+            try:
+                ai = await ai_task
+            except Exception as ai_error:
+                logger.error(f"Error in AI analysis: {str(ai_error)}")
+                emit("result", {
                     "salvato": False,
-                    "messaggio": f"Errore nel salvataggio del referto: {str(save_error)}",
-                    "diagnosi_ai": ai["diagnosis"],
-                    "classificazione_ai": ai["classification"],
-                    "codice_fiscale": codice_fiscale,
-                    "nome_paziente": meta.get("patient_name"),
-                    "tipo_referto": meta.get("report_type"),
-                    "data_referto": meta.get("report_date"),
+                    "messaggio": f"Errore nell'analisi AI: {str(ai_error)}",
+                    "nome_file": filename,
+                    "codice_fiscale": file_info['metadata'].get("codice_fiscale"),
+                    "nome_paziente": file_info['metadata'].get("patient_name"),
                 })
-                logger.info(f"⚠️ Added error result to response: salvato=False, CF={codice_fiscale}")
+                continue
+            try:
+                result = await _save_and_compare(db, file_info, ai)
+            except Exception as general_error:
+                logger.error(f"General error processing file {filename}: {str(general_error)}")
+                logger.error(traceback.format_exc())
+                result = {"salvato": False, "messaggio": f"Errore generico: {str(general_error)}"}
+            emit("result", {"nome_file": filename, **result})
         
-        except Exception as general_error:
-            logger.error(f"General error processing file {filename}: {str(general_error)}")
-            logger.error(traceback.format_exc())
-            risultati.append({
-                "salvato": False,
-                "messaggio": f"Errore generico: {str(general_error)}",
-                "filename": filename
-            })
-            
-    # Return all results
-    logger.info(f"Analysis complete, returning {len(risultati)} results")
-    return {"risultati": risultati}
+        done = {"file_analizzati": len(valid_files)}
+        if debug:
+            done["llm_ledger"] = ledger.summary()
+        emit("done", done)
+    finally:
+        for file_info in valid_files:
+            if not file_info.get('stored'):
+                crud.delete_pdf(file_info['file_path'])
+        db.close()
+
+@router.post("/stream", summary="Analizza uno o più referti PDF con risultati in streaming (SSE)")
+async def analyze_documents_stream(
+    files: List[UploadFile] = File(...),
+    debug: bool = False
+):
+    """
+    Same analysis as POST /, returned as server-sent events:
+    metadata, token, diagnosis, result (one per file), error, done.
+    Token text is raw model JSON ('{"diagnosis": "...'): show it as progress
+    and display the diagnosis event.
+    """
+    if not (1 <= len(files) <= 5):
+        raise HTTPException(400, "Seleziona da 1 a 5 file PDF.")
+    
+    logger.info(f"Streaming analysis of {len(files)} file(s)")
+    
+    # The uploads are stored before the response starts, the stream only uses the stored files
+    saved_files = await asyncio.gather(*(_save_file(f) for f in files))
+    
+    async def events():
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        
+        async def produce():
+            try:
+                await _stream_analysis(saved_files, lambda event, data: queue.put_nowait(_sse(event, data)), debug)
+            except Exception as e:
+                logger.error(f"Streaming analysis failed: {str(e)}")
+                logger.error(traceback.format_exc())
+                queue.put_nowait(_sse("error", {"messaggio": f"Errore generico: {str(e)}"}))
+            finally:
+                queue.put_nowait(finished)
+        
+        # The batch completes (and its reports are saved) even if the client disconnects
+        producer = asyncio.ensure_future(produce())
+        _stream_tasks.add(producer)
+        producer.add_done_callback(_stream_tasks.discard)
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            yield item
+        await producer
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -7,16 +7,23 @@ from uuid import UUID
 from datetime import datetime
 import os
 
-from core.pdf_parser import extract_metadata
+from core.pipeline import parse_stored_pdf, run_llm, run_db
 from core.ai_engine import analyze_text_with_medgemma
-from core.comparator import compare_with_previous_reports
-from db import crud
-from db.session import get_db
+from core.comparator import load_latest_pair, compare_report_pair
+from core.report_snapshot import build_snapshot, dump_snapshot
+from db import crud, async_crud
+from db.session import get_db, release_connection
+from db.async_session import DB_ASYNC_ENABLED, get_async_db
 from auth.api_auth import get_api_key
 from db.models import Report
+from sqlalchemy.orm import undefer
 
 router = APIRouter()
 
+# Con DB_ASYNC_ENABLED l'analisi, le letture EHR e il feedback usano l'engine
+# asincrono, così le query non bloccano l'event loop
+get_ehr_db = get_async_db if DB_ASYNC_ENABLED else get_db
+
 # ============ Modelli dati per richieste API ============
 
 class PatientQuery(BaseModel):
@@ -49,10 +56,47 @@ class PatientReportDetail(PatientReport):
 
 # ============ Endpoint per integrazione EHR ============
 
+def _report_fields(meta: dict, ai: dict, report_dt: datetime, path: str) -> dict:
+    """Columns of the record of an analyzed report (create_report keyword arguments)."""
+    return dict(
+        patient_cf=meta["codice_fiscale"],
+        patient_name=meta["patient_name"],
+        report_type=meta["report_type"],
+        report_date=report_dt,
+        file_path=path,
+        extracted_text=meta["full_text"],
+        ai_diagnosis=ai["diagnosis"],
+        ai_classification=ai["classification"],
+        structured_snapshot=dump_snapshot(build_snapshot(meta, ai, meta["full_text"])),
+    )
+
+def _save_report(db, meta: dict, ai: dict, report_dt: datetime, path: str):
+    """
+    Save an analyzed report and load the pair of latest reports to compare
+    (blocking, runs in the DB stage). Returns (report id, pair or None).
+    """
+    report = crud.create_report(db=db, **_report_fields(meta, ai, report_dt, path))
+    # Il nuovo referto e il precedente (se esiste) con lo stesso titolo
+    pair = load_latest_pair(crud.get_latest_reports_by_title(db, meta["codice_fiscale"], meta["report_type"], limit=2))
+    # La connessione torna al pool mentre il modello confronta (DB_SESSION_SCOPE=operation)
+    release_connection(db)
+    return report.id, pair
+
+async def _save_report_async(db, meta: dict, ai: dict, report_dt: datetime, path: str):
+    """_save_report on the async engine (DB_ASYNC_ENABLED)."""
+    report = await async_crud.create_report(db, **_report_fields(meta, ai, report_dt, path))
+    # Testo caricato con la query: in asincrono non c'è caricamento lazy
+    latest = await async_crud.get_latest_reports_by_title(db, meta["codice_fiscale"], meta["report_type"],
+                                                          limit=2, with_text=True)
+    pair = load_latest_pair(latest)
+    # Fine della transazione di lettura: la connessione torna al pool durante il confronto
+    await db.commit()
+    return report.id, pair
+
 @router.post("/analyze", summary="Analizza referti PDF da EHR")
 async def ehr_analyze_documents(
     files: List[UploadFile] = File(...),
-    db = Depends(get_db),
+    db = Depends(get_ehr_db),
     api_key: str = Depends(get_api_key)
 ):
     """Endpoint per l'analisi di referti PDF da un sistema EHR esterno.
@@ -61,79 +105,83 @@ async def ehr_analyze_documents(
     if not (1 <= len(files) <= 5):
         raise HTTPException(400, "Seleziona da 1 a 5 file PDF.")
 
-    # Utilizza la stessa logica dell'endpoint pubblico ma con autenticazione
+    # Utilizza la stessa logica dell'endpoint pubblico ma con autenticazione: parsing,
+    # chiamate al modello e accesso al database passano dagli stadi di core/pipeline.py
     risultati = []
     for f in files:
-        file_bytes = await f.read()
-        meta = extract_metadata(file_bytes)
-        full_text = meta["full_text"]
-        ai = analyze_text_with_medgemma(full_text)
+        # Upload salvato in streaming durante l'hashing; rimosso se il referto non viene salvato
+        path, digest = await crud.save_upload(f)
+        saved = False
+        try:
+            meta = await parse_stored_pdf(path, digest)
+            full_text = meta["full_text"]
+            ai = await run_llm(analyze_text_with_medgemma, full_text)
         
-        result = {
-            "diagnosi_ai": ai["diagnosis"],
-            "classificazione_ai": ai["classification"],
-            "codice_fiscale": meta["codice_fiscale"],
-            "nome_paziente": meta["patient_name"],
-            "tipo_referto": meta["report_type"],
-            "data_referto": meta["report_date"],
-        }
+            result = {
+                "diagnosi_ai": ai["diagnosis"],
+                "classificazione_ai": ai["classification"],
+                "codice_fiscale": meta["codice_fiscale"],
+                "nome_paziente": meta["patient_name"],
+                "tipo_referto": meta["report_type"],
+                "data_referto": meta["report_date"],
+            }
         
-        # Se c'è un codice fiscale, salva nel DB e aggiungi confronto
-        if meta["codice_fiscale"]:
-            # Processamento e salvataggio nel DB
-            try:
-                # Normalizzazione data
-                if meta["report_date"]:
-                    parsed_date = None
-                    date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
-                    for fmt in date_formats:
-                        try:
-                            parsed_date = datetime.strptime(meta["report_date"], fmt)
-                            break
-                        except ValueError:
-                            continue
-                    report_dt = parsed_date if parsed_date else datetime.utcnow()
-                else:
-                    report_dt = datetime.utcnow()
+            # Se c'è un codice fiscale, salva nel DB e aggiungi confronto
+            if meta["codice_fiscale"]:
+                # Processamento e salvataggio nel DB
+                try:
+                    # Normalizzazione data
+                    if meta["report_date"]:
+                        parsed_date = None
+                        date_formats = ["%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d"]
+                        for fmt in date_formats:
+                            try:
+                                parsed_date = datetime.strptime(meta["report_date"], fmt)
+                                break
+                            except ValueError:
+                                continue
+                        report_dt = parsed_date if parsed_date else datetime.utcnow()
+                    else:
+                        report_dt = datetime.utcnow()
                     
-                # Salvataggio su DB
-                path = crud.save_pdf(f.filename, file_bytes)
-                report = crud.create_report(
-                    db=db,
-                    patient_cf=meta["codice_fiscale"],
-                    patient_name=meta["patient_name"],
-                    report_type=meta["report_type"],
-                    report_date=report_dt,
-                    file_path=path,
-                    extracted_text=full_text,
-                    ai_diagnosis=ai["diagnosis"],
-                    ai_classification=ai["classification"],
-                )
+                    # Salvataggio su DB
+                    if DB_ASYNC_ENABLED:
+                        report_id, pair = await _save_report_async(db, meta, ai, report_dt, path)
+                    else:
+                        report_id, pair = await run_db(_save_report, db, meta, ai, report_dt, path)
+                    saved = True
                 
-                # Confronto con precedenti
-                cmp = compare_with_previous_reports(
-                    db=db,
-                    patient_cf=meta["codice_fiscale"],
-                    report_type=meta["report_type"],
-                    new_text=full_text,
-                )
-                crud.update_report_comparison(db, report.id, cmp)
+                    # Confronto con precedenti
+                    if pair is None:
+                        cmp = {
+                            "status": "nessun confronto disponibile",
+                            "explanation": "Non esiste un referto precedente con lo stesso titolo per il paziente."
+                        }
+                    else:
+                        cmp = await run_llm(compare_report_pair, *pair)
+                    if DB_ASYNC_ENABLED:
+                        await async_crud.update_report_comparison(db, report_id, cmp)
+                    else:
+                        await run_db(crud.update_report_comparison, db, report_id, cmp)
                 
-                # Aggiunta info al risultato
-                result.update({
-                    "salvato": True,
-                    "report_id": str(report.id),
-                    "situazione": cmp["status"],
-                    "spiegazione": cmp["explanation"]
-                })
+                    # Aggiunta info al risultato
+                    result.update({
+                        "salvato": True,
+                        "report_id": str(report_id),
+                        "situazione": cmp["status"],
+                        "spiegazione": cmp["explanation"]
+                    })
                 
-            except Exception as e:
-                result.update({
-                    "salvato": False,
-                    "errore": str(e)
-                })
-        else:
-            result["salvato"] = False
+                except Exception as e:
+                    result.update({
+                        "salvato": False,
+                        "errore": str(e)
+                    })
+            else:
+                result["salvato"] = False
+        finally:
+            if not saved:
+                crud.delete_pdf(path)
             
         risultati.append(result)
     
@@ -144,7 +192,7 @@ async def ehr_analyze_documents(
 async def get_patient_reports(
     codice_fiscale: str,
     report_type: Optional[str] = None,
-    db = Depends(get_db),
+    db = Depends(get_ehr_db),
     api_key: str = Depends(get_api_key)
 ):
     """Recupera lo storico dei referti di un paziente dal sistema LexiCare.
@@ -154,7 +202,10 @@ async def get_patient_reports(
     """
     # No validation needed since we accept any exact report title
     
-    reports = crud.get_patient_reports(db, codice_fiscale, report_type)
+    if DB_ASYNC_ENABLED:
+        reports = await async_crud.get_patient_reports(db, codice_fiscale, report_type)
+    else:
+        reports = crud.get_patient_reports(db, codice_fiscale, report_type)
     
     if not reports:
         return []
@@ -185,15 +236,18 @@ async def get_patient_reports(
 async def get_patient_report_detail(
     codice_fiscale: str,
     report_id: UUID,
-    db = Depends(get_db),
+    db = Depends(get_ehr_db),
     api_key: str = Depends(get_api_key)
 ):
     """Recupera il dettaglio completo di un singolo referto, incluso il testo estratto."""
     
-    report = db.query(Report).filter(
-        Report.id == report_id,
-        Report.patient_cf == codice_fiscale
-    ).first()
+    if DB_ASYNC_ENABLED:
+        report = await async_crud.get_patient_report(db, codice_fiscale, report_id)
+    else:
+        report = db.query(Report).options(undefer(Report.extracted_text), undefer(Report.comparison_explanation)).filter(
+            Report.id == report_id,
+            Report.patient_cf == codice_fiscale
+        ).first()
     
     if not report:
         raise HTTPException(
@@ -222,17 +276,20 @@ async def get_patient_report_detail(
 @router.post("/feedback", summary="Invia feedback del medico da EHR")
 async def submit_ehr_feedback(
     feedback: FeedbackData,
-    db = Depends(get_db),
+    db = Depends(get_ehr_db),
     api_key: str = Depends(get_api_key)
 ):
     """Consente al sistema EHR di inviare feedback dei medici."""
-    success = crud.save_feedback(
-        db=db,
+    correction = dict(
         report_id=feedback.report_id,
         correct_diagnosis=feedback.diagnosi_corretta,
         correct_classification=feedback.classificazione_corretta,
         comment=feedback.commento
     )
+    if DB_ASYNC_ENABLED:
+        success = await async_crud.save_feedback(db=db, **correction)
+    else:
+        success = crud.save_feedback(db=db, **correction)
     
     if not success:
         raise HTTPException(status_code=404, detail="Referto non trovato.")
@@ -1,9 +1,14 @@
 # backend/core/ai_engine.py
 
-import ollama
 import os
-import json
 import logging
+from collections import Counter
+from threading import Lock
+
+from core.llm_client import OLLAMA_BASE_URL
+from core.structured_output import generate_structured, Diagnosis, StructuredOutputError
+from core.prompt_builder import build_report_context
+from core.lab_delta import within_reference
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -11,10 +16,36 @@ logger = logging.getLogger(__name__)
 
 # Get configuration from environment variables
 MODEL_NAME = os.getenv("OLLAMA_MODEL", "alibayram/medgemma")
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 
-# Configure Ollama client
-ollama.api_base_url = OLLAMA_BASE_URL
+# Versioni dei template di prompt (chiave della cache LLM): incrementarle quando
+# cambia il testo di un prompt o il modo in cui se ne interpreta la risposta
+TEXT_ANALYSIS_TEMPLATE = "text_analysis:v2"
+LAB_ANALYSIS_TEMPLATE = "laboratory_analysis:v2"
+RADIOLOGY_ANALYSIS_TEMPLATE = "radiology_analysis:v2"
+
+# Triage dei referti di laboratorio: se tutti i valori sono nei limiti di riferimento
+# la diagnosi è deterministica e il modello non viene chiamato
+LAB_TRIAGE_ENABLED = os.getenv("LAB_TRIAGE_ENABLED", "True").lower() == "true"
+
+# Percorso seguito dall'analisi di laboratorio (campo "analysis_path" del risultato)
+PATH_TRIAGE, PATH_LLM, PATH_FALLBACK = "triage", "llm", "fallback"
+
+_analysis_paths = Counter()
+_analysis_paths_lock = Lock()
+
+def _record_path(path: str) -> str:
+    with _analysis_paths_lock:
+        _analysis_paths[path] += 1
+    return path
+
+def analysis_path_metrics() -> dict:
+    """How many laboratory analyses took each path in this process."""
+    with _analysis_paths_lock:
+        return dict(_analysis_paths)
+
+def triage_normal_panel(lab_values: dict, abnormal_values: list) -> bool:
+    """True if the panel can be answered without the model: no abnormal value and every value within range."""
+    return LAB_TRIAGE_ENABLED and not abnormal_values and all(within_reference(d) for d in lab_values.values())
 
 def get_test_specific_prompt(report_type: str, lab_data: str, abnormal_values: list) -> str:
     """Generate test-specific prompts that restrict AI analysis to appropriate clinical scope"""
@@ -215,9 +246,12 @@ IMPORTANTE: Includi i valori specifici alterati nella diagnosi quando appropriat
 Rispondi in JSON: {{"diagnosis": "diagnosi appropriata per {report_type} con valori", "classification": "lieve|moderato|grave"}}
 """
 
-def analyze_text_with_medgemma(report_text: str) -> dict:
+def analyze_text_with_medgemma(report_text: str, on_token=None) -> dict:
     """Invia testo a MedGemma tramite Ollama (Python lib) e restituisce diagnosi e classificazione."""
 
+    # Testo senza intestazioni amministrative, entro il budget di token del template
+    report_text = build_report_context(report_text, TEXT_ANALYSIS_TEMPLATE)
+
     prompt = f"""
 Sei un medico esperto. Analizza il seguente referto medico italiano e estrai SOLO la diagnosi medica definitiva.
 
@@ -258,81 +292,45 @@ Rispondi ESCLUSIVAMENTE in questo formato JSON:
 
     try:
         logger.info(f"Sending request to Ollama at {OLLAMA_BASE_URL}")
-        response = ollama.generate(model=MODEL_NAME, prompt=prompt)
-        result = response["response"].strip()
+        parsed = generate_structured("generate", MODEL_NAME, prompt, Diagnosis, TEXT_ANALYSIS_TEMPLATE,
+                                     on_token=on_token)
+        parsed_result = parsed.model_dump()
+        diagnosis = parsed.diagnosis
+        classification = parsed.classification
         
-        logger.info(f"Received response from model: {result[:100]}...")
+        logger.info(f"Received diagnosis from model: {diagnosis[:100]}...")
         
-        # Clean the result - remove markdown code fences if present
-        cleaned_result = result
-        if "```json" in cleaned_result:
-            cleaned_result = cleaned_result.replace("```json", "").replace("```", "").strip()
-        elif "```" in cleaned_result:
-            # Handle other code fence formats
-            parts = cleaned_result.split("```")
-            if len(parts) >= 2:
-                cleaned_result = parts[1].strip()
-                if cleaned_result.startswith("json"):
-                    cleaned_result = cleaned_result[4:].strip()
+        # Check if diagnosis looks like symptoms/signs rather than actual diagnosis
+        symptom_keywords = ["dolore", "febbre", "dispnea", "nausea", "vomito", "cefalea", "astenia", "malessere"]
+        sign_keywords = ["ipertensione", "tachicardia", "bradicardia", "tachipnea", "cianosi"]
+        exam_keywords = ["radiografia", "ecografia", "tac", "risonanza", "elettrocardiogramma", "ecocardiografia"]
         
-        # Remove any leading/trailing whitespace that might affect JSON parsing
-        cleaned_result = cleaned_result.strip()
-                
-        # Try to parse the response as JSON
-        try:
-            # First try with json.loads for safety
-            logger.info(f"Attempting to parse JSON: {cleaned_result[:100]}...")
-            parsed_result = json.loads(cleaned_result)
-            
-            # Validate the diagnosis quality
-            diagnosis = parsed_result.get("diagnosis", "").strip()
-            classification = parsed_result.get("classification", "").strip()
-            
-            # Check if diagnosis looks like symptoms/signs rather than actual diagnosis
-            symptom_keywords = ["dolore", "febbre", "dispnea", "nausea", "vomito", "cefalea", "astenia", "malessere"]
-            sign_keywords = ["ipertensione", "tachicardia", "bradicardia", "tachipnea", "cianosi"]
-            exam_keywords = ["radiografia", "ecografia", "tac", "risonanza", "elettrocardiogramma", "ecocardiografia"]
-            
-            diagnosis_lower = diagnosis.lower()
-            
-            # Warn if diagnosis might be symptoms/signs instead of actual diagnosis
-            if any(keyword in diagnosis_lower for keyword in symptom_keywords):
-                logger.warning(f"⚠️ Diagnosis might contain symptoms: {diagnosis}")
-            elif any(keyword in diagnosis_lower for keyword in sign_keywords):
-                logger.warning(f"⚠️ Diagnosis might contain clinical signs: {diagnosis}")
-            elif any(keyword in diagnosis_lower for keyword in exam_keywords):
-                logger.warning(f"⚠️ Diagnosis might contain exam type: {diagnosis}")
-            else:
-                logger.info(f"✅ Diagnosis looks appropriate: {diagnosis}")
-            
-            # Validate classification
-            valid_classifications = ["lieve", "moderato", "grave"]
-            if classification not in valid_classifications:
-                logger.warning(f"⚠️ Invalid classification '{classification}', defaulting to 'moderato'")
-                parsed_result["classification"] = "moderato"
-            
-            return parsed_result
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}")
-            # Fall back to eval if JSON parsing fails
-            # This is less safe but might handle some formatting issues
-            try:
-                # Try to extract just the JSON part if there's surrounding text
-                import re
-                json_match = re.search(r'\{.*\}', cleaned_result, re.DOTALL)
-                if json_match:
-                    json_str = json_match.group(0)
-                    parsed_result = json.loads(json_str)
-                    return parsed_result
-                else:
-                    raise ValueError("No JSON object found in response")
-            except Exception as parse_error:
-                logger.error(f"Failed to parse model response: {str(parse_error)}")
-                return {
-                    "diagnosis": "Errore nel formato della risposta",
-                    "classification": "non disponibile",
-                    "errore": f"Errore di parsing: {str(parse_error)}"
-                }
+        diagnosis_lower = diagnosis.lower()
+        
+        # Warn if diagnosis might be symptoms/signs instead of actual diagnosis
+        if any(keyword in diagnosis_lower for keyword in symptom_keywords):
+            logger.warning(f"⚠️ Diagnosis might contain symptoms: {diagnosis}")
+        elif any(keyword in diagnosis_lower for keyword in sign_keywords):
+            logger.warning(f"⚠️ Diagnosis might contain clinical signs: {diagnosis}")
+        elif any(keyword in diagnosis_lower for keyword in exam_keywords):
+            logger.warning(f"⚠️ Diagnosis might contain exam type: {diagnosis}")
+        else:
+            logger.info(f"✅ Diagnosis looks appropriate: {diagnosis}")
+        
+        # Validate classification
+        valid_classifications = ["lieve", "moderato", "grave"]
+        if classification not in valid_classifications:
+            logger.warning(f"⚠️ Invalid classification '{classification}', defaulting to 'moderato'")
+            parsed_result["classification"] = "moderato"
+        
+        return parsed_result
+    except StructuredOutputError as parse_error:
+        logger.error(f"Failed to parse model response: {str(parse_error)}")
+        return {
+            "diagnosis": "Errore nel formato della risposta",
+            "classification": "non disponibile",
+            "errore": f"Errore di parsing: {str(parse_error)}"
+        }
     except Exception as e:
         logger.error(f"Error communicating with Ollama: {str(e)}")
         return {
@@ -341,7 +339,7 @@ Rispondi ESCLUSIVAMENTE in questo formato JSON:
             "errore": str(e)
         }
 
-def analyze_laboratory_report(metadata: dict) -> dict:
+def analyze_laboratory_report(metadata: dict, on_token=None) -> dict:
     """Analizza specificamente referti di laboratorio con restrizioni per tipo di test."""
     
     patient_name = metadata.get('patient_name', 'Paziente non identificato')
@@ -354,10 +352,10 @@ def analyze_laboratory_report(metadata: dict) -> dict:
     # Handle different report types appropriately
     if report_category == 'radiology':
         logger.info(f"🏥 Analyzing radiology report: {report_type}")
-        return analyze_radiology_report(metadata)
+        return analyze_radiology_report(metadata, on_token=on_token)
     elif report_category == 'pathology':
         logger.info(f"🔬 Analyzing pathology report: {report_type}")
-        return analyze_pathology_report(metadata)
+        return analyze_pathology_report(metadata, on_token=on_token)
     
     # Continue with laboratory analysis for laboratory reports
     if not lab_values:
@@ -413,36 +411,29 @@ def analyze_laboratory_report(metadata: dict) -> dict:
                 abnormal_flag = " *ALTERATO*" if abnormal else ""
                 lab_text += f"- {test_name}: {value} {unit} (rif: {reference}){abnormal_flag}\n"
         
+        # Pannello nella norma: stessa risposta del fallback, senza chiamare il modello
+        if triage_normal_panel(lab_values, abnormal_values):
+            logger.info(f"⚡ Laboratory triage: all {len(lab_values)} values within range, skipping the model")
+            return {
+                "diagnosis": create_value_specific_diagnosis(report_type, abnormal_values, lab_values),
+                "classification": "lieve",
+                "laboratory_values": lab_values,
+                "abnormal_count": 0,
+                "test_type": report_type,
+                "analysis_path": _record_path(PATH_TRIAGE)
+            }
+        
         # Generate test-specific prompt that restricts analysis scope
         try:
             prompt = get_test_specific_prompt(report_type, lab_text, abnormal_values)
             logger.info(f"Generated prompt for {report_type}, abnormal values: {len(abnormal_values)}")
             
             # Send to AI with test-specific restrictions
-            response = ollama.chat(
-                model=MODEL_NAME,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            
-            response_text = response['message']['content'].strip()
-            logger.info(f"🤖 AI response received, length: {len(response_text)} chars")
-            
-            # Try to parse JSON response
             try:
-                # Clean the response
-                cleaned_result = response_text
-                if "```json" in cleaned_result:
-                    cleaned_result = cleaned_result.replace("```json", "").replace("```", "").strip()
-                elif "```" in cleaned_result:
-                    parts = cleaned_result.split("```")
-                    if len(parts) >= 2:
-                        cleaned_result = parts[1].strip()
-                        if cleaned_result.startswith("json"):
-                            cleaned_result = cleaned_result[4:].strip()
-                
-                parsed_result = json.loads(cleaned_result.strip())
-                diagnosis = parsed_result.get('diagnosis', 'Diagnosi non disponibile')
-                classification = parsed_result.get('classification', 'moderato')
+                parsed = generate_structured("chat", MODEL_NAME, prompt, Diagnosis, LAB_ANALYSIS_TEMPLATE,
+                                             on_token=on_token)
+                diagnosis = parsed.diagnosis
+                classification = parsed.classification
                 
                 # Validate classification
                 valid_classifications = ["lieve", "moderato", "grave"]
@@ -461,12 +452,12 @@ def analyze_laboratory_report(metadata: dict) -> dict:
                     "classification": classification,
                     "laboratory_values": lab_values,
                     "abnormal_count": len(abnormal_values),
-                    "test_type": report_type
+                    "test_type": report_type,
+                    "analysis_path": _record_path(PATH_LLM)
                 }
                 
-            except json.JSONDecodeError as e:
+            except StructuredOutputError as e:
                 logger.warning(f"Failed to parse JSON response: {str(e)}")
-                logger.warning(f"Raw response: {response_text[:200]}...")
                 
                 # Fallback: Create diagnosis based on abnormal values
                 fallback_diagnosis = create_fallback_diagnosis(report_type, abnormal_values)
@@ -478,7 +469,8 @@ def analyze_laboratory_report(metadata: dict) -> dict:
                     "classification": classification,
                     "laboratory_values": lab_values,
                     "abnormal_count": len(abnormal_values),
-                    "note": "Analisi fallback (JSON parsing failed)"
+                    "note": "Analisi fallback (JSON parsing failed)",
+                    "analysis_path": _record_path(PATH_FALLBACK)
                 }
                 
         except Exception as ai_error:
@@ -494,7 +486,8 @@ def analyze_laboratory_report(metadata: dict) -> dict:
                 "classification": classification,
                 "laboratory_values": lab_values,
                 "abnormal_count": len(abnormal_values),
-                "note": "Analisi automatica (AI non disponibile)"
+                "note": "Analisi automatica (AI non disponibile)",
+                "analysis_path": _record_path(PATH_FALLBACK)
             }
                 
     except Exception as e:
@@ -510,14 +503,16 @@ def analyze_laboratory_report(metadata: dict) -> dict:
                     "diagnosis": f"Alterazioni rilevate in {abnormal_count} parametri di laboratorio - controllo medico consigliato",
                     "classification": "moderato",
                     "laboratory_values": lab_values,
-                    "abnormal_count": abnormal_count
+                    "abnormal_count": abnormal_count,
+                    "analysis_path": _record_path(PATH_FALLBACK)
                 }
             else:
                 return {
                     "diagnosis": "Parametri di laboratorio nei limiti della norma",
                     "classification": "lieve",
                     "laboratory_values": lab_values,
-                    "abnormal_count": 0
+                    "abnormal_count": 0,
+                    "analysis_path": _record_path(PATH_FALLBACK)
                 }
         except:
             return {
@@ -716,7 +711,7 @@ def validate_diagnosis_scope(diagnosis: str, report_type: str) -> tuple[str, boo
     
     return diagnosis, False
 
-def analyze_radiology_report(metadata: dict) -> dict:
+def analyze_radiology_report(metadata: dict, on_token=None) -> dict:
     """Analyze radiology reports using text-based AI analysis with specific findings integration."""
     
     full_text = metadata.get('full_text', '')
@@ -783,13 +778,15 @@ def analyze_radiology_report(metadata: dict) -> dict:
     logger.info(f"Found {len(abnormal_findings)} abnormal findings with {len(specific_measurements)} measurements")
     
     # Enhanced AI prompt for radiology with specific findings integration
+    # (findings are extracted above from the full text, the prompt gets the budgeted one)
+    report_context = build_report_context(full_text, RADIOLOGY_ANALYSIS_TEMPLATE)
     enhanced_prompt = f"""
 Sei un medico radiologo esperto. Analizza il seguente referto radiologico e fornisci una diagnosi specifica.
 
 IMPORTANTE - Includi nei risultati le misure e i reperti specifici trovati nel referto:
 
 REFERTO RADIOLOGICO:
-{full_text}
+{report_context}
 
 REPERTI ANOMALI IDENTIFICATI: {', '.join(abnormal_findings[:5]) if abnormal_findings else 'Nessuno'}
 MISURAZIONI SPECIFICHE: {', '.join(specific_measurements[:3]) if specific_measurements else 'Nessune'}
@@ -810,66 +807,45 @@ Rispondi ESCLUSIVAMENTE in questo formato JSON:
     
     try:
         # Send enhanced prompt to AI
-        response = ollama.chat(
-            model=MODEL_NAME,
-            messages=[{"role": "user", "content": enhanced_prompt}]
-        )
+        parsed = generate_structured("chat", MODEL_NAME, enhanced_prompt, Diagnosis, RADIOLOGY_ANALYSIS_TEMPLATE,
+                                     on_token=on_token)
+        diagnosis = parsed.diagnosis
+        classification = parsed.classification
         
-        response_text = response['message']['content'].strip()
-        logger.info(f"🤖 AI response received for radiology, length: {len(response_text)} chars")
+        # Validate classification
+        valid_classifications = ["lieve", "moderato", "grave"]
+        if classification not in valid_classifications:
+            logger.warning(f"Invalid classification '{classification}', defaulting to 'moderato'")
+            classification = "moderato"
         
-        # Parse JSON response
-        try:
-            # Clean the response
-            cleaned_result = response_text
-            if "```json" in cleaned_result:
-                cleaned_result = cleaned_result.replace("```json", "").replace("```", "").strip()
-            elif "```" in cleaned_result:
-                parts = cleaned_result.split("```")
-                if len(parts) >= 2:
-                    cleaned_result = parts[1].strip()
-                    if cleaned_result.startswith("json"):
-                        cleaned_result = cleaned_result[4:].strip()
-            
-            parsed_result = json.loads(cleaned_result.strip())
-            diagnosis = parsed_result.get('diagnosis', 'Diagnosi radiologica non disponibile')
-            classification = parsed_result.get('classification', 'moderato')
-            
-            # Validate classification
-            valid_classifications = ["lieve", "moderato", "grave"]
-            if classification not in valid_classifications:
-                logger.warning(f"Invalid classification '{classification}', defaulting to 'moderato'")
-                classification = "moderato"
-            
-            # Enhance diagnosis with specific findings if AI didn't include them
-            enhanced_diagnosis = enhance_radiology_diagnosis_with_findings(diagnosis, abnormal_findings, specific_measurements)
-            
-            logger.info(f"✅ Radiology analysis complete: {enhanced_diagnosis}")
-            return {
-                "diagnosis": enhanced_diagnosis,
-                "classification": classification,
-                "abnormal_findings": abnormal_findings,
-                "specific_measurements": specific_measurements,
-                "report_type": report_type
-            }
-            
-        except json.JSONDecodeError as e:
-            logger.warning(f"Failed to parse JSON response: {str(e)}")
-            logger.warning(f"Raw response: {response_text[:200]}...")
-            
-            # Fallback: Create diagnosis based on findings
-            fallback_diagnosis = create_radiology_fallback_diagnosis(abnormal_findings, specific_measurements)
-            classification = "moderato" if abnormal_findings else "lieve"
+        # Enhance diagnosis with specific findings if AI didn't include them
+        enhanced_diagnosis = enhance_radiology_diagnosis_with_findings(diagnosis, abnormal_findings, specific_measurements)
+        
+        logger.info(f"✅ Radiology analysis complete: {enhanced_diagnosis}")
+        return {
+            "diagnosis": enhanced_diagnosis,
+            "classification": classification,
+            "abnormal_findings": abnormal_findings,
+            "specific_measurements": specific_measurements,
+            "report_type": report_type
+        }
+        
+    except StructuredOutputError as e:
+        logger.warning(f"Failed to parse JSON response: {str(e)}")
+        
+        # Fallback: Create diagnosis based on findings
+        fallback_diagnosis = create_radiology_fallback_diagnosis(abnormal_findings, specific_measurements)
+        classification = "moderato" if abnormal_findings else "lieve"
+        
+        logger.info(f"🔄 Using fallback radiology diagnosis: {fallback_diagnosis}")
+        return {
+            "diagnosis": fallback_diagnosis,
+            "classification": classification,
+            "abnormal_findings": abnormal_findings,
+            "specific_measurements": specific_measurements,
+            "note": "Analisi fallback (JSON parsing failed)"
+        }
             
-            logger.info(f"🔄 Using fallback radiology diagnosis: {fallback_diagnosis}")
-            return {
-                "diagnosis": fallback_diagnosis,
-                "classification": classification,
-                "abnormal_findings": abnormal_findings,
-                "specific_measurements": specific_measurements,
-                "note": "Analisi fallback (JSON parsing failed)"
-            }
-                
     except Exception as ai_error:
         logger.error(f"AI communication error for radiology: {str(ai_error)}")
         
@@ -976,7 +952,7 @@ def create_radiology_fallback_diagnosis(abnormal_findings: list, specific_measur
     else:
         return f"Alterazioni radiologiche rilevate ({len(abnormal_findings)} reperti)"
 
-def analyze_pathology_report(metadata: dict) -> dict:
+def analyze_pathology_report(metadata: dict, on_token=None) -> dict:
     """Analyze pathology reports using text-based AI analysis."""
     
     full_text = metadata.get('full_text', '')
@@ -992,4 +968,4 @@ def analyze_pathology_report(metadata: dict) -> dict:
     logger.info(f"🔬 Analyzing pathology report with {len(full_text)} characters")
     
     # Use general text analysis for pathology reports
-    return analyze_text_with_medgemma(full_text)
+    return analyze_text_with_medgemma(full_text, on_token=on_token)
@@ -3,8 +3,11 @@
 # Confronta l'ultimo referto salvato con quello nuovo usando MedGemma
 # e restituisce { "status": ..., "explanation": ... }
 
-import json, os
-import ollama
+import os
+from core.structured_output import generate_structured, Comparison, Explanation, StructuredOutputError
+from core.prompt_builder import build_comparison_context
+from core.lab_delta import compare_lab_reports, compare_lab_values, summarize_lab_changes
+from core.report_snapshot import load_snapshot, compare_measurements
 from db import crud
 import logging
 
@@ -12,6 +15,64 @@ logger = logging.getLogger(__name__)
 
 MODEL_NAME = os.getenv("OLLAMA_MODEL", "alibayram/medgemma")
 
+# Versione del template di prompt del confronto (chiave della cache LLM)
+COMPARISON_TEMPLATE = "comparison:v2"
+LAB_EXPLANATION_TEMPLATE = "lab_comparison_explanation:v1"
+SNAPSHOT_COMPARISON_TEMPLATE = "snapshot_comparison:v1"
+
+# Confronto dei referti di laboratorio:
+#   hybrid - esito calcolato sui valori, il modello scrive solo la spiegazione
+#   fast   - esito e spiegazione calcolati sui valori, nessuna chiamata al modello
+#   llm    - il modello confronta i testi completi (comportamento precedente)
+LAB_COMPARISON_MODE = os.getenv("LAB_COMPARISON_MODE", "hybrid").lower()
+
+def chronological_key(report):
+    """Sort key of the chronological order used by crud (report date, upload time, id)."""
+    return (report.report_date, report.created_at, report.id)
+
+def load_latest_pair(reports: list) -> tuple[dict, dict] | None:
+    """
+    Data of the two chronologically latest of the given reports (older, newer) that
+    compare_report_pair needs, or None if there are fewer than two. Reads the deferred
+    columns, so it belongs to the DB stage.
+    """
+    if len(reports) < 2:
+        return None
+    older_report, newer_report = sorted(reports, key=chronological_key)[-2:]
+    
+    print(f"🔍 Chronological Analysis:")
+    print(f"   📅 Older Report Date: {older_report.report_date}")
+    print(f"   📅 Newer Report Date: {newer_report.report_date}")
+    
+    return tuple(
+        {"snapshot": load_snapshot(report.structured_snapshot), "text": report.extracted_text}
+        for report in (older_report, newer_report)
+    )
+
+def compare_report_pair(older: dict, newer: dict) -> dict:
+    """Compare a pair loaded by load_latest_pair (older -> newer); no database access."""
+    # Snapshot strutturati salvati con i referti: il confronto dei testi è il ripiego
+    if older["snapshot"] and newer["snapshot"]:
+        result = _perform_snapshot_comparison(older["snapshot"], newer["snapshot"])
+        if result is not None:
+            return result
+    
+    # Always compare in chronological order: older report -> newer report
+    # This ensures we get "increased from X to Y" when values go from X (older) to Y (newer)
+    return _perform_comparison(older["text"], newer["text"])
+
+def compare_latest_reports(reports: list, release=None) -> dict | None:
+    """
+    Compare the two chronologically latest of the given reports (older -> newer),
+    or return None if there are fewer than two. release, if given, is called once
+    the reports' data is loaded and before any model call (see db.session.release_connection).
+    """
+    pair = load_latest_pair(reports)
+    if pair is None:
+        return None
+    (release or (lambda: None))()
+    return compare_report_pair(*pair)
+
 def _perform_comparison_chronological(db, patient_cf: str, report_type: str, previous_text: str, new_text: str) -> dict:
     """
     Perform chronological comparison ensuring proper temporal order.
@@ -19,40 +80,164 @@ def _perform_comparison_chronological(db, patient_cf: str, report_type: str, pre
     compares them in the correct temporal sequence.
     """
     from db import crud
+    from db.session import release_connection
     
     try:
-        # Get all reports for this patient and report type to determine chronological order
-        all_reports = crud.get_chronological_reports_by_title(db, patient_cf, report_type)
-        
-        if len(all_reports) < 2:
+        # Only the two most recent reports are needed (LIMIT query, not the whole history)
+        result = compare_latest_reports(crud.get_latest_reports_by_title(db, patient_cf, report_type, limit=2),
+                                        release=lambda: release_connection(db))
+        if result is None:
             return _perform_comparison(previous_text, new_text)
-        
-        # Get the two most recent reports (chronologically)
-        older_report = all_reports[-2]  # Second to last (older)  
-        newer_report = all_reports[-1]  # Last (newer)
-        
-        print(f"🔍 Chronological Analysis:")
-        print(f"   📅 Older Report Date: {older_report.report_date}")
-        print(f"   📅 Newer Report Date: {newer_report.report_date}")
-        
-        # Always compare in chronological order: older report -> newer report
-        # This ensures we get "increased from X to Y" when values go from X (older) to Y (newer)
-        return _perform_comparison(older_report.extracted_text, newer_report.extracted_text)
+        return result
             
     except Exception as e:
         print(f"⚠️ Chronological comparison error: {e}, falling back to simple comparison")
         return _perform_comparison(previous_text, new_text)
 
+def _lab_comparison_result(lab: dict) -> dict:
+    """Deterministic lab comparison, with the explanation phrased by the model in hybrid mode."""
+    if LAB_COMPARISON_MODE == "hybrid":
+        try:
+            lab["explanation"] = _explain_lab_comparison(lab)
+        except Exception as exc:
+            print(f"⚠️ AI explanation error: {exc}, using computed explanation")
+    return lab
+
+def _perform_snapshot_comparison(previous: dict, new: dict) -> dict | None:
+    """
+    Compare two stored structured snapshots (older -> newer). Returns None when
+    they cannot be compared, so that the caller falls back to the report texts.
+    """
+    both_laboratory = previous.get("report_category") == new.get("report_category") == "laboratory"
+    if both_laboratory and previous.get("laboratory_values") and new.get("laboratory_values"):
+        if LAB_COMPARISON_MODE not in ("hybrid", "fast"):
+            return None
+        lab = summarize_lab_changes(compare_lab_values(previous["laboratory_values"], new["laboratory_values"]))
+        return _lab_comparison_result(lab) if lab is not None else None
+
+    if not previous.get("diagnosis") or not new.get("diagnosis"):
+        return None
+    measurement_changes = compare_measurements(previous.get("measurements") or {}, new.get("measurements") or {})
+    return _compare_diagnoses(previous, new, measurement_changes)
+
+def _describe_snapshot(snapshot: dict) -> str:
+    lines = [f"Diagnosi: {snapshot['diagnosis']}", f"Classificazione: {snapshot.get('classification') or 'n.d.'}"]
+    if snapshot.get("findings"):
+        lines.append("Reperti: " + "; ".join(snapshot["findings"]))
+    if snapshot.get("measurements"):
+        lines.append("Misure: " + ", ".join(f"{name} {m['value']:g} {m['unit']}"
+                                            for name, m in snapshot["measurements"].items()))
+    return "\n".join(lines)
+
+def _compare_diagnoses(previous: dict, new: dict, measurement_changes: list[dict]) -> dict:
+    """Model comparison of two snapshots (diagnosis, findings, measurements), with a rule-based fallback."""
+    changes = "\n".join(f"- {c['name']}: {c['previous']} -> {c['current']} ({c['trend']})"
+                         for c in measurement_changes) or "Nessuna misura confrontabile"
+    prompt = f"""
+Sei un assistente clinico esperto. Hai la sintesi strutturata di due referti dello stesso paziente,
+in ordine cronologico.
+
+• Referto precedente:
+{_describe_snapshot(previous)}
+
+• Referto attuale:
+{_describe_snapshot(new)}
+
+Variazioni delle misure:
+{changes}
+
+Confrontali e indica se la situazione clinica è:
+- "peggiorata"
+- "migliorata"
+- "invariata"
+
+Nell'explanation, spiega brevemente QUALI SPECIFICHE DIFFERENZE hai trovato, citando le misure cambiate.
+
+Rispondi ESCLUSIVAMENTE in JSON nel seguente formato:
+{{
+  "status": "peggiorata | migliorata | invariata",
+  "explanation": "Breve paragrafo che spiega le specifiche differenze trovate tra i due referti"
+}}
+"""
+    try:
+        parsed = generate_structured("generate", MODEL_NAME, prompt, Comparison, SNAPSHOT_COMPARISON_TEMPLATE)
+        return {
+            "status": parsed.status or "non determinato",
+            "explanation": parsed.explanation or "Spiegazione non fornita dall'AI."
+        }
+    except Exception as exc:
+        print(f"⚠️ AI error: {exc}, using snapshot fallback")
+        return _fallback_snapshot_comparison(previous, new, measurement_changes)
+
+_SEVERITY = {"lieve": 1, "moderato": 2, "grave": 3}
+
+def _fallback_snapshot_comparison(previous: dict, new: dict, measurement_changes: list[dict]) -> dict:
+    """Rule-based comparison of two snapshots when the model is not available."""
+    old_severity = _SEVERITY.get((previous.get("classification") or "").lower())
+    new_severity = _SEVERITY.get((new.get("classification") or "").lower())
+    changed = [c for c in measurement_changes if c["trend"] != "invariata"]
+    details = "; ".join(f"{c['name']} da {c['previous']} a {c['current']}" for c in changed)
+
+    if old_severity and new_severity and old_severity != new_severity:
+        status = "peggiorata" if new_severity > old_severity else "migliorata"
+        explanation = (f"La gravità è passata da {previous['classification']} a {new['classification']}"
+                       + (f" ({details})." if details else "."))
+    elif details:
+        # Senza il modello non si può dire se la variazione delle misure sia clinicamente rilevante
+        status = "non determinato"
+        explanation = f"Gravità invariata; misure variate: {details}."
+    else:
+        status = "invariata"
+        explanation = "Non sono evidenti cambiamenti significativi tra i due referti."
+    return {"status": status, "explanation": explanation}
+
+def _explain_lab_comparison(lab: dict) -> str:
+    """Have the model phrase the explanation of a deterministic lab comparison."""
+    changed = [c for c in lab["lab_changes"] if c["trend"] != "invariato"] or lab["lab_changes"]
+    lines = "\n".join(
+        f"- {c['test']}: {c['previous']} -> {c['current']} {c['unit']} (rif. {c['reference'] or 'n.d.'}), {c['trend']}"
+        for c in changed[:10]
+    )
+    prompt = f"""
+Sei un assistente clinico esperto. Il confronto tra due referti di laboratorio dello stesso paziente
+ha stabilito che la situazione clinica è: "{lab['status']}".
+
+Variazioni dei parametri (valore precedente -> valore attuale, intervallo di riferimento):
+{lines}
+
+Scrivi una breve spiegazione (2-3 frasi) per il medico che motivi questo esito citando i valori.
+Non cambiare l'esito e non citare parametri non elencati.
+
+Rispondi ESCLUSIVAMENTE in JSON nel seguente formato:
+{{
+  "explanation": "Breve paragrafo con le differenze specifiche tra i due referti"
+}}
+"""
+    return generate_structured("generate", MODEL_NAME, prompt, Explanation, LAB_EXPLANATION_TEMPLATE).explanation
+
 def _perform_comparison(previous_text: str, new_text: str) -> dict:
     """Internal helper function to perform the actual comparison using AI"""
+    # Referti di laboratorio: esito deterministico sui valori estratti
+    if LAB_COMPARISON_MODE in ("hybrid", "fast"):
+        try:
+            lab = compare_lab_reports(previous_text, new_text)
+        except Exception as exc:
+            print(f"⚠️ Lab delta comparison error: {exc}, using AI comparison")
+            lab = None
+        if lab is not None:
+            return _lab_comparison_result(lab)
+
+    # Entrambi i referti senza intestazioni amministrative, entro il budget del confronto
+    previous_context, new_context = build_comparison_context(previous_text, new_text, COMPARISON_TEMPLATE)
+
     prompt = f"""
 Sei un assistente clinico esperto. Hai due referti medici in italiano dello stesso paziente:
 
 • Referto precedente:
-\"\"\"{previous_text}\"\"\"
+\"\"\"{previous_context}\"\"\"
 
 • Referto attuale:
-\"\"\"{new_text}\"\"\"
+\"\"\"{new_context}\"\"\"
 
 Confrontali e indica se la situazione clinica è:
 - "peggiorata"
@@ -69,23 +254,15 @@ Rispondi ESCLUSIVAMENTE in JSON nel seguente formato:
 """
 
     try:
-        llm_resp = ollama.generate(model=MODEL_NAME, prompt=prompt)
-        content  = llm_resp["response"].strip()
-
-        # Check if response is empty or invalid
-        if not content:
-            print(f"⚠️ AI returned empty response, using fallback analysis")
-            return _fallback_comparison(previous_text, new_text)
-
-        # tenta di parse-are il JSON restituito
-        parsed = json.loads(content)
+        # JSON vincolato dallo schema, con un tentativo di riparazione se non valido
+        parsed = generate_structured("generate", MODEL_NAME, prompt, Comparison, COMPARISON_TEMPLATE)
 
         return {
-            "status": parsed.get("status", "non determinato"),
-            "explanation": parsed.get("explanation", "Spiegazione non fornita dall'AI.")
+            "status": parsed.status or "non determinato",
+            "explanation": parsed.explanation or "Spiegazione non fornita dall'AI."
         }
 
-    except json.JSONDecodeError as je:
+    except StructuredOutputError as je:
         print(f"⚠️ AI returned invalid JSON: {je}, using fallback analysis")
         return _fallback_comparison(previous_text, new_text)
     except Exception as exc:
@@ -179,20 +356,46 @@ def compare_with_previous_report_by_title(db, patient_cf: str, report_type: str,
 
     return _perform_comparison_chronological(db, patient_cf, report_type, previous, new_text)
 
-def compare_with_latest_report_by_title_only(db, report_type: str, new_text: str) -> dict:
+def load_title_only_comparison(db, report_type: str) -> dict | None:
     """
-    Cerca l'ultimo referto con lo stesso titolo esatto (indipendentemente dal paziente),
-    poi chiede a MedGemma di dire se il caso è peggiorato / miglioramento / invariato.
-    Utile per documenti senza Codice Fiscale.
-    Se non trova un referto precedente → status = 'nessun confronto disponibile'.
+    Database part of compare_with_latest_report_by_title_only: the latest text with
+    the same title and, when available, the loaded pair of the latest reports
+    without CF. None if there is no previous report.
     """
     previous = crud.get_most_recent_report_text_by_title_only(db, report_type)
-    
     if not previous:
+        return None
+    try:
+        # For reports without CF, we use empty string as patient_cf and get report_type as title
+        pair = load_latest_pair(crud.get_latest_reports_by_title(db, "", report_type, limit=2))
+    except Exception as e:
+        print(f"⚠️ Chronological comparison error: {e}, falling back to simple comparison")
+        pair = None
+    return {"previous_text": previous, "pair": pair}
+
+def compare_title_only(loaded: dict | None, new_text: str) -> dict:
+    """Model part of compare_with_latest_report_by_title_only (no database access)."""
+    if loaded is None:
         return {
             "status": "nessun confronto disponibile",
             "explanation": "Non esiste un referto precedente con lo stesso titolo."
         }
-        
-    # For reports without CF, we use empty string as patient_cf and get report_type as title
-    return _perform_comparison_chronological(db, "", report_type, previous, new_text)
+    if loaded["pair"]:
+        try:
+            return compare_report_pair(*loaded["pair"])
+        except Exception as e:
+            print(f"⚠️ Chronological comparison error: {e}, falling back to simple comparison")
+    return _perform_comparison(loaded["previous_text"], new_text)
+
+def compare_with_latest_report_by_title_only(db, report_type: str, new_text: str) -> dict:
+    """
+    Cerca l'ultimo referto con lo stesso titolo esatto (indipendentemente dal paziente),
+    poi chiede a MedGemma di dire se il caso è peggiorato / miglioramento / invariato.
+    Utile per documenti senza Codice Fiscale.
+    Se non trova un referto precedente → status = 'nessun confronto disponibile'.
+    """
+    from db.session import release_connection
+    
+    loaded = load_title_only_comparison(db, report_type)
+    release_connection(db)
+    return compare_title_only(loaded, new_text)
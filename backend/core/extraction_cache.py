@@ -0,0 +1,69 @@
+# backend/core/extraction_cache.py
+#
+# Cache dell'output di extract_metadata indicizzata per SHA-256 del PDF:
+# i ricaricamenti dello stesso file saltano completamente parsing e OCR.
+
+import os
+import logging
+
+from core.pdf_parser import extract_metadata_from_file, PARSER_VERSION, OCR_MODE
+from core.ocr_engine import OCR_DPI, OCR_LANG
+from core.sqlite_cache import SQLiteCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "True").lower() == "true"
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", "backend/cache/extraction_cache.db")
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "256"))
+
+# Modalità, risoluzione e lingua dell'OCR cambiano il testo estratto: fanno parte della versione
+_cache = SQLiteCache(
+    path=EXTRACTION_CACHE_PATH,
+    max_bytes=EXTRACTION_CACHE_MAX_MB * 1024 * 1024,
+    version=f"{PARSER_VERSION}-{OCR_MODE}-{OCR_DPI}-{OCR_LANG}",
+)
+
+
+def get_cached_metadata(digest: str) -> dict | None:
+    """Cached extract_metadata output for a PDF digest, or None on a miss."""
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    try:
+        cached = _cache.get(digest)
+    except Exception as e:
+        logger.error(f"Extraction cache read error: {str(e)}")
+        return None
+    if cached is not None:
+        logger.info(f"✅ Extraction cache hit for {digest[:12]}, skipping PDF parsing")
+    return cached
+
+
+def store_cached_metadata(digest: str, meta: dict) -> None:
+    """Cache a parsing result, unless its OCR failed or timed out on some page."""
+    if not EXTRACTION_CACHE_ENABLED:
+        return
+    if meta.get("ocr_failed_pages"):
+        logger.warning(f"⚠️ OCR incomplete for {digest[:12]} (pages {meta['ocr_failed_pages']}), not caching")
+        return
+    try:
+        _cache.set(digest, meta)
+    except Exception as e:
+        logger.error(f"Extraction cache write error: {str(e)}")
+
+
+def extract_metadata_cached_from_file(path: str, digest: str) -> dict:
+    """
+    Cached extract_metadata for a PDF already stored on disk, whose SHA-256 was
+    computed while it was being written. On a miss the file is parsed via mmap.
+    """
+    if not EXTRACTION_CACHE_ENABLED:
+        return extract_metadata_from_file(path)
+    cached = get_cached_metadata(digest)
+    if cached is not None:
+        return cached
+    meta = extract_metadata_from_file(path)
+    store_cached_metadata(digest, meta)
+    return meta
@@ -0,0 +1,219 @@
+# backend/core/lab_delta.py
+#
+# Confronto deterministico di due referti di laboratorio: i valori estratti da
+# extract_laboratory_values vengono allineati per nome dell'analita e unità,
+# e per ognuno si misura quanto il valore è fuori dall'intervallo di
+# riferimento prima e dopo. Lo stato complessivo (peggiorata / migliorata /
+# invariata) deriva da queste variazioni, senza chiamare il modello.
+
+import re
+import logging
+
+from core.pdf_parser import extract_laboratory_values, classify_report_type
+
+logger = logging.getLogger(__name__)
+
+# Variazione minima della distanza dal range (in ampiezze del range) considerata significativa
+DEVIATION_TOLERANCE = 0.05
+
+NORMAL_QUALITATIVE = {"ASSENTE", "ASSENTI", "NEGATIVO", "NEGATIVI", "NORMALE", "ASSENZA"}
+ABNORMAL_QUALITATIVE = {"POSITIVO", "POSITIVI", "PRESENTE", "PRESENTI", "ALTERATO", "ALTO", "BASSO",
+                        "TORBIDO", "VELATO"}
+
+# Numero massimo di analiti descritti nella spiegazione
+MAX_EXPLAINED_CHANGES = 6
+
+_NUMBER_RE = re.compile(r"^-?\d+(?:[.,]\d+)?$")
+_RANGE_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*[-–]\s*(\d+(?:[.,]\d+)?)")
+_UPPER_BOUND_RE = re.compile(r"^\s*(?:<|≤|<=|fino a)\s*(\d+(?:[.,]\d+)?)", re.IGNORECASE)
+_LOWER_BOUND_RE = re.compile(r"^\s*(?:>|≥|>=)\s*(\d+(?:[.,]\d+)?)")
+
+TREND_WORSE, TREND_BETTER, TREND_SAME = "peggiorato", "migliorato", "invariato"
+
+
+def _to_float(value) -> float | None:
+    text = str(value).strip()
+    if not _NUMBER_RE.match(text):
+        return None
+    return float(text.replace(",", "."))
+
+
+def parse_reference(reference: str) -> tuple[float | None, float | None] | None:
+    """(low, high) bounds of a reference range string, or None if it is not numeric."""
+    if not reference:
+        return None
+    ranges = _RANGE_RE.findall(reference)
+    if ranges:
+        # L'ultimo intervallo della stringa è quello di riferimento ("creatinina: 0,9 mg/dl (0.5 - 1.2)")
+        low, high = (float(x.replace(",", ".")) for x in ranges[-1])
+        return (min(low, high), max(low, high))
+    match = _UPPER_BOUND_RE.match(reference)
+    if match:
+        return (None, float(match.group(1).replace(",", ".")))
+    match = _LOWER_BOUND_RE.match(reference)
+    if match:
+        return (float(match.group(1).replace(",", ".")), None)
+    return None
+
+
+def deviation(value: float, bounds: tuple[float | None, float | None]) -> float:
+    """Distance of value outside the range, in range widths (0 inside the range)."""
+    low, high = bounds
+    if low is not None and high is not None and high > low:
+        width = high - low
+    else:
+        width = abs(high if high is not None else low) or 1.0
+    if low is not None and value < low:
+        return (low - value) / width
+    if high is not None and value > high:
+        return (value - high) / width
+    return 0.0
+
+
+def within_reference(data: dict) -> bool:
+    """
+    True if an extracted value is normal: a numeric value must be inside its
+    reference range (without a parseable range it cannot be judged normal); a
+    qualitative value must not be flagged abnormal nor contain abnormal terms.
+    """
+    value = _to_float(data.get("value"))
+    bounds = parse_reference(str(data.get("reference") or ""))
+    if value is not None and bounds is not None:
+        return deviation(value, bounds) == 0.0 and not data.get("abnormal", False)
+    if data.get("abnormal", False):
+        return False
+    if value is not None:
+        # Valore numerico senza intervallo di riferimento: lo valuta il modello
+        return False
+    # Valore qualitativo senza asterisco: normale solo se non contiene termini patologici
+    return not (set(re.findall(r"[A-Z]+", str(data.get("value", "")).upper())) & ABNORMAL_QUALITATIVE)
+
+
+def _normalize_unit(unit: str) -> str:
+    return (unit or "").replace(" ", "").lower()
+
+
+def _is_normal_qualitative(data: dict) -> bool:
+    value = str(data.get("value", "")).strip().upper()
+    reference = str(data.get("reference", "")).strip().upper()
+    if value in NORMAL_QUALITATIVE or (reference and value == reference):
+        return True
+    return not data.get("abnormal", False)
+
+
+def _compare_analyte(name: str, old: dict, new: dict) -> dict | None:
+    old_unit, new_unit = _normalize_unit(old.get("unit")), _normalize_unit(new.get("unit"))
+    # Unità diverse non sono confrontabili (un'unità mancante è un limite dell'estrazione)
+    if old_unit and new_unit and old_unit != new_unit:
+        return None
+
+    change = {
+        "test": name,
+        "unit": new.get("unit") or old.get("unit") or "",
+        "previous": old.get("value"),
+        "current": new.get("value"),
+        "reference": new.get("reference") or old.get("reference") or "",
+    }
+    old_value, new_value = _to_float(old.get("value")), _to_float(new.get("value"))
+
+    if old_value is not None and new_value is not None:
+        change["delta"] = round(new_value - old_value, 4)
+        bounds = parse_reference(change["reference"])
+        if bounds is not None:
+            old_dev, new_dev = deviation(old_value, bounds), deviation(new_value, bounds)
+            change["deviation_change"] = round(new_dev - old_dev, 4)
+            if new_dev - old_dev > DEVIATION_TOLERANCE:
+                change["trend"] = TREND_WORSE
+            elif old_dev - new_dev > DEVIATION_TOLERANCE:
+                change["trend"] = TREND_BETTER
+            else:
+                change["trend"] = TREND_SAME
+            return change
+        old_normal, new_normal = not old.get("abnormal", False), not new.get("abnormal", False)
+    elif old_value is None and new_value is None:
+        old_normal, new_normal = _is_normal_qualitative(old), _is_normal_qualitative(new)
+    else:
+        # Un valore numerico e uno qualitativo: nessun confronto affidabile
+        return None
+
+    if old_normal and not new_normal:
+        change["trend"] = TREND_WORSE
+    elif new_normal and not old_normal:
+        change["trend"] = TREND_BETTER
+    else:
+        change["trend"] = TREND_SAME
+    return change
+
+
+def compare_lab_values(previous: dict, current: dict) -> list[dict]:
+    """Per-analyte changes between two extract_laboratory_values results, aligned by name and unit."""
+    previous_by_name = {name.strip().upper(): data for name, data in previous.items()}
+    changes = []
+    for name, data in current.items():
+        old = previous_by_name.get(name.strip().upper())
+        if old is None:
+            continue
+        change = _compare_analyte(name, old, data)
+        if change is not None:
+            changes.append(change)
+    return changes
+
+
+def overall_status(changes: list[dict]) -> str:
+    """peggiorata / migliorata / invariata from the per-analyte trends."""
+    worse = sum(1 for c in changes if c["trend"] == TREND_WORSE)
+    better = sum(1 for c in changes if c["trend"] == TREND_BETTER)
+    if worse != better:
+        return "peggiorata" if worse > better else "migliorata"
+    if worse == 0:
+        return "invariata"
+    # Pari numero di analiti peggiorati e migliorati: decide l'entità complessiva
+    total = sum(c.get("deviation_change", 0.0) for c in changes if c["trend"] != TREND_SAME)
+    if abs(total) <= DEVIATION_TOLERANCE:
+        return "invariata"
+    return "peggiorata" if total > 0 else "migliorata"
+
+
+def _describe(change: dict) -> str:
+    unit = f" {change['unit']}" if change["unit"] else ""
+    reference = f" (rif. {change['reference']})" if change["reference"] else ""
+    return f"{change['test']} {change['trend']}: da {change['previous']} a {change['current']}{unit}{reference}"
+
+
+def explain_changes(status: str, changes: list[dict]) -> str:
+    """Deterministic Italian explanation of the changes."""
+    changed = [c for c in changes if c["trend"] != TREND_SAME]
+    if not changed:
+        return (f"Situazione invariata: nessuna variazione significativa rispetto ai valori di "
+                f"riferimento nei parametri confrontabili ({len(changes)}).")
+    # Prima i peggioramenti, poi i miglioramenti, ciascuno in ordine di entità
+    changed.sort(key=lambda c: (c["trend"] != TREND_WORSE, -abs(c.get("deviation_change", 1.0))))
+    parts = [_describe(c) for c in changed[:MAX_EXPLAINED_CHANGES]]
+    if len(changed) > MAX_EXPLAINED_CHANGES:
+        parts.append(f"altri {len(changed) - MAX_EXPLAINED_CHANGES} parametri variati")
+    unchanged = len(changes) - len(changed)
+    explanation = f"Situazione {status}. " + "; ".join(parts) + "."
+    if unchanged:
+        explanation += f" Parametri confrontabili invariati: {unchanged}."
+    return explanation
+
+
+def compare_lab_reports(previous_text: str, new_text: str) -> dict | None:
+    """
+    Deterministic comparison of two laboratory reports:
+    {"status", "explanation", "lab_changes"}, or None when the texts are not both
+    laboratory reports or share no comparable analytes.
+    """
+    if classify_report_type(previous_text) != "laboratory" or classify_report_type(new_text) != "laboratory":
+        return None
+    return summarize_lab_changes(
+        compare_lab_values(extract_laboratory_values(previous_text), extract_laboratory_values(new_text)))
+
+
+def summarize_lab_changes(changes: list[dict]) -> dict | None:
+    """{"status", "explanation", "lab_changes"} for compare_lab_values output, None if it is empty."""
+    if not changes:
+        return None
+    status = overall_status(changes)
+    logger.info(f"🧮 Deterministic lab comparison: {status} over {len(changes)} analytes")
+    return {"status": status, "explanation": explain_changes(status, changes), "lab_changes": changes}
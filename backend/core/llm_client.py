@@ -0,0 +1,225 @@
+# backend/core/llm_client.py
+#
+# Client Ollama condiviso: un unico ollama.AsyncClient (connessioni keep-alive)
+# su un event loop dedicato in background, usato da tutti i thread del processo.
+#   - semaforo globale dimensionato sul parallelismo del server (OLLAMA_MAX_PARALLEL)
+#   - scadenza per chiamata (attesa in coda + tentativi, OLLAMA_CALL_DEADLINE_SECONDS)
+#   - nuovi tentativi limitati con backoff esponenziale e jitter (OLLAMA_MAX_RETRIES)
+#   - metriche sulla coda (chiamate in attesa, in corso, picco, errori)
+#   - streaming opzionale dei token (on_chunk), con la risposta completa alla fine
+
+import os
+import random
+import asyncio
+import logging
+import threading
+import time
+
+import httpx
+import ollama
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+# Deve corrispondere a OLLAMA_NUM_PARALLEL del server Ollama
+OLLAMA_MAX_PARALLEL = int(os.getenv("OLLAMA_MAX_PARALLEL", "2"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "10"))
+OLLAMA_CALL_DEADLINE_SECONDS = float(os.getenv("OLLAMA_CALL_DEADLINE_SECONDS", "300"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BASE_SECONDS = float(os.getenv("OLLAMA_RETRY_BASE_SECONDS", "1.0"))
+# Per quanto il server tiene il modello in memoria dopo ogni chiamata ("" = default del server)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Stati HTTP per cui ha senso riprovare (server sovraccarico o non pronto)
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call did not complete within its deadline (queueing and retries included)."""
+
+
+def _chunk_text(method: str, part) -> str:
+    return (part["message"]["content"] if method == "chat" else part["response"]) or ""
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code in RETRYABLE_STATUS
+    return isinstance(error, (ConnectionError, httpx.TransportError, asyncio.TimeoutError))
+
+
+class OllamaPool:
+    """Process-wide pooled AsyncClient with a concurrency cap, deadlines and retries."""
+
+    def __init__(self, host: str, max_parallel: int, max_connections: int, deadline: float,
+                 max_retries: int, retry_base: float):
+        self.host = host
+        self.max_parallel = max(1, max_parallel)
+        self.max_connections = max(self.max_parallel, max_connections)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self._waiting = 0
+        self._active = 0
+        self._stats = {"calls": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0, "max_queue_depth": 0}
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Dopo un fork il thread del loop non esiste più nel figlio
+            if self._loop is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._reset_metrics()
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="ollama-client", daemon=True).start()
+                self._client = None
+                self._semaphore = None
+            return self._loop
+
+    def _get_client(self) -> ollama.AsyncClient:
+        # Creati nel thread del loop, al primo uso
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = ollama.AsyncClient(host=self.host, limits=limits)
+            self._semaphore = asyncio.Semaphore(self.max_parallel)
+            logger.info(f"🔌 Ollama client pool ready for {self.host} (max {self.max_parallel} parallel calls)")
+        return self._client
+
+    def metrics(self) -> dict:
+        """Snapshot of the queue and call counters of this process."""
+        with self._lock:
+            return {"waiting": self._waiting, "active": self._active,
+                    "max_parallel": self.max_parallel, **self._stats}
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._stats[name] += delta
+
+    async def _stream(self, client, method: str, kwargs: dict, on_chunk, emitted: list):
+        """Stream a call, passing each text chunk to on_chunk; returns the assembled response."""
+        parts, last = [], None
+        async for part in await getattr(client, method)(stream=True, **kwargs):
+            text = _chunk_text(method, part)
+            if text:
+                parts.append(text)
+                emitted[0] = True
+                on_chunk(text)
+            last = part
+        text = "".join(parts)
+        response = {"message": {"role": "assistant", "content": text}} if method == "chat" else {"response": text}
+        for field in ("prompt_eval_count", "eval_count"):
+            response[field] = last[field] if last is not None else None
+        return response
+
+    async def _call(self, method: str, kwargs: dict, deadline: float, on_chunk=None):
+        client = self._get_client()
+        expires = time.monotonic() + deadline
+        attempt = 0
+        emitted = [False]
+        while True:
+            with self._lock:
+                self._waiting += 1
+                self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._waiting)
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=max(0.0, expires - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded(f"Ollama {method} still queued after {deadline:.0f}s") from None
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+            with self._lock:
+                self._active += 1
+            try:
+                remaining = expires - time.monotonic()
+                if on_chunk is not None:
+                    call = self._stream(client, method, kwargs, on_chunk, emitted)
+                else:
+                    call = getattr(client, method)(**kwargs)
+                return await asyncio.wait_for(call, timeout=max(0.0, remaining))
+            except Exception as e:
+                error = e
+            finally:
+                with self._lock:
+                    self._active -= 1
+                self._semaphore.release()
+
+            # Backoff esponenziale con jitter completo, senza superare la scadenza;
+            # uno stream già iniziato non si ripete (i token sono già stati inviati)
+            delay = random.uniform(0, self.retry_base * 2 ** attempt)
+            if (not _is_retryable(error) or emitted[0] or attempt >= self.max_retries
+                    or time.monotonic() + delay >= expires):
+                if isinstance(error, asyncio.TimeoutError):
+                    raise LLMDeadlineExceeded(f"Ollama {method} did not answer within {deadline:.0f}s") from None
+                raise error
+            attempt += 1
+            self._count("retries")
+            logger.warning(f"⚠️ Ollama {method} failed ({type(error).__name__}: {error}), "
+                           f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _tracked_call(self, method: str, kwargs: dict, deadline: float, on_chunk=None):
+        self._count("calls")
+        try:
+            return await self._call(method, kwargs, deadline, on_chunk)
+        except LLMDeadlineExceeded:
+            self._count("deadline_exceeded")
+            raise
+        except Exception:
+            self._count("failures")
+            raise
+
+    def request(self, method: str, deadline: float = None, on_chunk=None, **kwargs):
+        """
+        Run an AsyncClient method (generate, chat) from any thread and wait for its result.
+        With on_chunk the call is streamed: on_chunk receives each text chunk (in the
+        client's loop thread) and the assembled response is returned.
+        """
+        return self._submit(method, deadline, on_chunk, kwargs).result()
+
+    async def arequest(self, method: str, deadline: float = None, **kwargs):
+        """request() for coroutines running on another event loop; cancelling it cancels the call."""
+        return await asyncio.wrap_future(self._submit(method, deadline, None, kwargs))
+
+    def _submit(self, method: str, deadline: float, on_chunk, kwargs: dict):
+        if OLLAMA_KEEP_ALIVE:
+            kwargs.setdefault("keep_alive", OLLAMA_KEEP_ALIVE)
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(
+            self._tracked_call(method, kwargs, deadline or self.deadline, on_chunk), loop)
+
+
+pool = OllamaPool(
+    host=OLLAMA_BASE_URL,
+    max_parallel=OLLAMA_MAX_PARALLEL,
+    max_connections=OLLAMA_MAX_CONNECTIONS,
+    deadline=OLLAMA_CALL_DEADLINE_SECONDS,
+    max_retries=OLLAMA_MAX_RETRIES,
+    retry_base=OLLAMA_RETRY_BASE_SECONDS,
+)
+
+
+def generate(model: str, prompt: str, deadline: float = None, on_chunk=None, **kwargs):
+    """AsyncClient.generate through the shared pool (blocking)."""
+    return pool.request("generate", deadline=deadline, on_chunk=on_chunk, model=model, prompt=prompt, **kwargs)
+
+
+def chat(model: str, messages: list, deadline: float = None, on_chunk=None, **kwargs):
+    """AsyncClient.chat through the shared pool (blocking)."""
+    return pool.request("chat", deadline=deadline, on_chunk=on_chunk, model=model, messages=messages, **kwargs)
+
+
+def metrics() -> dict:
+    return pool.metrics()
@@ -0,0 +1,236 @@
+# backend/core/llm_gateway.py
+#
+# Punto unico di accesso al modello (Ollama) per ai_engine e comparator;
+# le chiamate vere e proprie passano dal client condiviso di llm_client.
+# Ogni invocazione viene registrata nel "ledger" della richiesta corrente
+# (hash del prompt, modello, latenza, token). Prompt identici non vengono
+# mai rieseguiti: nella stessa richiesta si riusa la risposta già ottenuta,
+# e le chiamate identiche in corso (anche di richieste diverse) vengono
+# accorpate in un'unica chiamata al modello. Le risposte riuscite vengono
+# inoltre salvate in una cache persistente su SQLite (TTL + LRU), indicizzata
+# per modello, versione del template di prompt e hash del prompt.
+# Con on_token il testo della risposta viene passato al chiamante man mano
+# che il modello lo genera (tutto in una volta se la risposta è già nota).
+
+import os
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import Future
+from contextvars import ContextVar
+from threading import Lock
+
+from core import llm_client
+from core.sqlite_cache import SQLiteCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "backend/cache/llm_cache.db")
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "128"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+
+# La versione qui è quella del formato delle voci; le versioni dei template
+# di prompt fanno parte della chiave
+_persistent_cache = SQLiteCache(
+    path=LLM_CACHE_PATH,
+    max_bytes=LLM_CACHE_MAX_MB * 1024 * 1024,
+    version="1",
+    ttl_seconds=LLM_CACHE_TTL_HOURS * 3600,
+)
+
+_current_ledger: ContextVar["LLMLedger | None"] = ContextVar("llm_ledger", default=None)
+
+_in_flight: dict[str, Future] = {}
+_in_flight_lock = Lock()
+
+
+class LLMLedger:
+    """Per-request record of model invocations, plus the responses reused within the request."""
+
+    def __init__(self):
+        self.entries: list[dict] = []
+        self._responses = {}
+        self._lock = Lock()
+
+    def lookup(self, key: str):
+        with self._lock:
+            return self._responses.get(key)
+
+    def record(self, key: str, kind: str, model: str, source: str, latency: float,
+               response=None, error: str = None, template: str = None) -> None:
+        entry = {
+            "kind": kind,
+            "model": model,
+            "template": template,
+            "prompt_hash": key[:16],
+            "source": source,  # model | in_flight | request_cache | persistent_cache
+            "latency_ms": round(latency * 1000, 1),
+            "prompt_tokens": _response_field(response, "prompt_eval_count") if source == "model" else 0,
+            "completion_tokens": _response_field(response, "eval_count") if source == "model" else 0,
+        }
+        if error:
+            entry["error"] = error
+        with self._lock:
+            if response is not None and error is None:
+                self._responses[key] = response
+            self.entries.append(entry)
+
+    def summary(self) -> dict:
+        with self._lock:
+            entries = list(self.entries)
+        return {
+            "calls": len(entries),
+            "model_calls": sum(1 for e in entries if e["source"] == "model"),
+            "deduplicated": sum(1 for e in entries if e["source"] != "model"),
+            "total_latency_ms": round(sum(e["latency_ms"] for e in entries), 1),
+            "prompt_tokens": sum(e["prompt_tokens"] or 0 for e in entries),
+            "completion_tokens": sum(e["completion_tokens"] or 0 for e in entries),
+            "entries": entries,
+        }
+
+
+def start_ledger() -> LLMLedger:
+    """Start a new ledger for the current request (context) and return it."""
+    ledger = LLMLedger()
+    _current_ledger.set(ledger)
+    return ledger
+
+
+def current_ledger() -> LLMLedger | None:
+    return _current_ledger.get()
+
+
+def _response_field(response, name: str):
+    try:
+        return response[name]
+    except (KeyError, TypeError, IndexError):
+        return None
+
+
+def _prompt_key(kind: str, model: str, template: str | None, payload: dict) -> str:
+    raw = json.dumps({"kind": kind, "model": model, "template": template, **payload},
+                     sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _response_text(kind: str, response) -> str:
+    return response["message"]["content"] if kind == "chat" else response["response"]
+
+
+def _cacheable_response(kind: str, response) -> dict:
+    """Plain-dict copy of an Ollama response with the fields callers read."""
+    if kind == "chat":
+        data = {"message": {"role": "assistant", "content": response["message"]["content"]}}
+    else:
+        data = {"response": response["response"]}
+    data["prompt_eval_count"] = _response_field(response, "prompt_eval_count")
+    data["eval_count"] = _response_field(response, "eval_count")
+    return data
+
+
+def _get_persistent(key: str):
+    if not LLM_CACHE_ENABLED:
+        return None
+    try:
+        return _persistent_cache.get(key)
+    except Exception as e:
+        logger.error(f"LLM cache read error: {str(e)}")
+        return None
+
+
+def _store_persistent(key: str, kind: str, response) -> None:
+    if not LLM_CACHE_ENABLED:
+        return
+    try:
+        _persistent_cache.set(key, _cacheable_response(kind, response))
+    except Exception as e:
+        logger.error(f"LLM cache write error: {str(e)}")
+
+
+def _invoke(kind: str, model: str, template: str | None, payload: dict, call, on_token=None):
+    key = _prompt_key(kind, model, template, payload)
+    ledger = _current_ledger.get()
+    start = time.perf_counter()
+
+    if ledger is not None:
+        cached = ledger.lookup(key)
+        if cached is not None:
+            logger.info(f"♻️ LLM {kind} {key[:12]} already answered in this request, reusing response")
+            ledger.record(key, kind, model, "request_cache", time.perf_counter() - start, cached,
+                          template=template)
+            if on_token is not None:
+                on_token(_response_text(kind, cached))
+            return cached
+
+    cached = _get_persistent(key)
+    if cached is not None:
+        logger.info(f"✅ LLM cache hit for {kind} {key[:12]} ({template}), skipping model call")
+        if ledger is not None:
+            ledger.record(key, kind, model, "persistent_cache", time.perf_counter() - start, cached,
+                          template=template)
+        if on_token is not None:
+            on_token(_response_text(kind, cached))
+        return cached
+
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _in_flight[key] = future
+
+    if owner:
+        source = "model"
+        try:
+            response = call(on_token)
+            future.set_result(response)
+        except Exception as e:
+            future.set_exception(e)
+            if ledger is not None:
+                ledger.record(key, kind, model, source, time.perf_counter() - start, error=str(e),
+                              template=template)
+            raise
+        finally:
+            with _in_flight_lock:
+                _in_flight.pop(key, None)
+    else:
+        source = "in_flight"
+        logger.info(f"♻️ LLM {kind} {key[:12]} already in flight, waiting for its response")
+        try:
+            response = future.result()
+        except Exception as e:
+            if ledger is not None:
+                ledger.record(key, kind, model, source, time.perf_counter() - start, error=str(e),
+                              template=template)
+            raise
+        if on_token is not None:
+            on_token(_response_text(kind, response))
+
+    if owner:
+        _store_persistent(key, kind, response)
+    if ledger is not None:
+        ledger.record(key, kind, model, source, time.perf_counter() - start, response, template=template)
+    return response
+
+
+def generate(model: str, prompt: str, template: str = None, on_token=None, **kwargs):
+    """
+    Ollama generate through the gateway (ledger, deduplication, persistent cache).
+    template names the prompt template and its version, e.g. "text_analysis:v1";
+    on_token, if given, receives the response text as it is generated.
+    """
+    return _invoke("generate", model, template, {"prompt": prompt, **kwargs},
+                   lambda on_chunk: llm_client.generate(model=model, prompt=prompt, on_chunk=on_chunk, **kwargs),
+                   on_token)
+
+
+def chat(model: str, messages: list, template: str = None, on_token=None, **kwargs):
+    """Ollama chat through the gateway (ledger, deduplication, persistent cache)."""
+    return _invoke("chat", model, template, {"messages": messages, **kwargs},
+                   lambda on_chunk: llm_client.chat(model=model, messages=messages, on_chunk=on_chunk, **kwargs),
+                   on_token)
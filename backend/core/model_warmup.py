@@ -0,0 +1,116 @@
+# backend/core/model_warmup.py
+#
+# Preriscaldamento del modello Ollama: all'avvio il modello configurato viene
+# caricato con una generate a prompt vuoto (Ollama carica il modello senza
+# generare), poi tenuto in memoria con la stessa chiamata e keep_alive a
+# intervalli regolari. Lo stato (pronto o no) è esposto sull'endpoint di health
+# e usato da main.py per rifiutare le analisi finché il modello non è caricato.
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+
+from core import llm_client
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "alibayram/medgemma")
+OLLAMA_WARMUP_ENABLED = os.getenv("OLLAMA_WARMUP_ENABLED", "True").lower() == "true"
+# Intervallo tra i ping keep_alive: deve essere più breve di OLLAMA_KEEP_ALIVE
+OLLAMA_KEEPALIVE_INTERVAL_SECONDS = float(os.getenv("OLLAMA_KEEPALIVE_INTERVAL_SECONDS", "240"))
+# Attesa prima di riprovare se Ollama non risponde o il caricamento fallisce
+OLLAMA_WARMUP_RETRY_SECONDS = float(os.getenv("OLLAMA_WARMUP_RETRY_SECONDS", "10"))
+# Rifiuta le analisi (503) finché il modello non è caricato
+OLLAMA_WARMUP_GATE = os.getenv("OLLAMA_WARMUP_GATE", "True").lower() == "true"
+
+STATE_DISABLED, STATE_LOADING, STATE_READY, STATE_UNAVAILABLE = "disabled", "loading", "ready", "unavailable"
+
+
+class ModelWarmup:
+    """Loads the model at startup and keeps it resident with periodic keep_alive pings."""
+
+    def __init__(self, model: str, enabled: bool, interval: float, retry_seconds: float):
+        self.model = model
+        self.enabled = enabled
+        self.interval = interval
+        self.retry_seconds = retry_seconds
+
+        self.state = STATE_LOADING if enabled else STATE_DISABLED
+        self.last_error = None
+        self.load_seconds = None
+        self.ready_since = None
+        self.last_ping = None
+        self._task = None
+
+    @property
+    def ready(self) -> bool:
+        """True once the model is loaded (always True when warm-up is disabled)."""
+        return self.state in (STATE_READY, STATE_DISABLED)
+
+    def status(self) -> dict:
+        return {
+            "model": self.model,
+            "state": self.state,
+            "ready": self.ready,
+            "load_seconds": self.load_seconds,
+            "ready_since": self.ready_since.isoformat() if self.ready_since else None,
+            "last_ping": self.last_ping.isoformat() if self.last_ping else None,
+            "last_error": self.last_error,
+        }
+
+    async def ping(self):
+        """Load the model (or refresh its keep_alive if it is already loaded)."""
+        started = time.monotonic()
+        try:
+            # Prompt vuoto: Ollama carica il modello e risponde senza generare token
+            await llm_client.pool.arequest("generate", model=self.model, prompt="")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.state != STATE_UNAVAILABLE:
+                logger.warning(f"⚠️ Model {self.model} not available ({self.last_error})")
+            self.state = STATE_UNAVAILABLE
+            return False
+
+        self.last_ping = datetime.utcnow()
+        self.last_error = None
+        if self.state != STATE_READY:
+            self.load_seconds = round(time.monotonic() - started, 2)
+            self.ready_since = self.last_ping
+            self.state = STATE_READY
+            logger.info(f"🔥 Model {self.model} ready ({self.load_seconds}s)")
+        return True
+
+    async def _run(self):
+        while True:
+            ok = await self.ping()
+            await asyncio.sleep(self.interval if ok else self.retry_seconds)
+
+    def start(self):
+        """Start the warm-up and keep-alive loop on the running event loop."""
+        if self.enabled and self._task is None:
+            logger.info(f"🔄 Warming up model {self.model}")
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+warmup = ModelWarmup(
+    model=OLLAMA_MODEL,
+    enabled=OLLAMA_WARMUP_ENABLED,
+    interval=OLLAMA_KEEPALIVE_INTERVAL_SECONDS,
+    retry_seconds=OLLAMA_WARMUP_RETRY_SECONDS,
+)
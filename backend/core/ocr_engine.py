@@ -0,0 +1,183 @@
+# backend/core/ocr_engine.py
+#
+# OCR parallelo a livello di pagina: ogni pagina del PDF viene rasterizzata
+# e passata a Tesseract in un processo separato, così i referti scansionati
+# multi-pagina sfruttano tutti i core invece di bloccare il worker uvicorn.
+# Le pagine sono rasterizzate una alla volta dal documento PyMuPDF già aperto
+# (nessun file temporaneo) e al massimo OCR_WORKERS immagini sono in memoria.
+
+import os
+import time
+import logging
+import contextvars
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import fitz                            # PyMuPDF
+import pytesseract
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configurazione da variabili d'ambiente
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_PAGE_TIMEOUT = float(os.getenv("OCR_PAGE_TIMEOUT", "120"))
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_LANG = os.getenv("PYTESSERACT_LANG", "ita")
+
+_pool = None
+_pool_lock = Lock()
+
+# Pagine il cui OCR è fallito o scaduto durante l'estrazione in corso (track_ocr_failures)
+_failed_pages: contextvars.ContextVar = contextvars.ContextVar("ocr_failed_pages", default=None)
+
+
+@contextmanager
+def track_ocr_failures():
+    """Collect, in the yielded list, the pages whose OCR fails or times out within the block."""
+    failed = []
+    token = _failed_pages.set(failed)
+    try:
+        yield failed
+    finally:
+        _failed_pages.reset(token)
+
+
+def record_ocr_failures(page_numbers):
+    failed = _failed_pages.get()
+    if failed is not None:
+        failed.extend(page_numbers)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Return the shared OCR process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logger.info(f"Starting OCR process pool with {OCR_WORKERS} workers")
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        return _pool
+
+
+def _reset_pool():
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_page_png(page: fitz.Page, dpi: int) -> bytes:
+    """Rasterize a PyMuPDF page to a grayscale PNG, the only image kept in memory for that page."""
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    return pix.tobytes("png")
+
+
+def _ocr_image(png_bytes: bytes, lang: str, timeout: float) -> str:
+    """Run Tesseract on a rendered page image. Runs in a worker process."""
+    try:
+        with Image.open(BytesIO(png_bytes)) as img:
+            return pytesseract.image_to_string(img, lang=lang, timeout=timeout)
+    except Exception as e:
+        # Some pytesseract exceptions cannot be unpickled in the parent and would
+        # mark the whole pool as broken: re-raise as a plain RuntimeError
+        raise RuntimeError(f"{type(e).__name__}: {e}") from None
+
+
+def format_ocr_pages(page_texts: list[tuple[int, str]]) -> str:
+    """Join OCR output using the same '--- PAGINA n ---' markers as the legacy OCR path."""
+    return "".join(f"\n--- PAGINA {page_number} ---\n{text}" for page_number, text in page_texts)
+
+
+def ocr_pages(doc: fitz.Document, page_numbers: list[int], workers: int = None,
+              page_timeout: float = None, dpi: int = None, lang: str = None) -> list[tuple[int, str]]:
+    """
+    OCR the given 1-based page numbers of an open PyMuPDF document in parallel.
+    Pages are rendered one at a time and at most `workers` page images are in
+    flight. Returns (page_number, text) pairs in the order requested; pages that
+    fail or exceed the per-page timeout come back with empty text (and are
+    recorded for track_ocr_failures).
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    page_timeout = OCR_PAGE_TIMEOUT if page_timeout is None else page_timeout
+    dpi = dpi or OCR_DPI
+    lang = lang or OCR_LANG
+
+    if not page_numbers:
+        return []
+
+    logger.info(f"Running OCR on {len(page_numbers)} pages (workers={workers}, dpi={dpi}, lang={lang})")
+
+    # Con un solo worker non vale la pena pagare l'avvio del pool
+    if workers <= 1 or len(page_numbers) == 1:
+        results = []
+        for page_number in page_numbers:
+            try:
+                png_bytes = render_page_png(doc[page_number - 1], dpi)
+                text = _ocr_image(png_bytes, lang, page_timeout)
+            except Exception as e:
+                logger.error(f"❌ OCR error on page {page_number}: {str(e)}")
+                record_ocr_failures([page_number])
+                text = ""
+            results.append((page_number, text))
+        return results
+
+    pool = _get_pool()
+    texts = {}
+    in_flight = {}  # future -> (page_number, deadline)
+
+    def collect(done):
+        for future in done:
+            page_number, _ = in_flight.pop(future)
+            try:
+                texts[page_number] = future.result()
+            except BrokenProcessPool as e:
+                logger.error(f"❌ OCR worker crashed on page {page_number}: {str(e)}")
+                _reset_pool()
+                record_ocr_failures([page_number])
+                texts[page_number] = ""
+            except Exception as e:
+                logger.error(f"❌ OCR error on page {page_number}: {str(e)}")
+                record_ocr_failures([page_number])
+                texts[page_number] = ""
+
+    def drain(max_in_flight):
+        while len(in_flight) > max_in_flight:
+            now = time.monotonic()
+            expired = [f for f, (_, deadline) in in_flight.items() if deadline <= now]
+            for future in expired:
+                page_number, _ = in_flight.pop(future)
+                logger.error(f"❌ OCR timeout on page {page_number} after {page_timeout}s")
+                future.cancel()
+                record_ocr_failures([page_number])
+                texts[page_number] = ""
+            if len(in_flight) <= max_in_flight:
+                break
+            next_deadline = min(deadline for _, deadline in in_flight.values())
+            done, _ = wait(list(in_flight), timeout=max(next_deadline - now, 0), return_when=FIRST_COMPLETED)
+            collect(done)
+
+    for page_number in page_numbers:
+        # Render the next page only when a worker slot is free, bounding peak memory
+        drain(workers - 1)
+        try:
+            png_bytes = render_page_png(doc[page_number - 1], dpi)
+            future = pool.submit(_ocr_image, png_bytes, lang, page_timeout)
+        except Exception as e:
+            logger.error(f"❌ OCR error on page {page_number}: {str(e)}")
+            record_ocr_failures([page_number])
+            texts[page_number] = ""
+            continue
+        in_flight[future] = (page_number, time.monotonic() + page_timeout)
+        del png_bytes
+
+    drain(0)
+
+    return [(page_number, texts.get(page_number, "")) for page_number in page_numbers]
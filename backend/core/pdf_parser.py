@@ -1,9 +1,15 @@
 import fitz                            # PyMuPDF
-import pytesseract
-from pdf2image import convert_from_path
 from io import BytesIO
-import tempfile, os, re
+import os, re
+import mmap
 import logging
+from functools import lru_cache
+
+from core.ocr_engine import ocr_pages, format_ocr_pages, track_ocr_failures, record_ocr_failures
+from core.report_text import ReportText
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -21,11 +27,78 @@ CF_RE = re.compile(
     re.I | re.X,
 )
 
-def extract_text_from_pdf(file_bytes: bytes) -> tuple[str, fitz.Document]:
+# Versione del parser: va incrementata quando cambia l'output di extract_metadata,
+# così le voci della cache di estrazione scritte in precedenza vengono invalidate
+PARSER_VERSION = "1"
+
+# Modalità OCR: "document" decide sull'intero documento (comportamento storico),
+# "page" decide pagina per pagina usando il text layer e la copertura delle immagini
+OCR_MODE = os.getenv("OCR_MODE", "document").lower()
+# Sotto questa soglia di caratteri il text layer di una pagina non è considerato utilizzabile
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "100"))
+# Frazione della pagina coperta da immagini oltre la quale la pagina è considerata scansionata
+OCR_IMAGE_COVERAGE = float(os.getenv("OCR_IMAGE_COVERAGE", "0.6"))
+
+def _image_coverage(page: fitz.Page) -> float:
+    """Fraction of the page area covered by raster images (0.0 - 1.0)."""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    if page_area <= 0:
+        return 0.0
+
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page_rect
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return min(covered / page_area, 1.0)
+
+def _page_needs_ocr(page: fitz.Page, page_text: str) -> bool:
+    """A page needs OCR when it has no usable text layer, or is mostly a scanned image with sparse text."""
+    chars = len(page_text.strip())
+    if chars < OCR_MIN_PAGE_CHARS:
+        return True
+    return _image_coverage(page) >= OCR_IMAGE_COVERAGE and chars < OCR_MIN_PAGE_CHARS * 3
+
+def _extract_text_per_page(doc: fitz.Document) -> str:
+    """Merge the text layer and OCR output page by page, OCR-ing only pages without a usable text layer."""
+    layer_texts = [p.get_text() for p in doc]
+    ocr_candidates = [i + 1 for i, p in enumerate(doc) if _page_needs_ocr(p, layer_texts[i])]
+
+    if not ocr_candidates:
+        logger.info("ℹ️ All pages have a usable text layer, skipping OCR")
+        return "".join(layer_texts)
+
+    logger.info(f"OCR needed on {len(ocr_candidates)}/{doc.page_count} pages: {ocr_candidates}")
+    ocr_texts = {}
+    try:
+        ocr_texts = dict(ocr_pages(doc, ocr_candidates))
+    except Exception as e:
+        logger.error(f"❌ OCR Error: {str(e)}")
+        record_ocr_failures(ocr_candidates)
+
+    merged = []
+    for page_number, layer_text in enumerate(layer_texts, start=1):
+        ocr_text = ocr_texts.get(page_number, "")
+        # Keep whichever source produced more content for this page
+        if len(ocr_text.strip()) > len(layer_text.strip()):
+            merged.append(format_ocr_pages([(page_number, ocr_text)]))
+        else:
+            merged.append(layer_text)
+    return "".join(merged)
+
+def extract_text_from_pdf(file_bytes: bytes | memoryview) -> tuple[str, fitz.Document]:
     """Return full text and the opened PyMuPDF document."""
     logger.info("Opening PDF document")
+    doc = None
     try:
         doc = fitz.open(stream=file_bytes, filetype="pdf")
+
+        if OCR_MODE == "page":
+            text = _extract_text_per_page(doc)
+            logger.info(f"Extracted {len(text)} characters from PDF (per-page OCR mode)")
+            return text, doc
+
         text = "".join(p.get_text() for p in doc)
         logger.info(f"Extracted {len(text)} characters from PDF")
 
@@ -39,22 +112,9 @@ def extract_text_from_pdf(file_bytes: bytes) -> tuple[str, fitz.Document]:
                 logger.info("OCR enabled by configuration")
                 
         if use_ocr:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(file_bytes)
-                tmp_path = tmp.name
-                logger.info(f"Created temporary file for OCR: {tmp_path}")
-                
             try:
-                ocr_text = ""
-                ocr_lang = os.getenv("PYTESSERACT_LANG", "ita")
-                logger.info(f"Converting PDF to images for OCR with language: {ocr_lang}")
-                images = convert_from_path(tmp_path, dpi=300)
-                logger.info(f"Processing {len(images)} pages with OCR")
-                
-                for i, img in enumerate(images):
-                    logger.info(f"Running OCR on page {i+1}")
-                    page_text = pytesseract.image_to_string(img, lang=ocr_lang)
-                    ocr_text += f"\n--- PAGINA {i+1} ---\n{page_text}"
+                logger.info(f"Processing {doc.page_count} pages with OCR")
+                ocr_text = format_ocr_pages(ocr_pages(doc, list(range(1, doc.page_count + 1))))
                     
                 # Use OCR text if it produced more content
                 if len(ocr_text.strip()) > len(text.strip()):
@@ -64,11 +124,11 @@ def extract_text_from_pdf(file_bytes: bytes) -> tuple[str, fitz.Document]:
                     logger.info("ℹ️ Using original text (better than OCR)")
             except Exception as e:
                 logger.error(f"❌ OCR Error: {str(e)}")
-            finally:
-                logger.info("Cleaning up temporary file")
-                os.remove(tmp_path)
+                record_ocr_failures(range(1, doc.page_count + 1))
     except Exception as e:
         logger.error(f"Error opening PDF document: {str(e)}")
+        if doc is not None:
+            doc.close()
         raise
             
     return text, doc
@@ -122,155 +182,255 @@ def find_cf(text: str, doc: fitz.Document) -> str | None:
                 
     return None
 
-def extract_exam_title(text: str) -> str | None:
+# --- Titoli d'esame specifici, in ordine di priorità ---------------------------
+# Laboratory exam patterns first (most specific)
+LAB_EXAM_PATTERNS = [
+    r"ESAME\s+CHIMICO\s+FISICO\s+DELLE?\s+URINE?",
+    r"ESAME\s+EMOCROMOCITOMETRICO",
+    r"ESAME\s+BATTERIOLOGICO",
+    r"ESAME\s+MICROSCOPICO",
+    r"FORMULA\s+LEUCOCITARIA",
+    r"CHIMICA\s+CLINICA",
+    r"EMOCROMO\s+COMPLETO",
+    r"PROFILO\s+LIPIDICO",
+    r"FUNZIONALITÀ\s+EPATICA",
+    r"FUNZIONALITÀ\s+RENALE",
+    r"MARKERS?\s+TUMORALI",
+    r"ORMONI\s+TIROIDEI",
+    r"COAGULAZIONE"
+]
+
+# Radiology and imaging exam patterns (most specific first)
+RADIOLOGY_EXAM_PATTERNS = [
+    # Ecocolordopplergrafia - specific anatomical regions (most specific first)
+    r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+INFERIORI\s+ARTERIOSO",
+    r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+INFERIORI\s+VENOSO",
+    r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+SUPERIORI\s+ARTERIOSO",
+    r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+SUPERIORI\s+VENOSO",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DEI\s+)?TRONCHI\s+SOVRAORTICI",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DELL')?AORTA\s+ADDOMINALE",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?ARTERIE\s+RENALI",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DEL\s+)?SISTEMA\s+VENOSO\s+PROFONDO",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?CAROTIDI",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?ARTERIE\s+VERTEBRALI",
+    r"ECOCOLORDOPPLERGRAFIA\s+CARDIACA",
+    r"ECOCOLORDOPPLERGRAFIA\s+(?:ARTI\s+)?(?:INFERIORI|SUPERIORI)",
+    r"ECOCOLORDOPPLERGRAFIA",
+
+    # Ecografia - specific regions
+    r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+COMPLETO",
+    r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+SUPERIORE",
+    r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+INFERIORE",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?PELVI\s+TRANSVAGINALE",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?PELVI\s+TRANSADDOMINALE",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?TIROIDE",
+    r"ECOGRAFIA\s+(?:DEL\s+)?COLLO",
+    r"ECOGRAFIA\s+(?:DELLE\s+)?MAMMELLE",
+    r"ECOGRAFIA\s+(?:DEI\s+)?TESTICOLI",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?PROSTATA",
+    r"ECOGRAFIA\s+(?:DEI\s+)?RENI\s+E\s+VESCICA",
+    r"ECOGRAFIA\s+(?:DELLE\s+)?VIE\s+URINARIE",
+    r"ECOGRAFIA\s+(?:DEL\s+)?FEGATO",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?COLECISTI",
+    r"ECOGRAFIA\s+(?:DEL\s+)?PANCREAS",
+    r"ECOGRAFIA\s+(?:DELLA\s+)?MILZA",
+    r"ECOGRAFIA\s+(?:ADDOMINALE|PELVICA|TIROIDEA|EPATICA|RENALE)",
+
+    # Ecocardiogramma variants
+    r"ECOCARDIOGRAMMA\s+(?:COLOR\s+)?DOPPLER",
+    r"ECOCARDIOGRAMMA\s+TRANSTORACICO",
+    r"ECOCARDIOGRAMMA\s+TRANSESOFAGEO",
+    r"ECOCARDIOGRAMMA",
+
+    # Radiografia variants
+    r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE\s+IN\s+DUE\s+PROIEZIONI",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE\s+(?:IN\s+)?(?:PA|AP)",
+    r"RADIOGRAFIA\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?BACINO",
+    r"RADIOGRAFIA\s+(?:DELLE\s+)?ANCHE",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?GINOCCHIO",
+    r"RADIOGRAFIA\s+(?:DELLA\s+)?SPALLA",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?POLSO",
+    r"RADIOGRAFIA\s+(?:DELLA\s+)?CAVIGLIA",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?PIEDE",
+    r"RADIOGRAFIA\s+(?:DELL')?ADDOME",
+    r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE",
+
+    # TAC/TC variants
+    r"TAC\s+(?:DELL')?ADDOME\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
+    r"TAC\s+(?:DEL\s+)?TORACE\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
+    r"TAC\s+(?:DEL\s+)?CRANIO\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
+    r"TAC\s+(?:DELL')?ENCEFALO\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
+    r"TAC\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
+    r"TAC\s+(?:DEL\s+)?RACHIDE",
+    r"TAC\s+(?:ADDOME|TORACE|CRANIO|ENCEFALO)",
+
+    # Risonanza Magnetica variants
+    r"RISONANZA\s+MAGNETICA\s+(?:DELL')?ENCEFALO",
+    r"RISONANZA\s+MAGNETICA\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
+    r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?RACHIDE",
+    r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?GINOCCHIO",
+    r"RISONANZA\s+MAGNETICA\s+(?:DELLA\s+)?SPALLA",
+    r"RISONANZA\s+MAGNETICA\s+(?:DELL')?ADDOME",
+    r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?BACINO",
+    r"RISONANZA\s+MAGNETICA",
+
+    # Other imaging modalities
+    r"MAMMOGRAFIA\s+BILATERALE",
+    r"MAMMOGRAFIA",
+    r"DENSITOMETRIA\s+OSSEA",
+    r"SCINTIGRAFIA\s+OSSEA",
+    r"SCINTIGRAFIA\s+TIROIDEA",
+    r"SCINTIGRAFIA",
+    r"ANGIO\s*TAC",
+    r"ANGIO\s*RM",
+
+    # Generic patterns (least specific, processed last)
+    r"REFERTO\s+DI\s+RADIOLOGIA",
+    r"REFERTO\s+RADIOLOGICO",
+    r"DOPPLER",
+    r"ECO\s+DOPPLER",
+    r"ECO-DOPPLER"
+]
+
+# Pathology and histology exam patterns
+PATHOLOGY_EXAM_PATTERNS = [
+    r"ESAME\s+ISTOLOGICO",
+    r"ESAME\s+CITOLOGICO", 
+    r"ESAME\s+ANATOMO\s*PATOLOGICO",
+    r"BIOPSIA",
+    r"AGOBIOPSIA",
+    r"REFERTO\s+(?:DI\s+)?(?:ANATOMIA\s+)?PATOLOGICA?",
+    r"REFERTO\s+ISTOLOGICO",
+    r"REFERTO\s+CITOLOGICO",
+    r"DIAGNOSI\s+ISTOLOGICA",
+    r"DIAGNOSI\s+CITOLOGICA",
+    r"PAP\s*TEST",
+    r"IMMUNOISTOCHIMICA",
+    r"COLORAZIONE\s+(?:HE|H&E|EMATOSSILINA)",
+    r"PREPARATO\s+ISTOLOGICO",
+    r"SEZIONI\s+ISTOLOGICHE"
+]
+
+# Combine all specific patterns: the first pattern (in this order) found anywhere in the text wins
+EXAM_TITLE_PATTERNS = LAB_EXAM_PATTERNS + RADIOLOGY_EXAM_PATTERNS + PATHOLOGY_EXAM_PATTERNS
+
+def _build_exam_title_matcher(patterns: list[str]):
+    """
+    Compile the exam title patterns once into a single-pass matcher.
+    Every pattern starts with a literal keyword (its "stem"): one alternation over
+    all stems finds every candidate position in a single scan of the uppercased
+    text, and only the patterns sharing the stem found there are tried at that position.
+    """
+    by_stem = {}
+    for priority, pattern in enumerate(patterns):
+        stem = re.match(r"[A-ZÀ-Ý']+", pattern).group(0)
+        # "MARKERS?": an optional trailing letter is not part of the literal stem
+        if pattern[len(stem):len(stem) + 1] in ("?", "*"):
+            stem = stem[:-1]
+        by_stem.setdefault(stem, []).append((priority, re.compile(pattern, re.IGNORECASE)))
+
+    # The alternation reports the longest stem at each position; every shorter stem
+    # occurring at the same position is a prefix of it, so its patterns are candidates too
+    candidates = {
+        stem: sorted(
+            (entry for other, entries in by_stem.items() if stem.startswith(other) for entry in entries),
+            key=lambda entry: entry[0],
+        )
+        for stem in by_stem
+    }
+    all_patterns = sorted((entry for entries in by_stem.values() for entry in entries), key=lambda entry: entry[0])
+    alternation = "|".join(re.escape(stem) for stem in sorted(by_stem, key=len, reverse=True))
+    # Case-sensitive scan of the uppercased text is much faster than an IGNORECASE scan
+    return re.compile(alternation), re.compile(alternation, re.IGNORECASE), candidates, all_patterns
+
+(_TITLE_STEMS_RE, _TITLE_STEMS_RE_I,
+ _TITLE_CANDIDATES, _ALL_TITLE_PATTERNS) = _build_exam_title_matcher(EXAM_TITLE_PATTERNS)
+
+def match_exam_title_pattern(text: str, upper_text: str = None) -> str | None:
+    """
+    Return the match of the highest-priority pattern in EXAM_TITLE_PATTERNS found
+    anywhere in text (its leftmost occurrence), scanning the text only once.
+    Equivalent to trying re.search for each pattern in order.
+    """
+    upper_text = text.upper() if upper_text is None else upper_text
+    if len(upper_text) == len(text):
+        scan_text, stems_re = upper_text, _TITLE_STEMS_RE
+    else:
+        # Rare case mappings that change length (e.g. "ß" -> "SS"): scan the original text
+        scan_text, stems_re = text, _TITLE_STEMS_RE_I
+
+    best_priority, best_match = None, None
+    position = 0
+    while best_priority != 0:
+        hit = stems_re.search(scan_text, position)
+        if not hit:
+            break
+        position = hit.start()
+        for priority, regex in _TITLE_CANDIDATES.get(hit.group(0).upper(), _ALL_TITLE_PATTERNS):
+            if best_priority is not None and priority >= best_priority:
+                break
+            match = regex.match(text, position)
+            if match:
+                best_priority, best_match = priority, match.group(0)
+                break
+        # Stems can overlap (e.g. DOPPLER inside ECOCOLORDOPPLERGRAFIA): resume from the next character
+        position += 1
+    return best_match
+
+# Medical keywords for exam titles found in dedicated lines
+EXAM_TITLE_KEYWORDS = [
+    'ESAME', 'REFERTO', 'ANALISI', 'DIAGNOSTICA', 'INDAGINE',
+    'CHIMICO', 'FISICO', 'BATTERIOLOGICO', 'MICROSCOPICO',
+    'URINE', 'SANGUE', 'EMOCROMO', 'COAGULAZIONE',
+    'RADIOLOG', 'ECOGRAF', 'CARDIOL', 'NEUROLOG', 'ORTOPED',
+    'PATOLOG', 'ISTOLOG', 'CITOLOG', 'BIOPSIA'
+]
+
+# Administrative terms that disqualify a title candidate
+EXAM_TITLE_ADMIN_TERMS = [
+    'AZIENDA', 'OSPEDALE', 'DIRETTORE', 'RESPONSABILE',
+    'TELEFONO', 'EMAIL', 'INDIRIZZO', 'VIA', 'VIALE',
+    'CODICE', 'PAZIENTE', 'RISULTATO', 'UNITA', 'RIFERIMENTO'
+]
+
+# Fallback: look for pattern-based exam types
+_REPORT_TYPE_RES = [re.compile(p, re.I) for p in [
+    r"(?:Tipo(?:\s*di)?(?:\s*esame|referto|indagine)?)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
+    r"(?:REFERTO|Referto)(?:\s*di)?[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
+    r"(?:PRESTAZIONE|Prestazione)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
+    r"(?:SPECIALITÀ|Specialità)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
+    r"(?:SETTORE|Settore)[\s:.-]*([A-Za-zÀ-ÿ\s]+)"
+]]
+
+# Specific medical keywords in the first lines (fallback classification)
+EXAM_TYPE_KEYWORDS = {
+    "Esame Chimico Fisico Delle Urine": ["URINE", "PROTEINE", "GLUCOSIO", "SEDIMENTO", "ESTERASI"],
+    "Esame Emocromocitometrico": ["WBC", "RBC", "HGB", "HCT", "PLT", "EMOCROMO"],
+    "Chimica Clinica": ["GLUCOSIO", "CREATININA", "UREA", "SODIO", "POTASSIO", "TRANSAMINASI"],
+    "Ecocolordopplergrafia": ["ECOCOLORDOPPLERGRAFIA", "DOPPLER", "CAROTIDE", "VASCOLARE", "STENOSI", "FLUSSO"],
+    "Radiologia": ["RX", "TAC", "ECOGRAFIA", "RADIOLOGIA", "ECO", "RAGGI X", "RISONANZA"],
+    "Cardiologia": ["ECG", "ECOCARDIOGRAMMA", "ELETTROCARDIOGRAMMA", "CARDIO", "CARDIOVASCOLARE"],
+    "Anatomia Patologica": ["ISTOLOGICO", "CITOLOGICO", "BIOPSIA", "AGOBIOPSIA", "PATOLOGICA", "HE", "EMATOSSILINA", "IMMUNOISTOCHIMICA", "NEOPLASIA", "DISPLASIA", "METAPLASIA"],
+    "Laboratorio": ["ANALISI", "LABORATORIO", "BIOCHIMICA", "SIEROLOGIA"]
+}
+
+def extract_exam_title(text: str | ReportText) -> str | None:
     """
     Extract the exam/report type from medical document text.
     Prioritizes longer, more specific exam titles.
     """
     logger.info("Extracting exam title from document")
     
-    # Split text into lines for better processing
-    lines = text.splitlines()
-    
-    # Look for specific laboratory exam patterns first (most specific)
-    lab_exam_patterns = [
-        r"ESAME\s+CHIMICO\s+FISICO\s+DELLE?\s+URINE?",
-        r"ESAME\s+EMOCROMOCITOMETRICO",
-        r"ESAME\s+BATTERIOLOGICO",
-        r"ESAME\s+MICROSCOPICO",
-        r"FORMULA\s+LEUCOCITARIA",
-        r"CHIMICA\s+CLINICA",
-        r"EMOCROMO\s+COMPLETO",
-        r"PROFILO\s+LIPIDICO",
-        r"FUNZIONALITÀ\s+EPATICA",
-        r"FUNZIONALITÀ\s+RENALE",
-        r"MARKERS?\s+TUMORALI",
-        r"ORMONI\s+TIROIDEI",
-        r"COAGULAZIONE"
-    ]
-    
-    # Add radiology and imaging exam patterns (most specific first)
-    radiology_exam_patterns = [
-        # Ecocolordopplergrafia - specific anatomical regions (most specific first)
-        r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+INFERIORI\s+ARTERIOSO",
-        r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+INFERIORI\s+VENOSO",
-        r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+SUPERIORI\s+ARTERIOSO",
-        r"ECOCOLORDOPPLERGRAFIA\s+DEGLI\s+ARTI\s+SUPERIORI\s+VENOSO",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DEI\s+)?TRONCHI\s+SOVRAORTICI",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DELL')?AORTA\s+ADDOMINALE",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?ARTERIE\s+RENALI",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DEL\s+)?SISTEMA\s+VENOSO\s+PROFONDO",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?CAROTIDI",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:DELLE\s+)?ARTERIE\s+VERTEBRALI",
-        r"ECOCOLORDOPPLERGRAFIA\s+CARDIACA",
-        r"ECOCOLORDOPPLERGRAFIA\s+(?:ARTI\s+)?(?:INFERIORI|SUPERIORI)",
-        r"ECOCOLORDOPPLERGRAFIA",
-        
-        # Ecografia - specific regions
-        r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+COMPLETO",
-        r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+SUPERIORE",
-        r"ECOGRAFIA\s+(?:DELL')?ADDOME\s+INFERIORE",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?PELVI\s+TRANSVAGINALE",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?PELVI\s+TRANSADDOMINALE",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?TIROIDE",
-        r"ECOGRAFIA\s+(?:DEL\s+)?COLLO",
-        r"ECOGRAFIA\s+(?:DELLE\s+)?MAMMELLE",
-        r"ECOGRAFIA\s+(?:DEI\s+)?TESTICOLI",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?PROSTATA",
-        r"ECOGRAFIA\s+(?:DEI\s+)?RENI\s+E\s+VESCICA",
-        r"ECOGRAFIA\s+(?:DELLE\s+)?VIE\s+URINARIE",
-        r"ECOGRAFIA\s+(?:DEL\s+)?FEGATO",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?COLECISTI",
-        r"ECOGRAFIA\s+(?:DEL\s+)?PANCREAS",
-        r"ECOGRAFIA\s+(?:DELLA\s+)?MILZA",
-        r"ECOGRAFIA\s+(?:ADDOMINALE|PELVICA|TIROIDEA|EPATICA|RENALE)",
-        
-        # Ecocardiogramma variants
-        r"ECOCARDIOGRAMMA\s+(?:COLOR\s+)?DOPPLER",
-        r"ECOCARDIOGRAMMA\s+TRANSTORACICO",
-        r"ECOCARDIOGRAMMA\s+TRANSESOFAGEO",
-        r"ECOCARDIOGRAMMA",
-        
-        # Radiografia variants
-        r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE\s+IN\s+DUE\s+PROIEZIONI",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE\s+(?:IN\s+)?(?:PA|AP)",
-        r"RADIOGRAFIA\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?BACINO",
-        r"RADIOGRAFIA\s+(?:DELLE\s+)?ANCHE",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?GINOCCHIO",
-        r"RADIOGRAFIA\s+(?:DELLA\s+)?SPALLA",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?POLSO",
-        r"RADIOGRAFIA\s+(?:DELLA\s+)?CAVIGLIA",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?PIEDE",
-        r"RADIOGRAFIA\s+(?:DELL')?ADDOME",
-        r"RADIOGRAFIA\s+(?:DEL\s+)?TORACE",
-        
-        # TAC/TC variants
-        r"TAC\s+(?:DELL')?ADDOME\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
-        r"TAC\s+(?:DEL\s+)?TORACE\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
-        r"TAC\s+(?:DEL\s+)?CRANIO\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
-        r"TAC\s+(?:DELL')?ENCEFALO\s+(?:CON\s+)?(?:E\s+SENZA\s+)?(?:MDC|CONTRASTO)",
-        r"TAC\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
-        r"TAC\s+(?:DEL\s+)?RACHIDE",
-        r"TAC\s+(?:ADDOME|TORACE|CRANIO|ENCEFALO)",
-        
-        # Risonanza Magnetica variants
-        r"RISONANZA\s+MAGNETICA\s+(?:DELL')?ENCEFALO",
-        r"RISONANZA\s+MAGNETICA\s+(?:DELLA\s+)?COLONNA\s+VERTEBRALE",
-        r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?RACHIDE",
-        r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?GINOCCHIO",
-        r"RISONANZA\s+MAGNETICA\s+(?:DELLA\s+)?SPALLA",
-        r"RISONANZA\s+MAGNETICA\s+(?:DELL')?ADDOME",
-        r"RISONANZA\s+MAGNETICA\s+(?:DEL\s+)?BACINO",
-        r"RISONANZA\s+MAGNETICA",
-        
-        # Other imaging modalities
-        r"MAMMOGRAFIA\s+BILATERALE",
-        r"MAMMOGRAFIA",
-        r"DENSITOMETRIA\s+OSSEA",
-        r"SCINTIGRAFIA\s+OSSEA",
-        r"SCINTIGRAFIA\s+TIROIDEA",
-        r"SCINTIGRAFIA",
-        r"ANGIO\s*TAC",
-        r"ANGIO\s*RM",
-        
-        # Generic patterns (least specific, processed last)
-        r"REFERTO\s+DI\s+RADIOLOGIA",
-        r"REFERTO\s+RADIOLOGICO",
-        r"DOPPLER",
-        r"ECO\s+DOPPLER",
-        r"ECO-DOPPLER"
-    ]
-    
-    # Add pathology and histology exam patterns
-    pathology_exam_patterns = [
-        r"ESAME\s+ISTOLOGICO",
-        r"ESAME\s+CITOLOGICO", 
-        r"ESAME\s+ANATOMO\s*PATOLOGICO",
-        r"BIOPSIA",
-        r"AGOBIOPSIA",
-        r"REFERTO\s+(?:DI\s+)?(?:ANATOMIA\s+)?PATOLOGICA?",
-        r"REFERTO\s+ISTOLOGICO",
-        r"REFERTO\s+CITOLOGICO",
-        r"DIAGNOSI\s+ISTOLOGICA",
-        r"DIAGNOSI\s+CITOLOGICA",
-        r"PAP\s*TEST",
-        r"IMMUNOISTOCHIMICA",
-        r"COLORAZIONE\s+(?:HE|H&E|EMATOSSILINA)",
-        r"PREPARATO\s+ISTOLOGICO",
-        r"SEZIONI\s+ISTOLOGICHE"
-    ]
-    
-    # Combine all specific patterns
-    all_specific_patterns = lab_exam_patterns + radiology_exam_patterns + pathology_exam_patterns
+    report = ReportText.of(text)
+    lines = report.splitlines
     
-    # Search for specific laboratory exam patterns in the entire text
-    for pattern in all_specific_patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            found_title = match.group(0).strip()
-            logger.info(f"Found specific exam title: {found_title}")
-            return found_title.title()
+    # Look for specific exam patterns first (most specific), in priority order
+    found_title = match_exam_title_pattern(report.text, report.upper)
+    if found_title:
+        found_title = found_title.strip()
+        logger.info(f"Found specific exam title: {found_title}")
+        return found_title.title()
     
     # Look for exam titles in dedicated sections (look for longer, more descriptive titles)
     exam_title_candidates = []
@@ -288,24 +448,9 @@ def extract_exam_title(text: str) -> str | None:
             line.isupper() and 
             not any(c.isdigit() for c in line[:5])):  # No numbers at start
             
-            # Check if it contains medical exam keywords
-            medical_keywords = [
-                'ESAME', 'REFERTO', 'ANALISI', 'DIAGNOSTICA', 'INDAGINE',
-                'CHIMICO', 'FISICO', 'BATTERIOLOGICO', 'MICROSCOPICO',
-                'URINE', 'SANGUE', 'EMOCROMO', 'COAGULAZIONE',
-                'RADIOLOG', 'ECOGRAF', 'CARDIOL', 'NEUROLOG', 'ORTOPED',
-                'PATOLOG', 'ISTOLOG', 'CITOLOG', 'BIOPSIA'
-            ]
-            
-            if any(keyword in line for keyword in medical_keywords):
-                # Exclude administrative terms
-                admin_terms = [
-                    'AZIENDA', 'OSPEDALE', 'DIRETTORE', 'RESPONSABILE',
-                    'TELEFONO', 'EMAIL', 'INDIRIZZO', 'VIA', 'VIALE',
-                    'CODICE', 'PAZIENTE', 'RISULTATO', 'UNITA', 'RIFERIMENTO'
-                ]
-                
-                if not any(term in line for term in admin_terms):
+            # Check if it contains medical exam keywords, excluding administrative terms
+            if any(keyword in line for keyword in EXAM_TITLE_KEYWORDS):
+                if not any(term in line for term in EXAM_TITLE_ADMIN_TERMS):
                     exam_title_candidates.append((len(line), line, i))
     
     # Sort by length (longer titles are usually more specific) and prefer earlier positions
@@ -317,16 +462,8 @@ def extract_exam_title(text: str) -> str | None:
         return best_title.title()
     
     # Fallback: look for pattern-based exam types
-    report_type_patterns = [
-        r"(?:Tipo(?:\s*di)?(?:\s*esame|referto|indagine)?)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
-        r"(?:REFERTO|Referto)(?:\s*di)?[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
-        r"(?:PRESTAZIONE|Prestazione)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
-        r"(?:SPECIALITÀ|Specialità)[\s:.-]*([A-Za-zÀ-ÿ\s]+)",
-        r"(?:SETTORE|Settore)[\s:.-]*([A-Za-zÀ-ÿ\s]+)"
-    ]
-    
-    for pattern in report_type_patterns:
-        match = re.search(pattern, text, re.I)
+    for pattern in _REPORT_TYPE_RES:
+        match = pattern.search(report.text)
         if match:
             result = match.group(1).strip()
             # Clean and validate the result
@@ -337,21 +474,9 @@ def extract_exam_title(text: str) -> str | None:
                     logger.info(f"Found pattern-based exam title: {result}")
                     return result.title()
 
-    # Check for specific medical keywords in the entire text (fallback classification)
-    type_keywords = {
-        "Esame Chimico Fisico Delle Urine": ["URINE", "PROTEINE", "GLUCOSIO", "SEDIMENTO", "ESTERASI"],
-        "Esame Emocromocitometrico": ["WBC", "RBC", "HGB", "HCT", "PLT", "EMOCROMO"],
-        "Chimica Clinica": ["GLUCOSIO", "CREATININA", "UREA", "SODIO", "POTASSIO", "TRANSAMINASI"],
-        "Ecocolordopplergrafia": ["ECOCOLORDOPPLERGRAFIA", "DOPPLER", "CAROTIDE", "VASCOLARE", "STENOSI", "FLUSSO"],
-        "Radiologia": ["RX", "TAC", "ECOGRAFIA", "RADIOLOGIA", "ECO", "RAGGI X", "RISONANZA"],
-        "Cardiologia": ["ECG", "ECOCARDIOGRAMMA", "ELETTROCARDIOGRAMMA", "CARDIO", "CARDIOVASCOLARE"],
-        "Anatomia Patologica": ["ISTOLOGICO", "CITOLOGICO", "BIOPSIA", "AGOBIOPSIA", "PATOLOGICA", "HE", "EMATOSSILINA", "IMMUNOISTOCHIMICA", "NEOPLASIA", "DISPLASIA", "METAPLASIA"],
-        "Laboratorio": ["ANALISI", "LABORATORIO", "BIOCHIMICA", "SIEROLOGIA"]
-    }
-    
     # Check for these keywords in the first part of the document
     search_text = ' '.join(lines[:30]).upper()  # First 30 lines
-    for type_name, keywords in type_keywords.items():
+    for type_name, keywords in EXAM_TYPE_KEYWORDS.items():
         keyword_count = sum(1 for keyword in keywords if keyword in search_text)
         if keyword_count >= 2:  # Need at least 2 matching keywords
             logger.info(f"Found exam type by keywords: {type_name}")
@@ -360,100 +485,80 @@ def extract_exam_title(text: str) -> str | None:
     logger.warning("No specific exam title found")
     return None
 
-def extract_metadata(file_bytes: bytes) -> dict:
-    logger.info("Extracting metadata from PDF")
-    
-    text, doc = extract_text_from_pdf(file_bytes)
-    
-    logger.info(f"Successfully extracted {len(text)} chars from document")
-    logger.info("Searching for patient information in document")
-    # Pattern più robusti per i dati anagrafici italiani
-    name_patterns = [
-        # Use non-greedy matching and better boundaries for formal titles
-        r"Sig\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Sig\.ra\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Signor[ae]?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Dott\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Dr\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Dr\.ssa\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"Prof\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        # Standard field patterns with boundaries
-        r"(?:Paziente|Nome)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"(?:Cognome)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"(?:Nome e cognome|Nominativo)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"(?:Assistito|Soggetto)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        r"(?:Destinatario|Per|Richiedente)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$|D\.|C\.F\.|\d)",
-        # Pattern for reports with name on next line
-        r"Nome[\s:.-]*\n\s*([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$)",
-        r"Paziente[\s:.-]*\n\s*([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)?)\s*(?:\n|$)"
-    ]
+# --- Pattern per i campi anagrafici e le date del referto ----------------------
+# Enhanced patterns for different medical report formats
+PATIENT_NAME_PATTERNS = [
+    # Direct format: Nome: Palumbo Maria Grazia (most specific for radiology)
+    r"Nome:\s+([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età|Age)",
+    # Standard format with boundaries
+    r"(?:Nome|Paziente|Patient)[\s:.-]+([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età|Age|D\.|C\.F\.|\d)",
+    # Medical center format: Center line + Name line
+    r"(?:Centro|Ambulatorio|Clinica).*?\n.*?Nome:\s*([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età)",
+    # Extended patterns from original with better boundaries
+    r"Sig\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d|Età)",
+    r"(?:Intestato a|Per)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
+    r"(?:Paziente)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
+    # Professional titles
+    r"(?:Dott\.?|Dr\.?|Prof\.?)\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
+    # Generic name patterns with better boundaries
+    r"([A-ZÀ-ÿ]{2,}\s+[A-ZÀ-ÿ]{2,}(?:\s+[A-ZÀ-ÿ]{2,})?)\s*(?:\d{2}|\n|Età|Age)"
+]
 
-    # Patterns for date of birth - enhanced for Italian medical documents
-    birth_date_patterns = [
-        r"(?:D\.?\s*Nasc\.?|Data di nascita|Nato il|Nata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:DN|d\.n\.|D\.N\.)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Nascita|Birth|Born)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Data nasc\.?|D\.nasc\.?)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Nato\/a il|Nato\/a in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Luogo e data di nascita).*?([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Nato a).*?(?:il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Nata a).*?(?:il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Data nascita|D\.nascita)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:D\.?\s*Nasc\.?|Data di nascita)[\s:.-]*\n\s*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
-    ]
-    
-    # Patterns for exam/report dates - comprehensive Italian medical formats
-    date_patterns = [
-        # Standard Italian exam date patterns
-        r"(?:Data|Data esame|Data referto|Data del referto)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Italian specific medical date patterns
-        r"(?:Refertato il|Refertazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Eseguito il|Effettuato il|Eseguito in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:In data|Il giorno|Nella giornata del)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Del|dell'|della)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Healthcare service patterns
-        r"(?:Prestazione del|Prestazione effettuata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Visitato il|Visita del|Visita effettuata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Controllo del|Controllo effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Appointment and procedure patterns
-        r"(?:Appuntamento del|Appuntamento in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Prelievo del|Prelievo effettuato il|Campionamento)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Analisi del|Analisi effettuate il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Administrative patterns
-        r"(?:Accettazione|Accettato il|Ricevuto il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Registrato il|Protocollato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        r"(?:Emesso il|Stampato il|Rilasciato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Time and date patterns
-        r"(?:Data e ora|Data e orario)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Patterns where date appears on next line
-        r"(?:Data|Data esame|Refertato il)[\s:.-]*\n\s*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-        # Fallback: Standalone date with 4-digit year (last resort)
-        r"([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{4})"
-    ]
-    
-    # Cerca nome paziente con i vari pattern
-    patient_name = None
-    
-    # Enhanced patterns for different medical report formats
-    enhanced_name_patterns = [
-        # Direct format: Nome: Palumbo Maria Grazia (most specific for radiology)
-        r"Nome:\s+([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età|Age)",
-        # Standard format with boundaries
-        r"(?:Nome|Paziente|Patient)[\s:.-]+([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età|Age|D\.|C\.F\.|\d)",
-        # Medical center format: Center line + Name line
-        r"(?:Centro|Ambulatorio|Clinica).*?\n.*?Nome:\s*([A-ZÀ-ÿ][a-zà-ÿ]+(?:\s+[A-ZÀ-ÿ][a-zà-ÿ]+)+?)(?:\s*\n|$|Età)",
-        # Extended patterns from original with better boundaries
-        r"Sig\.?\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d|Età)",
-        r"(?:Intestato a|Per)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
-        r"(?:Paziente)[\s:.-]+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
-        # Professional titles
-        r"(?:Dott\.?|Dr\.?|Prof\.?)\s+([A-ZÀ-ÿ]+(?:\s+[A-ZÀ-ÿ]+)*?)(?:\s*\n|$|D\.|C\.F\.|\d)",
-        # Generic name patterns with better boundaries
-        r"([A-ZÀ-ÿ]{2,}\s+[A-ZÀ-ÿ]{2,}(?:\s+[A-ZÀ-ÿ]{2,})?)\s*(?:\d{2}|\n|Età|Age)"
-    ]
-    
-    for pattern in enhanced_name_patterns:
-        name_match = re.search(pattern, text, re.I | re.MULTILINE)
+# Patterns for date of birth - enhanced for Italian medical documents
+BIRTH_DATE_PATTERNS = [
+    r"(?:D\.?\s*Nasc\.?|Data di nascita|Nato il|Nata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:DN|d\.n\.|D\.N\.)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Nascita|Birth|Born)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Data nasc\.?|D\.nasc\.?)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Nato\/a il|Nato\/a in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Luogo e data di nascita).*?([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Nato a).*?(?:il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Nata a).*?(?:il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Data nascita|D\.nascita)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:D\.?\s*Nasc\.?|Data di nascita)[\s:.-]*\n\s*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
+]
+
+# Patterns for exam/report dates - comprehensive Italian medical formats
+REPORT_DATE_PATTERNS = [
+    # Standard Italian exam date patterns
+    r"(?:Data|Data esame|Data referto|Data del referto)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Italian specific medical date patterns
+    r"(?:Refertato il|Refertazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Eseguito il|Effettuato il|Eseguito in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:In data|Il giorno|Nella giornata del)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Del|dell'|della)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Healthcare service patterns
+    r"(?:Prestazione del|Prestazione effettuata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Visitato il|Visita del|Visita effettuata il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Controllo del|Controllo effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Appointment and procedure patterns
+    r"(?:Appuntamento del|Appuntamento in data)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Prelievo del|Prelievo effettuato il|Campionamento)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Analisi del|Analisi effettuate il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Administrative patterns
+    r"(?:Accettazione|Accettato il|Ricevuto il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Registrato il|Protocollato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    r"(?:Emesso il|Stampato il|Rilasciato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Time and date patterns
+    r"(?:Data e ora|Data e orario)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Patterns where date appears on next line
+    r"(?:Data|Data esame|Refertato il)[\s:.-]*\n\s*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+    # Fallback: Standalone date with 4-digit year (last resort)
+    r"([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{4})"
+]
+
+_PATIENT_NAME_RES = [re.compile(p, re.I | re.MULTILINE) for p in PATIENT_NAME_PATTERNS]
+_BIRTH_DATE_RES = [re.compile(p, re.I) for p in BIRTH_DATE_PATTERNS]
+_REPORT_DATE_RES = [re.compile(p, re.I) for p in REPORT_DATE_PATTERNS]
+
+# --- Estrattori dei campi di extract_metadata ----------------------------------
+# Ogni estrattore riceve l'indice condiviso del testo (ReportText) e il documento
+# e restituisce i campi trovati.
+
+def _extract_patient_name(report: ReportText, doc: fitz.Document) -> dict:
+    logger.info("Searching for patient information in document")
+    for pattern in _PATIENT_NAME_RES:
+        name_match = pattern.search(report.text)
         if name_match:
             raw_name = name_match.group(1).strip()
             # Clean and validate the name
@@ -466,17 +571,16 @@ def extract_metadata(file_bytes: bytes) -> dict:
                 not re.search(r'[^\w\sÀ-ÿ\'-]', cleaned_name) and  # Only valid name characters
                 not any(word.lower() in ['data', 'centro', 'medico', 'via', 'tel', 'dott'] for word in cleaned_name.split())):  # Not administrative terms
                 
-                patient_name = cleaned_name
-                logger.info(f"Found patient name with pattern: {pattern} -> {patient_name}")
-                break
+                logger.info(f"Found patient name with pattern: {pattern.pattern} -> {cleaned_name}")
+                return {"patient_name": cleaned_name}
             else:
                 logger.debug(f"Found potential name but failed validation: {cleaned_name}")
                 continue
+    return {"patient_name": None}
 
-    # Cerca data di nascita
-    birth_date = None
-    for pattern in birth_date_patterns:
-        birth_match = re.search(pattern, text, re.I)
+def _extract_birth_date(report: ReportText, doc: fitz.Document) -> dict:
+    for pattern in _BIRTH_DATE_RES:
+        birth_match = pattern.search(report.text)
         if birth_match:
             try:
                 raw_birth_date = birth_match.group(1)
@@ -502,8 +606,8 @@ def extract_metadata(file_bytes: bytes) -> dict:
                         1900 <= year_int <= 2024):  # Reasonable birth year range
                         
                         birth_date = f"{day:0>2}/{month:0>2}/{year}"
-                        logger.info(f"Found birth date with pattern: {pattern} -> {birth_date}")
-                        break
+                        logger.info(f"Found birth date with pattern: {pattern.pattern} -> {birth_date}")
+                        return {"birth_date": birth_date}
                     else:
                         logger.warning(f"Birth date out of valid range: {normalized_birth_date}")
                         continue
@@ -514,11 +618,11 @@ def extract_metadata(file_bytes: bytes) -> dict:
             except (IndexError, ValueError) as e:
                 logger.warning(f"Error processing birth date: {str(e)}")
                 continue
-    
-    # Cerca data esame/referto con i vari pattern
-    report_date = None
-    for pattern in date_patterns:
-        date_match = re.search(pattern, text, re.I)
+    return {"birth_date": None}
+
+def _extract_report_date(report: ReportText, doc: fitz.Document) -> dict:
+    for pattern in _REPORT_DATE_RES:
+        date_match = pattern.search(report.text)
         if date_match:
             try:
                 # Safely extract the first capturing group
@@ -545,8 +649,8 @@ def extract_metadata(file_bytes: bytes) -> dict:
                         1980 <= year_int <= 2025):  # Reasonable exam date range
                         
                         report_date = f"{day:0>2}/{month:0>2}/{year}"
-                        logger.info(f"Found exam date with pattern: {pattern} -> {report_date}")
-                        break
+                        logger.info(f"Found exam date with pattern: {pattern.pattern} -> {report_date}")
+                        return {"report_date": report_date}
                     else:
                         logger.warning(f"Exam date out of valid range: {normalized_report_date}")
                         continue
@@ -555,225 +659,303 @@ def extract_metadata(file_bytes: bytes) -> dict:
                     continue
                     
             except (IndexError, ValueError) as e:
-                logger.warning(f"Pattern {pattern} matched but error processing date: {str(e)}")
+                logger.warning(f"Pattern {pattern.pattern} matched but error processing date: {str(e)}")
                 continue
-            
-    # Recupera codice fiscale
-    try:
-        codice_fiscale = find_cf(text, doc)
-        logger.info(f"Found CF: {codice_fiscale or 'Not found'}")
-    except Exception as e:
-        logger.error(f"Error finding CF: {str(e)}")
-        codice_fiscale = None
-    
+    return {"report_date": None}
+
+def _extract_codice_fiscale(report: ReportText, doc: fitz.Document) -> dict:
+    codice_fiscale = find_cf(report.text, doc)
+    logger.info(f"Found CF: {codice_fiscale or 'Not found'}")
+    return {"codice_fiscale": codice_fiscale}
+
+def _extract_report_type(report: ReportText, doc: fitz.Document) -> dict:
     # Get report title and classify report type
-    try:
-        report_title = extract_exam_title(text) or "sconosciuto"
-        report_category = classify_report_type(text, report_title)
-        logger.info(f"Report classification: {report_category} (title: {report_title})")
-    except Exception as e:
-        logger.error(f"Error extracting/classifying report type: {str(e)}")
-        report_title = "sconosciuto"
-        report_category = "laboratory"  # Default fallback
-    
+    report_title = extract_exam_title(report) or "sconosciuto"
+    report_category = classify_report_type(report, report_title)
+    logger.info(f"Report classification: {report_category} (title: {report_title})")
+    return {"report_type": report_title, "report_category": report_category}
+
+def _extract_lab_values(report: ReportText, doc: fitz.Document) -> dict:
     # Extract laboratory values (for all reports, but most relevant for laboratory type)
-    try:
-        lab_values = extract_laboratory_values(text)
-        logger.info(f"Extracted {len(lab_values)} laboratory parameters")
-    except Exception as e:
-        logger.error(f"Error extracting laboratory values: {str(e)}")
-        lab_values = {}
+    lab_values = extract_laboratory_values(report)
+    logger.info(f"Extracted {len(lab_values)} laboratory parameters")
+    return {"laboratory_values": lab_values}
+
+def _extract_dates(report: ReportText, doc: fitz.Document) -> dict:
+    # Extract all date types; use them for report_date if available,
+    # otherwise keep the date found by _extract_report_date
+    extracted_dates = extract_exam_dates(report)
+    fields = {"extracted_dates": extracted_dates}
+    for date_type in ('report_date', 'exam_date', 'acceptance_date'):
+        if date_type in extracted_dates:
+            fields["report_date"] = extracted_dates[date_type]
+            break
+    return fields
+
+# Pipeline: (estrattore, campi di ripiego in caso di errore, descrizione per il log).
+# Senza campi di ripiego l'errore viene propagato. L'ordine conta: _extract_dates
+# può sovrascrivere report_date.
+METADATA_EXTRACTORS = [
+    (_extract_patient_name, None, "extracting patient name"),
+    (_extract_birth_date, None, "extracting birth date"),
+    (_extract_report_date, None, "extracting report date"),
+    (_extract_codice_fiscale, {"codice_fiscale": None}, "finding CF"),
+    (_extract_report_type, {"report_type": "sconosciuto", "report_category": "laboratory"},
+     "extracting/classifying report type"),
+    (_extract_lab_values, {"laboratory_values": {}}, "extracting laboratory values"),
+    (_extract_dates, {"extracted_dates": {}}, "extracting dates"),
+]
+
+METADATA_FIELDS = [
+    "full_text", "patient_name", "birth_date", "codice_fiscale", "report_date",
+    "report_type", "report_category", "laboratory_values", "extracted_dates",
+    "ocr_failed_pages",
+]
+
+def extract_metadata(file_bytes: bytes | memoryview) -> dict:
+    logger.info("Extracting metadata from PDF")
+    
+    # Pagine con OCR fallito o scaduto: il testo estratto è incompleto
+    with track_ocr_failures() as ocr_failed_pages:
+        text, doc = extract_text_from_pdf(file_bytes)
+    
+    logger.info(f"Successfully extracted {len(text)} chars from document")
     
-    # Extract all date types
+    # Un solo pre-passaggio di tokenizzazione condiviso da tutti gli estrattori
+    report = ReportText(text)
+    fields = {"full_text": text, "ocr_failed_pages": sorted(set(ocr_failed_pages))}
     try:
-        extracted_dates = extract_exam_dates(text)
-        # Use extracted dates if available, fallback to existing logic
-        if 'report_date' in extracted_dates:
-            report_date = extracted_dates['report_date']
-        elif 'exam_date' in extracted_dates:
-            report_date = extracted_dates['exam_date']
-        elif 'acceptance_date' in extracted_dates:
-            report_date = extracted_dates['acceptance_date']
-        # Keep the existing report_date if no new dates found
-    except Exception as e:
-        logger.error(f"Error extracting dates: {str(e)}")
-        extracted_dates = {}
+        for extractor, fallback, description in METADATA_EXTRACTORS:
+            try:
+                fields.update(extractor(report, doc))
+            except Exception as e:
+                if fallback is None:
+                    raise
+                logger.error(f"Error {description}: {str(e)}")
+                fields.update(fallback)
+    finally:
+        doc.close()
     
-    return {
-        "full_text"          : text,
-        "patient_name"       : patient_name,
-        "birth_date"         : birth_date,
-        "codice_fiscale"     : codice_fiscale,
-        "report_date"        : report_date,
-        "report_type"        : report_title,
-        "report_category"    : report_category,
-        "laboratory_values"  : lab_values,
-        "extracted_dates"    : extracted_dates,
-    }
+    return {field: fields[field] for field in METADATA_FIELDS}
+
+def extract_metadata_from_file(path: str) -> dict:
+    """
+    Same as extract_metadata, reading the stored PDF through a read-only mmap
+    instead of loading its bytes in memory.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            # Il documento viene chiuso da extract_metadata prima di rilasciare la mappa
+            return extract_metadata(view)
+        finally:
+            view.release()
+
+# Nomi di esami noti, in ordine di priorità (a parità di nome in maiuscolo vince il primo)
+KNOWN_LAB_TESTS = [
+    # Urinalysis
+    'Colore', 'Aspetto', 'Limpidezza', 'Ph', 'PH', 'Glucosio', 'Proteine',
+    'Emoglobina', 'Corpi Chetonici', 'Bilirubina', 'Urobilinogeno',
+    'Peso Specifico', 'Densità', 'Nitriti', 'Esterasi Leucocitaria',
+
+    # Hematology
+    'WBC', 'RBC', 'HGB', 'HCT', 'MCV', 'MCH', 'MCHC', 'RDW', 'PLT', 'MPV',
+    'NEU', 'LYN', 'MON', 'EOS', 'BAS',
+
+    # Chemistry
+    'GLUCOSIO', 'CREATININA', 'UREA', 'SODIO', 'POTASSIO', 'CALCIO', 'ALBUMINA',
+    'BILIRUBINA TOTALE', 'GOT/AST', 'GPT/ALT', 'CPK', 'INR', 'PTT',
+    'PROTEINA C REATTIVA', 'AMILASI PANCREATICA', 'COLINESTERASI',
+    'ATTIVITA\' PROTROMBINICA'
+]
+
+# Nome in maiuscolo -> (priorità, nome canonico)
+_KNOWN_LAB_TESTS_BY_UPPER = {}
+for _index, _name in enumerate(KNOWN_LAB_TESTS):
+    _KNOWN_LAB_TESTS_BY_UPPER.setdefault(_name.upper(), (_index, _name))
+
+# Righe amministrative (intestazione, contatti, anagrafica, firme, piè di pagina),
+# definite una volta sola: compongono LAB_EXCLUDE_PATTERNS e ADMIN_BOILERPLATE_PATTERNS
+_ASL, _TEL, _DIRETTORE, _VIALE, _EMAIL = r'A\.S\.L\.', r'TEL\.', 'DIRETTORE', 'VIALE', 'EMAIL'
+_ADMIN_CONTACTS = r'(lab\.ospmare@libero\.it|081-18775094|Metamorfosi)'
+_ADMIN_PATIENT_FIELDS = r'(Cod\.|Sig\.|Provenienza|C\.F\.|Nosologico|D\.Nasc\.)'
+_ADMIN_WORKFLOW = 'Accettato il|Refertato il'
+_ADMIN_SIGNATURES = r'(IL T\.S\.L\.B\.|IL SANITARIO RESPONSABILE|Pag\.)'
+_ADMIN_FOOTER = ('fine referto', '§S§')
+
+# Le stesse righe, tolte dal testo dei referti inviato al modello (prompt_builder).
+# Qui 'A.S.L.' e 'TEL.' sono seguiti da uno spazio, quindi senza \b finale.
+ADMIN_BOILERPLATE_PATTERNS = (
+    rf'\b({_ASL}|{_TEL})|\b({_DIRETTORE}|{_VIALE}|{_EMAIL})\b',
+    _ADMIN_CONTACTS,
+    _ADMIN_PATIENT_FIELDS,
+    rf'({_ADMIN_WORKFLOW})',
+    _ADMIN_SIGNATURES,
+    f'({"|".join(_ADMIN_FOOTER)})',
+)
 
-def extract_laboratory_values(text: str) -> dict:
+# Exclude patterns - lines that are definitely not lab values
+LAB_EXCLUDE_PATTERNS = [
+    rf'\b({_ASL}|OSPEDALE|PATOLOGIA|CLINICA|{_DIRETTORE}|{_VIALE}|NAPOLI|{_TEL}|{_EMAIL})\b',
+    _ADMIN_CONTACTS,
+    _ADMIN_PATIENT_FIELDS,
+    rf'({_ADMIN_WORKFLOW}|ESAME|RISULTATO|UNITA)',
+    _ADMIN_SIGNATURES,
+    r'(ESAME CHIMICO FISICO|ESAME EMOCROMOCITOMETRICO|FORMULA LEUCOCITARIA)',
+    rf'(SEDIMENTO:|{_ADMIN_FOOTER[0]}|\.\.\.|{_ADMIN_FOOTER[1]})',
+    r'^\s*[0-9]+/mm3\s*$',  # Unit-only lines
+    r'RIFERIMENTO\s*$',  # Reference header
+    # Add administrative and non-medical data exclusions
+    r'\b(Data:|Nome:|Età:|ID PAZIENTE|Centro Medico|per la Diagnosi|Direttore)\b',
+    r'\b(Via\s+\w+|Tel\.|www\.|\.it)\b',
+    r'\b(Ecocolordopplergrafia|L\'esame eseguito|ha evidenziato)\b',
+    r'\b(Circolo venoso|profondo|superficiale)\b',
+    r'^\s*\d{1,2}:\s*\d{1,2}\s*$',  # Time patterns
+    r'^\s*\d{1,2}/\d{1,2}/\d{4}\s*$',  # Date patterns
+    r'^\s*\d+\s*$'  # Pure numbers without context
+]
+
+# Un'unica regex: una riga è esclusa se almeno un pattern la trova
+_LAB_EXCLUDE_RE = re.compile("|".join(f"(?:{p})" for p in LAB_EXCLUDE_PATTERNS), re.IGNORECASE)
+
+_LAB_SINGLE_LINE_RES = [re.compile(p, re.IGNORECASE) for p in [
+    # Italian format: Proteine: 15 * mg/dl (0 - 10)
+    r'^([A-Za-z\s]+):\s+([0-9]+[.,]?[0-9]*|\w+)\s*(\*?)\s*([a-zA-Z%/]+)?\s*(?:\(([^)]+)\))?',
+
+    # Common hematology format: TEST VALUE UNIT
+    r'^(WBC|RBC|HGB|HCT|MCV|MCH|MCHC|RDW|PLT|MPV|NEU|LYN|MON|EOS|BAS)\s+([0-9]+[.,]?[0-9]*)\s*(\*?)\s*([^\s]+)?',
+
+    # Chemistry with reference ranges: TEST VALUE UNIT REFERENCE
+    r'^([A-Z][A-Za-z\s/]{2,25}?)\s+([0-9]+[.,]?[0-9]*)\s*(\*?)\s*([a-zA-Z%/]+)?\s+([0-9]+[.,]?[0-9]*\s*[-–]\s*[0-9]+[.,]?[0-9]*)',
+
+    # Simple test value format
+    r'^([A-Z]{3,})\s+([0-9]+[.,]?[0-9]*)\s*(\*?)'
+]]
+
+_LAB_NUMERIC_VALUE_RE = re.compile(r'([0-9]+[.,]?[0-9]*)\s*(\*?)')
+_LAB_PURE_NUMBER_RE = re.compile(r'^[0-9]+[.,]?[0-9]*$')
+
+_MULTILINE_QUALITATIVE = (
+    'ASSENTE', 'ASSENTI', 'NEGATIVO', 'POSITIVO', 'GIALLO', 'PAGLIERINO',
+    'VELATO', 'LIMPIDO', 'TORBIDO'
+)
+_SINGLE_LINE_QUALITATIVE = _MULTILINE_QUALITATIVE + (
+    'PRESENTE', 'PRESENTI', 'NORMALE', 'ALTERATO', 'ALTO', 'BASSO'
+)
+_LAB_UNITS = ('mg/dl', 'g/dl', 'EU/dl', 'Leu/ul', 'mm3', '/mm3', '%', 'ng/ml', 'mU/ml')
+
+# Skip administrative/demographic fields that aren't lab tests
+_LAB_ADMIN_FIELDS = frozenset([
+    'DATA', 'NOME', 'ETA', 'PAZIENTE', 'CODICE', 'ID',
+    'VIA', 'TEL', 'TELEFONO', 'EMAIL', 'CENTRO', 'AMBULATORIO',
+    'MEDICO', 'DOTTORE', 'SPECIALISTA', 'OSPEDALE', 'CLINICA',
+    'REPARTO', 'SERVIZIO', 'DIAGNOSI', 'CONCLUSIONI'
+])
+
+
+def _match_known_test(upper_line: str) -> str | None:
+    """
+    Known test name for a line: the whole line, or else the highest-priority
+    name followed by a space or tab at the start of the line.
+    """
+    exact = _KNOWN_LAB_TESTS_BY_UPPER.get(upper_line)
+    if exact:
+        return exact[1]
+
+    best = None
+    for pos, ch in enumerate(upper_line):
+        if ch == ' ' or ch == '\t':
+            candidate = _KNOWN_LAB_TESTS_BY_UPPER.get(upper_line[:pos])
+            if candidate and (best is None or candidate[0] < best[0]):
+                best = candidate
+    return best[1] if best else None
+
+
+def extract_laboratory_values(text: str | ReportText) -> dict:
     """
     Extract laboratory test values, units, and reference ranges from Italian medical reports.
     Handles both single-line and multi-line formats.
     """
     logger.info("Extracting laboratory values from text")
-    
+
     lab_values = {}
-    lines = text.split('\n')
-    
-    # Known test names for exact matching
-    known_tests = [
-        # Urinalysis
-        'Colore', 'Aspetto', 'Limpidezza', 'Ph', 'PH', 'Glucosio', 'Proteine', 
-        'Emoglobina', 'Corpi Chetonici', 'Bilirubina', 'Urobilinogeno', 
-        'Peso Specifico', 'Densità', 'Nitriti', 'Esterasi Leucocitaria',
-        
-        # Hematology
-        'WBC', 'RBC', 'HGB', 'HCT', 'MCV', 'MCH', 'MCHC', 'RDW', 'PLT', 'MPV',
-        'NEU', 'LYN', 'MON', 'EOS', 'BAS',
-        
-        # Chemistry
-        'GLUCOSIO', 'CREATININA', 'UREA', 'SODIO', 'POTASSIO', 'CALCIO', 'ALBUMINA',
-        'BILIRUBINA TOTALE', 'GOT/AST', 'GPT/ALT', 'CPK', 'INR', 'PTT',
-        'PROTEINA C REATTIVA', 'AMILASI PANCREATICA', 'COLINESTERASI',
-        'ATTIVITA\' PROTROMBINICA'
-    ]
-    
-    # Exclude patterns - lines that are definitely not lab values
-    exclude_patterns = [
-        r'\b(A\.S\.L\.|OSPEDALE|PATOLOGIA|CLINICA|DIRETTORE|VIALE|NAPOLI|TEL\.|EMAIL)\b',
-        r'(lab\.ospmare@libero\.it|081-18775094|Metamorfosi)',
-        r'(Cod\.|Sig\.|Provenienza|C\.F\.|Nosologico|D\.Nasc\.)',
-        r'(Accettato il|Refertato il|ESAME|RISULTATO|UNITA)',
-        r'(IL T\.S\.L\.B\.|IL SANITARIO RESPONSABILE|Pag\.)',
-        r'(ESAME CHIMICO FISICO|ESAME EMOCROMOCITOMETRICO|FORMULA LEUCOCITARIA)',
-        r'(SEDIMENTO:|fine referto|\.\.\.|§S§)',
-        r'^\s*[0-9]+/mm3\s*$',  # Unit-only lines
-        r'RIFERIMENTO\s*$',  # Reference header
-        # Add administrative and non-medical data exclusions
-        r'\b(Data:|Nome:|Età:|ID PAZIENTE|Centro Medico|per la Diagnosi|Direttore)\b',
-        r'\b(Via\s+\w+|Tel\.|www\.|\.it)\b',
-        r'\b(Ecocolordopplergrafia|L\'esame eseguito|ha evidenziato)\b',
-        r'\b(Circolo venoso|profondo|superficiale)\b',
-        r'^\s*\d{1,2}:\s*\d{1,2}\s*$',  # Time patterns
-        r'^\s*\d{1,2}/\d{1,2}/\d{4}\s*$',  # Date patterns
-        r'^\s*\d+\s*$'  # Pure numbers without context
-    ]
-    
+
+    # Tokenizzazione unica (condivisa con gli altri estrattori): riga ripulita,
+    # versione maiuscola ed esclusione
+    report = ReportText.of(text)
+    lines = report.stripped_lines
+    upper_lines = report.upper_lines
+    excluded = [len(line) < 2 or _LAB_EXCLUDE_RE.search(line) is not None for line in lines]
+    n_lines = len(lines)
+
     # Process lines sequentially for multi-line format
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # Skip empty or excluded lines
-        if (len(line) < 2 or 
-            any(re.search(pattern, line, re.IGNORECASE) for pattern in exclude_patterns)):
-            i += 1
+    for i, line in enumerate(lines):
+        if excluded[i]:
             continue
-        
-        # Check if current line is a test name
-        test_name = None
-        for known_test in known_tests:
-            if line.upper() == known_test.upper() or line.strip() == known_test:
-                test_name = known_test
-                break
-        
-        # Also check for test names that start the line
+
+        test_name = _match_known_test(upper_lines[i])
         if not test_name:
-            for known_test in known_tests:
-                if line.upper().startswith(known_test.upper() + ' ') or line.upper().startswith(known_test.upper() + '\t'):
-                    test_name = known_test
-                    # Extract value from same line if present
-                    remaining = line[len(known_test):].strip()
-                    if remaining:
-                        # Process as single-line format
-                        pass
-                    break
-        
-        if test_name:
-            # Look for value on next lines (multi-line format)
-            value = None
-            unit = None
-            reference = None
-            abnormal = False
-            
-            # Check next 4 lines for value, unit, reference
-            for offset in range(1, min(5, len(lines) - i)):
-                next_line = lines[i + offset].strip()
-                
-                if not next_line:
-                    continue
-                
-                # Stop if we hit another test name
-                if any(next_line.upper() == test.upper() for test in known_tests):
-                    break
-                
-                # Extract value if not found yet
-                if value is None:
-                    # Check for numeric value with possible abnormal flag
-                    numeric_match = re.search(r'([0-9]+[.,]?[0-9]*)\s*(\*?)', next_line)
-                    if numeric_match:
-                        value = numeric_match.group(1)
-                        if numeric_match.group(2) == '*':
-                            abnormal = True
-                    # Check for qualitative values
-                    elif any(qual in next_line.upper() for qual in [
-                        'ASSENTE', 'ASSENTI', 'NEGATIVO', 'POSITIVO', 'GIALLO', 'PAGLIERINO',
-                        'VELATO', 'LIMPIDO', 'TORBIDO'
-                    ]):
-                        value = next_line
-                        abnormal = '*' in next_line
-                
-                # Extract unit if it looks like one
-                elif not unit and len(next_line) < 15 and any(u in next_line for u in [
-                    'mg/dl', 'g/dl', 'EU/dl', 'Leu/ul', 'mm3', '/mm3', '%', 'ng/ml', 'mU/ml'
-                ]):
-                    unit = next_line
-                
-                # Extract reference range
-                elif not reference and ('-' in next_line or next_line.upper() in ['ASSENTE', 'ASSENTI']):
-                    reference = next_line
-            
-            # Store if we found a value
-            if value:
-                lab_values[test_name] = {
-                    'value': value,
-                    'unit': unit or '',
-                    'reference': reference or '',
-                    'abnormal': abnormal,
-                    'type': 'multiline',
-                    'category': determine_test_category(test_name),
-                    'line_number': i + 1
-                }
-                logger.debug(f"Extracted multiline lab value: {test_name} = {value}")
-        
-        i += 1
-    
+            continue
+
+        # Look for value on next lines (multi-line format)
+        value = None
+        unit = None
+        reference = None
+        abnormal = False
+
+        # Check next 4 lines for value, unit, reference
+        for j in range(i + 1, min(i + 5, n_lines)):
+            next_line = lines[j]
+
+            if not next_line:
+                continue
+
+            # Stop if we hit another test name
+            if upper_lines[j] in _KNOWN_LAB_TESTS_BY_UPPER:
+                break
+
+            # Extract value if not found yet
+            if value is None:
+                # Check for numeric value with possible abnormal flag
+                numeric_match = _LAB_NUMERIC_VALUE_RE.search(next_line)
+                if numeric_match:
+                    value = numeric_match.group(1)
+                    if numeric_match.group(2) == '*':
+                        abnormal = True
+                # Check for qualitative values
+                elif any(qual in upper_lines[j] for qual in _MULTILINE_QUALITATIVE):
+                    value = next_line
+                    abnormal = '*' in next_line
+
+            # Extract unit if it looks like one
+            elif not unit and len(next_line) < 15 and any(u in next_line for u in _LAB_UNITS):
+                unit = next_line
+
+            # Extract reference range
+            elif not reference and ('-' in next_line or upper_lines[j] in ('ASSENTE', 'ASSENTI')):
+                reference = next_line
+
+        # Store if we found a value
+        if value:
+            lab_values[test_name] = {
+                'value': value,
+                'unit': unit or '',
+                'reference': reference or '',
+                'abnormal': abnormal,
+                'type': 'multiline',
+                'category': determine_test_category(test_name),
+                'line_number': i + 1
+            }
+            logger.debug(f"Extracted multiline lab value: {test_name} = {value}")
+
     # Also try single-line patterns for blood chemistry
-    single_line_patterns = [
-        # Italian format: Proteine: 15 * mg/dl (0 - 10)
-        r'^([A-Za-z\s]+):\s+([0-9]+[.,]?[0-9]*|\w+)\s*(\*?)\s*([a-zA-Z%/]+)?\s*(?:\(([^)]+)\))?',
-        
-        # Common hematology format: TEST VALUE UNIT
-        r'^(WBC|RBC|HGB|HCT|MCV|MCH|MCHC|RDW|PLT|MPV|NEU|LYN|MON|EOS|BAS)\s+([0-9]+[.,]?[0-9]*)\s*(\*?)\s*([^\s]+)?',
-        
-        # Chemistry with reference ranges: TEST VALUE UNIT REFERENCE  
-        r'^([A-Z][A-Za-z\s/]{2,25}?)\s+([0-9]+[.,]?[0-9]*)\s*(\*?)\s*([a-zA-Z%/]+)?\s+([0-9]+[.,]?[0-9]*\s*[-–]\s*[0-9]+[.,]?[0-9]*)',
-        
-        # Simple test value format
-        r'^([A-Z]{3,})\s+([0-9]+[.,]?[0-9]*)\s*(\*?)'
-    ]
-    
     for line_num, line in enumerate(lines):
-        line = line.strip()
-        
         # Skip if already processed or invalid
-        if (len(line) < 5 or 
-            any(re.search(pattern, line, re.IGNORECASE) for pattern in exclude_patterns)):
+        if len(line) < 5 or excluded[line_num]:
             continue
-        
-        for pattern in single_line_patterns:
-            match = re.search(pattern, line, re.IGNORECASE)
+
+        for pattern in _LAB_SINGLE_LINE_RES:
+            match = pattern.search(line)
             if match:
                 groups = match.groups()
                 test_name = groups[0].strip()
@@ -781,41 +963,27 @@ def extract_laboratory_values(text: str) -> dict:
                 abnormal_flag = groups[2] if len(groups) > 2 else ""
                 unit = groups[3] if len(groups) > 3 and groups[3] else ""
                 reference = groups[4] if len(groups) > 4 and groups[4] else ""
-                
+
                 # For Italian format with colon, clean up test name
                 if ':' in test_name:
                     test_name = test_name.replace(':', '').strip()
-                
+
                 # Skip if already extracted or invalid name
-                if (test_name in lab_values or 
-                    len(test_name) < 2 or 
+                if (test_name in lab_values or
+                    len(test_name) < 2 or
                     test_name.isdigit()):
                     continue
-                
-                # Skip administrative/demographic fields that aren't lab tests
-                admin_fields = [
-                    'DATA', 'NOME', 'ETA', 'PAZIENTE', 'CODICE', 'ID',
-                    'VIA', 'TEL', 'TELEFONO', 'EMAIL', 'CENTRO', 'AMBULATORIO',
-                    'MEDICO', 'DOTTORE', 'SPECIALISTA', 'OSPEDALE', 'CLINICA',
-                    'REPARTO', 'SERVIZIO', 'DIAGNOSI', 'CONCLUSIONI'
-                ]
-                
-                if test_name.upper() in admin_fields:
+
+                if test_name.upper() in _LAB_ADMIN_FIELDS:
                     continue
-                
+
                 # For non-numeric values, ensure they look like medical test results
-                if not re.match(r'^[0-9]+[.,]?[0-9]*$', value):
-                    # Allow specific qualitative medical values
-                    valid_qualitative = [
-                        'ASSENTE', 'ASSENTI', 'NEGATIVO', 'POSITIVO', 'GIALLO', 'PAGLIERINO',
-                        'VELATO', 'LIMPIDO', 'TORBIDO', 'PRESENTE', 'PRESENTI', 'NORMALE',
-                        'ALTERATO', 'ALTO', 'BASSO'
-                    ]
-                    if not any(qual in value.upper() for qual in valid_qualitative):
+                if not _LAB_PURE_NUMBER_RE.match(value):
+                    if not any(qual in value.upper() for qual in _SINGLE_LINE_QUALITATIVE):
                         continue
-                
+
                 abnormal = '*' in abnormal_flag or '*' in line
-                
+
                 lab_values[test_name] = {
                     'value': value,
                     'unit': unit,
@@ -827,10 +995,11 @@ def extract_laboratory_values(text: str) -> dict:
                 }
                 logger.debug(f"Extracted single-line lab value: {test_name} = {value}")
                 break
-    
+
     logger.info(f"Extracted {len(lab_values)} laboratory values")
     return lab_values
 
+@lru_cache(maxsize=1024)
 def determine_test_category(test_name: str) -> str:
     """Determine the category of a laboratory test based on its name."""
     test_upper = test_name.upper()
@@ -865,33 +1034,39 @@ def determine_test_category(test_name: str) -> str:
     else:
         return 'chemistry'
 
-def extract_exam_dates(text: str) -> dict:
+# Enhanced date patterns for Italian medical reports
+EXAM_DATE_PATTERNS = {
+    'exam_date': [
+        r"(?:Data esame|Data del esame)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+        r"(?:Eseguito il|Effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+        r"(?:Prelievo|Prelievo del|Prelievo effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
+    ],
+    'report_date': [
+        r"(?:Refertato il|Refertazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+        r"(?:Data referto|Data del referto)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
+    ],
+    'acceptance_date': [
+        r"(?:Accettato il|Accettazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
+        r"(?:Ricevuto il|Data accettazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
+    ]
+}
+
+_EXAM_DATE_RES = {
+    date_type: [re.compile(p, re.I) for p in patterns]
+    for date_type, patterns in EXAM_DATE_PATTERNS.items()
+}
+
+def extract_exam_dates(text: str | ReportText) -> dict:
     """
     Extract various dates from Italian medical reports.
     Returns a dictionary with different types of dates found.
     """
     dates = {}
+    text = ReportText.of(text).text
     
-    # Enhanced date patterns for Italian medical reports
-    date_patterns = {
-        'exam_date': [
-            r"(?:Data esame|Data del esame)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-            r"(?:Eseguito il|Effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-            r"(?:Prelievo|Prelievo del|Prelievo effettuato il)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
-        ],
-        'report_date': [
-            r"(?:Refertato il|Refertazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-            r"(?:Data referto|Data del referto)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
-        ],
-        'acceptance_date': [
-            r"(?:Accettato il|Accettazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})",
-            r"(?:Ricevuto il|Data accettazione)[\s:.-]*([0-9]{1,2}[/.-][0-9]{1,2}[/.-][0-9]{2,4})"
-        ]
-    }
-    
-    for date_type, patterns in date_patterns.items():
+    for date_type, patterns in _EXAM_DATE_RES.items():
         for pattern in patterns:
-            match = re.search(pattern, text, re.I)
+            match = pattern.search(text)
             if match:
                 date_str = match.group(1)
                 # Normalize date format
@@ -902,14 +1077,23 @@ def extract_exam_dates(text: str) -> dict:
     
     return dates
 
-def classify_report_type(text: str, exam_title: str = None) -> str:
+# Structured laboratory data patterns (strong indicator of a lab report)
+_STRUCTURED_LAB_VALUE_RES = [re.compile(p) for p in [
+    r'\b[A-Z][A-Z\s]+\s*[:=]\s*[0-9]+[.,]?[0-9]*\s*[a-zA-Z/%]*',  # TEST: 123 mg/dl
+    r'\b[A-Z]{2,}\s*[0-9]+[.,]?[0-9]*\s*[a-zA-Z/%]*',  # HGB 12.5 g/dl
+    r'[0-9]+[.,]?[0-9]*\s*[-–]\s*[0-9]+[.,]?[0-9]*',  # Reference ranges
+]]
+
+def classify_report_type(text: str | ReportText, exam_title: str = None) -> str:
     """
     Classify medical reports into three main categories:
     - laboratory: structured lab tests with name-value pairs
     - radiology: imaging-based descriptive reports 
     - pathology: tissue/cell analysis descriptive reports
     """
-    text_upper = text.upper()
+    report = ReportText.of(text)
+    text = report.text
+    text_upper = report.upper
     title_upper = (exam_title or "").upper()
     
     # Laboratory report indicators (structured data with values)
@@ -966,16 +1150,9 @@ def classify_report_type(text: str, exam_title: str = None) -> str:
     pathology_score = sum(1 for keyword in pathology_keywords if keyword in text_upper or keyword in title_upper)
     
     # Look for structured laboratory data patterns (strong indicator)
-    lab_value_patterns = [
-        r'\b[A-Z][A-Z\s]+\s*[:=]\s*[0-9]+[.,]?[0-9]*\s*[a-zA-Z/%]*',  # TEST: 123 mg/dl
-        r'\b[A-Z]{2,}\s*[0-9]+[.,]?[0-9]*\s*[a-zA-Z/%]*',  # HGB 12.5 g/dl
-        r'[0-9]+[.,]?[0-9]*\s*[-–]\s*[0-9]+[.,]?[0-9]*',  # Reference ranges
-    ]
-    
     structured_data_count = 0
-    for pattern in lab_value_patterns:
-        matches = re.findall(pattern, text)
-        structured_data_count += len(matches)
+    for pattern in _STRUCTURED_LAB_VALUE_RES:
+        structured_data_count += len(pattern.findall(text))
     
     # Boost laboratory score if structured data is found
     if structured_data_count >= 3:
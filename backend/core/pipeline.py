@@ -0,0 +1,113 @@
+# backend/core/pipeline.py
+#
+# Stadi dell'analisi dei referti con concorrenza limitata, per non bloccare
+# l'event loop di FastAPI:
+#   - parsing dei PDF in un pool di processi  (ANALYZE_PARSE_WORKERS)
+#   - chiamate all'LLM in un pool di thread   (ANALYZE_LLM_CONCURRENCY)
+#   - accesso al database in un pool di thread (ANALYZE_DB_CONCURRENCY)
+
+import os
+import asyncio
+import logging
+import contextvars
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from core.extraction_cache import get_cached_metadata, store_cached_metadata
+from core.pdf_parser import extract_metadata_from_file
+from core.llm_client import OLLAMA_MAX_PARALLEL
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Configurazione da variabili d'ambiente (0 workers di parsing = parsing in un thread)
+ANALYZE_PARSE_WORKERS = int(os.getenv("ANALYZE_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Di default quante chiamate il server Ollama esegue in parallelo: un limite più basso
+# lascerebbe inattivi slot del server, uno più alto accoda solo sul semaforo del client
+ANALYZE_LLM_CONCURRENCY = int(os.getenv("ANALYZE_LLM_CONCURRENCY", str(OLLAMA_MAX_PARALLEL)))
+ANALYZE_DB_CONCURRENCY = int(os.getenv("ANALYZE_DB_CONCURRENCY", "4"))
+
+_parse_pool = None
+_parse_pool_lock = Lock()
+
+_llm_executor = ThreadPoolExecutor(max_workers=max(1, ANALYZE_LLM_CONCURRENCY), thread_name_prefix="llm")
+_db_executor = ThreadPoolExecutor(max_workers=max(1, ANALYZE_DB_CONCURRENCY), thread_name_prefix="db")
+
+
+def _init_parse_worker():
+    # Il pool OCR eventualmente ereditato dal padre con fork non è utilizzabile nel figlio
+    from core import ocr_engine
+    ocr_engine._pool = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Return the shared PDF parsing process pool, creating it on first use."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            logger.info(f"Starting PDF parsing process pool with {ANALYZE_PARSE_WORKERS} workers")
+            _parse_pool = ProcessPoolExecutor(max_workers=ANALYZE_PARSE_WORKERS, initializer=_init_parse_worker)
+        return _parse_pool
+
+
+def _reset_parse_pool():
+    """Drop a broken pool so the next call starts a fresh one."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def _parse_in_worker(path: str) -> dict:
+    """Parse a stored PDF. Runs in a worker process."""
+    try:
+        return extract_metadata_from_file(path)
+    except Exception as e:
+        # Le eccezioni di PyMuPDF non sempre si possono deserializzare nel padre
+        raise RuntimeError(str(e)) from None
+
+
+async def parse_stored_pdf(path: str, digest: str) -> dict:
+    """
+    Metadata of a stored PDF: served from the extraction cache, or parsed in the
+    process pool (at most ANALYZE_PARSE_WORKERS documents at a time).
+    """
+    meta = await asyncio.to_thread(get_cached_metadata, digest)
+    if meta is not None:
+        return meta
+
+    if ANALYZE_PARSE_WORKERS <= 0:
+        meta = await asyncio.to_thread(extract_metadata_from_file, path)
+    else:
+        loop = asyncio.get_running_loop()
+        try:
+            meta = await loop.run_in_executor(_get_parse_pool(), _parse_in_worker, path)
+        except BrokenProcessPool:
+            logger.error("PDF parsing pool is broken, restarting it")
+            _reset_parse_pool()
+            raise
+
+    await asyncio.to_thread(store_cached_metadata, digest, meta)
+    return meta
+
+
+def _run_in_context(executor, fn, *args, **kwargs):
+    # I context var della richiesta (es. il ledger LLM) seguono il lavoro nel thread
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, partial(context.run, fn, *args, **kwargs))
+
+
+async def run_llm(fn, *args, **kwargs):
+    """Run a blocking LLM call with at most ANALYZE_LLM_CONCURRENCY in flight."""
+    return await _run_in_context(_llm_executor, fn, *args, **kwargs)
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run blocking database work with at most ANALYZE_DB_CONCURRENCY in flight."""
+    return await _run_in_context(_db_executor, fn, *args, **kwargs)
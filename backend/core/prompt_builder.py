@@ -0,0 +1,141 @@
+# backend/core/prompt_builder.py
+#
+# Testo dei referti da inserire nei prompt, entro un budget di token per
+# template: vengono tolte le righe amministrative (stessi frammenti del parser),
+# i marcatori di pagina OCR e le intestazioni ripetute; se il testo supera
+# ancora il budget si tengono prima le sezioni cliniche (conclusioni, diagnosi,
+# reperti, valori alterati) e poi l'inizio del referto.
+
+import os
+import re
+import math
+import logging
+
+from core.pdf_parser import ADMIN_BOILERPLATE_PATTERNS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Budget in token del testo dei referti (esclusa la parte fissa del prompt);
+# per il confronto il budget è diviso tra i due referti
+PROMPT_REPORT_TOKEN_BUDGET = int(os.getenv("PROMPT_REPORT_TOKEN_BUDGET", "2500"))
+PROMPT_COMPARISON_TOKEN_BUDGET = int(os.getenv("PROMPT_COMPARISON_TOKEN_BUDGET", "2500"))
+
+# Stima per testo italiano con il tokenizer di Gemma
+CHARS_PER_TOKEN = 3.5
+
+OMISSION_MARKER = "[...]"
+
+# Le intestazioni ripetute su ogni pagina sono righe lunghe identiche
+_MIN_DEDUP_LINE_CHARS = 25
+
+_BOILERPLATE_RE = re.compile("|".join(f"(?:{p})" for p in ADMIN_BOILERPLATE_PATTERNS), re.IGNORECASE)
+_PAGE_MARKER_RE = re.compile(r"^-+\s*PAGINA\s+\d+\s*-+$", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Intestazione di sezione clinica, da sola sulla riga o seguita da ':'
+_CLINICAL_HEADING_RE = re.compile(
+    r"^(CONCLUSION[EI]|DIAGNOSI|IMPRESSIONE|ESITO|GIUDIZIO|COMMENTO|REPERT[OI]|QUESITO|NOTE)\b[\w ]{0,30}(:|$)",
+    re.IGNORECASE
+)
+# Intestazione generica: riga breve tutta in maiuscolo, eventualmente con ':'
+_HEADING_RE = re.compile(r"^[A-ZÀ-Ý][A-ZÀ-Ý .'/]{3,40}:?$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a text for the model's tokenizer."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def strip_boilerplate(text: str) -> str:
+    """Drop administrative lines, OCR page markers, blank lines and repeated headers."""
+    lines, seen = [], set()
+    for raw_line in text.splitlines():
+        line = _WHITESPACE_RE.sub(" ", raw_line).strip()
+        if not line or _PAGE_MARKER_RE.match(line) or _BOILERPLATE_RE.search(line):
+            continue
+        if len(line) >= _MIN_DEDUP_LINE_CHARS:
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _clinical_lines(lines: list[str]) -> list[bool]:
+    """Lines that belong to a clinical section (heading up to the next heading) or flag an abnormal value."""
+    mask, in_section = [], False
+    for line in lines:
+        if _CLINICAL_HEADING_RE.match(line):
+            in_section = True
+        elif _HEADING_RE.match(line):
+            in_section = False
+        mask.append(in_section or "*" in line)
+    return mask
+
+
+def _fit_lines(lines: list[str], budget_chars: int) -> list[str]:
+    if sum(len(line) + 1 for line in lines) <= budget_chars:
+        return lines
+
+    clinical = _clinical_lines(lines)
+    keep = [False] * len(lines)
+    used = 0
+    # Prima le sezioni cliniche (tutte quelle che entrano), poi l'inizio del referto
+    for i, line in enumerate(lines):
+        if clinical[i] and used + len(line) + 1 <= budget_chars:
+            keep[i] = True
+            used += len(line) + 1
+    for i, line in enumerate(lines):
+        if keep[i] or clinical[i]:
+            continue
+        if used + len(line) + 1 > budget_chars:
+            break
+        keep[i] = True
+        used += len(line) + 1
+
+    fitted, omitted = [], False
+    for line, kept in zip(lines, keep):
+        if kept:
+            if omitted:
+                fitted.append(OMISSION_MARKER)
+                omitted = False
+            fitted.append(line)
+        else:
+            omitted = True
+    if omitted:
+        fitted.append(OMISSION_MARKER)
+    return fitted
+
+
+def fit_report_text(text: str, budget_tokens: int) -> str:
+    """Report text without boilerplate, cut down to roughly budget_tokens."""
+    # Margine per i marcatori di omissione
+    budget_chars = int(budget_tokens * CHARS_PER_TOKEN * 0.95)
+    return "\n".join(_fit_lines(strip_boilerplate(text).split("\n"), budget_chars))
+
+
+def build_report_context(text: str, template: str, budget_tokens: int = None) -> str:
+    """fit_report_text with the template's budget, logging the tokens saved."""
+    budget_tokens = budget_tokens or PROMPT_REPORT_TOKEN_BUDGET
+    fitted = fit_report_text(text or "", budget_tokens)
+    _log_savings(template, estimate_tokens(text or ""), estimate_tokens(fitted))
+    return fitted
+
+
+def build_comparison_context(previous_text: str, new_text: str, template: str,
+                             budget_tokens: int = None) -> tuple[str, str]:
+    """Both reports of a comparison, each within half of the comparison budget."""
+    budget_tokens = budget_tokens or PROMPT_COMPARISON_TOKEN_BUDGET
+    previous = fit_report_text(previous_text or "", budget_tokens // 2)
+    new = fit_report_text(new_text or "", budget_tokens // 2)
+    _log_savings(template, estimate_tokens(previous_text or "") + estimate_tokens(new_text or ""),
+                 estimate_tokens(previous) + estimate_tokens(new))
+    return previous, new
+
+
+def _log_savings(template: str, original: int, fitted: int):
+    logger.info(f"✂️ Prompt {template}: report text ~{original} -> ~{fitted} tokens "
+                f"(saved ~{original - fitted})")
@@ -0,0 +1,124 @@
+# backend/core/report_snapshot.py
+#
+# Snapshot strutturato e compatto di un referto analizzato, salvato insieme al
+# referto (colonna structured_snapshot, JSON): valori di laboratorio, misure
+# radiologiche, reperti e diagnosi. I confronti successivi usano i due snapshot
+# invece di rileggere o rimandare al modello il testo dei referti storici.
+
+import re
+import json
+import logging
+
+from core.pdf_parser import extract_laboratory_values, classify_report_type
+
+logger = logging.getLogger(__name__)
+
+# Da incrementare quando cambia la struttura: gli snapshot di altre versioni vengono ignorati
+SNAPSHOT_VERSION = 1
+
+LAB_FIELDS = ("value", "unit", "reference", "abnormal")
+
+# Variazione relativa minima di una misura considerata significativa
+MEASUREMENT_TOLERANCE = 0.05
+
+MAX_FINDINGS = 10
+
+# Struttura anatomica o reperto, seguito (nella stessa frase) dalla sua misura
+_MEASUREMENT_RE = re.compile(
+    r"\b(fegato|milza|pancreas|tiroide|prostata|utero|aorta|vena porta|coledoco|"
+    r"ren[ei](?:\s+(?:destro|sinistro|dx|sx))?|lobo\s+(?:destro|sinistro)|"
+    r"nodul[oi]|cisti|placca|stenosi|linfonod[oi]|lesione|massa|IMT|spessore|versamento)"
+    r"\b[^.\n]{0,60}?(\d+(?:[.,]\d+)?)\s*(mm|cm|%)(?![a-z])",
+    re.IGNORECASE
+)
+_UNIT_TO_MM = {"mm": 1.0, "cm": 10.0}
+
+
+def extract_radiology_measurements(text: str) -> dict:
+    """Measurements by structure ("fegato", "stenosi", ...), e.g. {"fegato": {"value": 18.0, "unit": "cm"}}."""
+    measurements = {}
+    for match in _MEASUREMENT_RE.finditer(text or ""):
+        name = re.sub(r"\s+", " ", match.group(1)).lower()
+        # La stessa struttura misurata più volte: le occorrenze successive sono numerate
+        key, n = name, 2
+        while key in measurements:
+            key, n = f"{name} ({n})", n + 1
+        measurements[key] = {"value": float(match.group(2).replace(",", ".")), "unit": match.group(3).lower()}
+    return measurements
+
+
+def build_snapshot(meta: dict, ai: dict, full_text: str = None) -> dict:
+    """Compact structured snapshot of an analyzed report (metadata, AI result and text)."""
+    full_text = full_text if full_text is not None else meta.get("full_text", "")
+    category = meta.get("report_category") or classify_report_type(full_text)
+    lab_values = {
+        name: {field: data.get(field, "") for field in LAB_FIELDS}
+        for name, data in (meta.get("laboratory_values") or {}).items()
+    }
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "report_category": category,
+        "diagnosis": ai.get("diagnosis", ""),
+        "classification": ai.get("classification", ""),
+        "analysis_path": ai.get("analysis_path"),
+        "laboratory_values": lab_values,
+    }
+    if category != "laboratory" or not lab_values:
+        snapshot["measurements"] = extract_radiology_measurements(full_text)
+        snapshot["findings"] = list(ai.get("abnormal_findings") or [])[:MAX_FINDINGS]
+    return snapshot
+
+
+def snapshot_from_text(text: str, diagnosis: str, classification: str) -> dict:
+    """Snapshot of an already stored report, rebuilt from its text without calling the model."""
+    meta = {"laboratory_values": extract_laboratory_values(text), "report_category": classify_report_type(text)}
+    return build_snapshot(meta, {"diagnosis": diagnosis, "classification": classification}, text)
+
+
+def dump_snapshot(snapshot: dict) -> str:
+    return json.dumps(snapshot, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_snapshot(raw: str | None) -> dict | None:
+    """Parse a stored snapshot; None if missing, unreadable or of another version."""
+    if not raw:
+        return None
+    try:
+        snapshot = json.loads(raw)
+    except (TypeError, ValueError):
+        logger.warning("⚠️ Unreadable structured snapshot, ignoring it")
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    return snapshot
+
+
+def _in_mm(measurement: dict) -> tuple[float, str]:
+    unit = measurement["unit"]
+    if unit in _UNIT_TO_MM:
+        return measurement["value"] * _UNIT_TO_MM[unit], "mm"
+    return measurement["value"], unit
+
+
+def compare_measurements(previous: dict, current: dict) -> list[dict]:
+    """Changes of the measurements present in both snapshots (cm and mm are comparable)."""
+    changes = []
+    for name, data in current.items():
+        old = previous.get(name)
+        if old is None:
+            continue
+        (old_value, old_unit), (new_value, new_unit) = _in_mm(old), _in_mm(data)
+        if old_unit != new_unit:
+            continue
+        delta = new_value - old_value
+        if abs(delta) <= MEASUREMENT_TOLERANCE * max(abs(old_value), 1e-9):
+            trend = "invariata"
+        else:
+            trend = "aumentata" if delta > 0 else "ridotta"
+        changes.append({
+            "name": name,
+            "previous": f"{old['value']:g} {old['unit']}",
+            "current": f"{data['value']:g} {data['unit']}",
+            "trend": trend,
+        })
+    return changes
@@ -0,0 +1,44 @@
+# backend/core/report_text.py
+#
+# Indice condiviso del testo di un referto: righe, righe ripulite e viste in
+# maiuscolo vengono calcolate una sola volta (alla prima richiesta) e riusate
+# da tutti gli estrattori di extract_metadata.
+
+from functools import cached_property
+
+
+class ReportText:
+    """Lazily built line index and upper-case views of a report's text."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    @classmethod
+    def of(cls, text_or_report) -> "ReportText":
+        """Wrap a plain string; pass an existing ReportText through unchanged."""
+        if isinstance(text_or_report, cls):
+            return text_or_report
+        return cls(text_or_report)
+
+    @cached_property
+    def upper(self) -> str:
+        return self.text.upper()
+
+    @cached_property
+    def lines(self) -> list[str]:
+        """Lines split on '\\n' only, as the lab value parser expects."""
+        return self.text.split('\n')
+
+    @cached_property
+    def stripped_lines(self) -> list[str]:
+        return [line.strip() for line in self.lines]
+
+    @cached_property
+    def upper_lines(self) -> list[str]:
+        """Upper-case view of stripped_lines."""
+        return [line.upper() for line in self.stripped_lines]
+
+    @cached_property
+    def splitlines(self) -> list[str]:
+        """Lines split on every line boundary (str.splitlines semantics)."""
+        return self.text.splitlines()
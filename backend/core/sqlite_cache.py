@@ -0,0 +1,129 @@
+# backend/core/sqlite_cache.py
+#
+# Cache persistente chiave -> JSON su SQLite, con limite di dimensione
+# (evizione LRU), scadenza opzionale (TTL) e version stamp: le voci scritte
+# con una versione diversa o più vecchie del TTL sono considerate scadute e
+# vengono rimosse alla prima lettura.
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteCache:
+    """Size-bounded LRU cache of JSON-serializable values stored in a SQLite file."""
+
+    def __init__(self, path: str, max_bytes: int, version: str, ttl_seconds: float = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = str(version)
+        self.ttl_seconds = ttl_seconds
+        self._lock = Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key         TEXT PRIMARY KEY,
+                    version     TEXT NOT NULL,
+                    value       TEXT NOT NULL,
+                    size        INTEGER NOT NULL,
+                    created_at  REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_last_access ON cache_entries (last_access)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def get(self, key: str):
+        """Return the cached value for key, or None on miss, version mismatch or expiry."""
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT version, value, created_at FROM cache_entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                version, value, created_at = row
+                if version != self.version or self._expired(created_at, now):
+                    conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+                    conn.commit()
+                    return None
+                conn.execute(
+                    "UPDATE cache_entries SET last_access = ? WHERE key = ?", (now, key)
+                )
+                conn.commit()
+                return json.loads(value)
+            finally:
+                conn.close()
+
+    def set(self, key: str, value) -> None:
+        """Store value under key and evict least recently used entries above max_bytes."""
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            logger.info(f"Cache entry {key[:12]} too large ({size} bytes), not cached")
+            return
+
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, version, value, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, self.version, payload, size, now, now),
+                )
+                self._evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Le voci di versioni precedenti o scadute non verranno mai più lette
+        conn.execute("DELETE FROM cache_entries WHERE version != ?", (self.version,))
+        if self.ttl_seconds is not None:
+            conn.execute("DELETE FROM cache_entries WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM cache_entries ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} cache entries from {self.path}")
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM cache_entries")
+                conn.commit()
+            finally:
+                conn.close()
@@ -0,0 +1,164 @@
+# backend/core/structured_output.py
+#
+# Output JSON vincolato per le chiamate di diagnosi e confronto: lo schema
+# Pydantic viene passato a Ollama come "format" (o format="json" con
+# LLM_STRUCTURED_FORMAT=json), la risposta viene validata e, solo se non è
+# valida, si chiede al modello di correggerla con un breve prompt di riparazione.
+# Per ogni template si contano chiamate, risposte non valide e riparazioni.
+
+import os
+import re
+import json
+import logging
+from threading import Lock
+
+from pydantic import BaseModel, ValidationError, field_validator
+from core import llm_gateway
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# "schema" (JSON schema, Ollama >= 0.5) oppure "json" (solo JSON valido)
+LLM_STRUCTURED_FORMAT = os.getenv("LLM_STRUCTURED_FORMAT", "schema").lower()
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+_metrics: dict[str, dict] = {}
+_metrics_lock = Lock()
+
+
+class Diagnosis(BaseModel):
+    diagnosis: str
+    classification: str
+
+    @field_validator("diagnosis")
+    @classmethod
+    def _not_empty(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("empty diagnosis")
+        return value.strip()
+
+    @field_validator("classification")
+    @classmethod
+    def _normalize(cls, value: str) -> str:
+        return value.strip().lower()
+
+
+class Comparison(BaseModel):
+    status: str
+    explanation: str
+
+    @field_validator("status")
+    @classmethod
+    def _normalize(cls, value: str) -> str:
+        return value.strip().lower()
+
+
+class Explanation(BaseModel):
+    explanation: str
+
+    @field_validator("explanation")
+    @classmethod
+    def _not_empty(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("empty explanation")
+        return value.strip()
+
+
+class StructuredOutputError(ValueError):
+    """The model output did not match the schema, even after the repair attempt."""
+
+
+def _count(template: str, field: str):
+    with _metrics_lock:
+        counters = _metrics.setdefault(template, {"calls": 0, "parse_failures": 0, "repaired": 0, "failed": 0})
+        counters[field] += 1
+
+
+def structured_output_metrics() -> dict:
+    """Per-template counters, with the share of responses that needed a repair."""
+    with _metrics_lock:
+        return {
+            template: {**c, "parse_failure_rate": round(c["parse_failures"] / c["calls"], 3) if c["calls"] else 0.0}
+            for template, c in _metrics.items()
+        }
+
+
+def response_format(schema: type[BaseModel]):
+    """Value of Ollama's format option for a schema."""
+    return "json" if LLM_STRUCTURED_FORMAT == "json" else schema.model_json_schema()
+
+
+def parse_structured(text: str, schema: type[BaseModel]) -> BaseModel:
+    """Validate a model response against schema, tolerating code fences and surrounding text."""
+    cleaned = _FENCE_RE.sub("", text.strip())
+    try:
+        return schema.model_validate_json(cleaned)
+    except ValidationError as first_error:
+        match = _OBJECT_RE.search(cleaned)
+        if match and match.group(0) != cleaned:
+            try:
+                return schema.model_validate_json(match.group(0))
+            except ValidationError:
+                pass
+        raise StructuredOutputError(str(first_error)) from None
+
+
+def _repair_prompt(raw: str, schema: type[BaseModel], error: Exception) -> str:
+    return f"""
+La seguente risposta non è un JSON valido per lo schema richiesto.
+
+Risposta:
+\"\"\"{raw[:2000]}\"\"\"
+
+Errore: {str(error)[:300]}
+
+Schema JSON: {json.dumps(schema.model_json_schema(), ensure_ascii=False)}
+
+Restituisci ESCLUSIVAMENTE il JSON corretto, senza testo aggiuntivo.
+"""
+
+
+def _content(kind: str, response) -> str:
+    return response["message"]["content"] if kind == "chat" else response["response"]
+
+
+def generate_structured(kind: str, model: str, prompt: str, schema: type[BaseModel], template: str,
+                        on_token=None) -> BaseModel:
+    """
+    Call the model through the gateway (kind "generate" or "chat") asking for
+    JSON matching schema. One repair call is made only if the response is invalid;
+    raises StructuredOutputError if that fails too. Connection errors propagate.
+    on_token receives the raw JSON fragments of the first response as they are
+    generated (not the repair call); only the returned object is validated.
+    """
+    fmt = response_format(schema)
+    _count(template, "calls")
+    if kind == "chat":
+        response = llm_gateway.chat(model=model, messages=[{"role": "user", "content": prompt}],
+                                    template=template, on_token=on_token, format=fmt)
+    else:
+        response = llm_gateway.generate(model=model, prompt=prompt, template=template,
+                                        on_token=on_token, format=fmt)
+    raw = _content(kind, response)
+
+    try:
+        return parse_structured(raw, schema)
+    except StructuredOutputError as e:
+        _count(template, "parse_failures")
+        logger.warning(f"⚠️ Invalid {schema.__name__} JSON for {template} ({str(e)[:120]}), asking for a repair")
+        error = e
+
+    repaired = llm_gateway.generate(model=model, prompt=_repair_prompt(raw, schema, error),
+                                    template=f"{template}/repair", format=fmt)
+    try:
+        result = parse_structured(repaired["response"], schema)
+    except StructuredOutputError:
+        _count(template, "failed")
+        raise
+    _count(template, "repaired")
+    logger.info(f"🔧 {schema.__name__} JSON for {template} repaired")
+    return result
@@ -0,0 +1,106 @@
+# backend/db/async_crud.py
+#
+# Versioni asincrone (AsyncSession, db/async_session.py) delle funzioni di crud
+# usate dagli endpoint EHR (analisi, lettura e feedback). Stesse query e stessi
+# risultati delle versioni sincrone; le colonne differite vanno caricate
+# esplicitamente, perché in asincrono un accesso lazy non è possibile.
+
+from __future__ import annotations
+
+from typing import Optional, List, TYPE_CHECKING
+from sqlalchemy import Row, select
+from sqlalchemy.orm import undefer
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import Report
+from db.crud import REPORT_SUMMARY_COLUMNS
+
+# Ordine cronologico decrescente usato da crud (data del referto, caricamento, id)
+NEWEST_FIRST = (Report.report_date.desc(), Report.created_at.desc(), Report.id.desc())
+
+
+async def create_report(
+    db: AsyncSession, *,
+    patient_cf, patient_name,
+    report_type, report_date,
+    file_path, extracted_text,
+    ai_diagnosis, ai_classification,
+    structured_snapshot=None
+):
+    report = Report(
+        patient_cf   = patient_cf,
+        patient_name = patient_name,
+        report_type = report_type,
+        report_date  = report_date,
+        file_path    = file_path,
+        extracted_text = extracted_text,
+        ai_diagnosis   = ai_diagnosis,
+        ai_classification = ai_classification,
+        structured_snapshot = structured_snapshot,
+    )
+    db.add(report)
+    await db.commit()
+    await db.refresh(report)
+    return report
+
+
+async def update_report_comparison(db: AsyncSession, report_id, comparison: dict):
+    report = await db.get(Report, report_id)
+    if not report:
+        return False
+    report.comparison_to_previous = comparison.get("status")
+    report.comparison_explanation = comparison.get("explanation")
+    await db.commit()
+    return True
+
+
+async def save_feedback(db: AsyncSession, report_id, correct_diagnosis, correct_classification, comment=None):
+    report = await db.get(Report, report_id)
+    if not report:
+        return False
+    report.doctor_diagnosis = correct_diagnosis
+    report.doctor_classification = correct_classification
+    report.doctor_comment = comment
+    await db.commit()
+    return True
+
+
+async def get_patient_reports(db: AsyncSession, patient_cf: str, report_type: Optional[str] = None) -> List[Row]:
+    """Reports of a patient (REPORT_SUMMARY_COLUMNS rows), newest first; see crud.get_patient_reports."""
+    query = select(*REPORT_SUMMARY_COLUMNS).where(Report.patient_cf == patient_cf)
+    if report_type:
+        query = query.where(Report.report_type == report_type)
+    result = await db.execute(query.order_by(Report.report_date.desc()))
+    return list(result.all())
+
+
+async def get_patient_report(db: AsyncSession, patient_cf: str, report_id) -> Optional[Report]:
+    """A single report of a patient with its text and comparison explanation loaded."""
+    result = await db.execute(
+        select(Report)
+        .options(undefer(Report.extracted_text), undefer(Report.comparison_explanation))
+        .where(Report.id == report_id, Report.patient_cf == patient_cf)
+    )
+    return result.scalars().first()
+
+
+async def get_latest_reports_by_title(db: AsyncSession, patient_cf: str, report_type: str, limit: int = 2,
+                                      with_text: bool = False) -> List[Report]:
+    """
+    At most `limit` most recent reports of a title for a patient, newest first, with the
+    structured snapshot loaded; see crud.get_latest_reports_by_title. The extracted text
+    cannot be lazy-loaded later in async code, so pass with_text=True when it is needed.
+    """
+    options = [undefer(Report.structured_snapshot)]
+    if with_text:
+        options.append(undefer(Report.extracted_text))
+    result = await db.execute(
+        select(Report)
+        .options(*options)
+        .where(Report.patient_cf == patient_cf, Report.report_type == report_type)
+        .order_by(*NEWEST_FIRST)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
@@ -0,0 +1,79 @@
+# backend/db/async_session.py
+#
+# Engine SQLAlchemy asincrono opzionale (DB_ASYNC_ENABLED=True): asyncpg per
+# PostgreSQL, aiosqlite per SQLite. Usa lo stesso DATABASE_URL e gli stessi
+# parametri di pool di db/session.py. L'engine viene creato al primo uso, quindi
+# il driver asincrono (e greenlet, richiesto da sqlalchemy.ext.asyncio) serve
+# solo quando il percorso è attivo.
+
+import os
+import logging
+
+from db.session import (DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+                        DB_POOL_RECYCLE, DB_POOL_PRE_PING)
+
+logger = logging.getLogger(__name__)
+
+DB_ASYNC_ENABLED = os.getenv("DB_ASYNC_ENABLED", "False").lower() == "true"
+
+# Driver asincrono per ogni dialetto supportato
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+_engine = None
+_sessionmaker = None
+
+
+def async_database_url(url: str) -> str:
+    """DATABASE_URL with its driver replaced by the async one (postgresql -> postgresql+asyncpg)."""
+    scheme, separator, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if not separator or dialect not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for database URL scheme '{scheme}'")
+    return f"{ASYNC_DRIVERS[dialect]}://{rest}"
+
+
+def _async_engine_options(url: str) -> dict:
+    if "sqlite" in url and (":memory:" in url or url.rstrip("/").endswith("sqlite:")):
+        # Database in memoria: il pool di default va bene
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def get_async_engine():
+    """The async engine, created on first use (raises ImportError if the driver is missing)."""
+    global _engine, _sessionmaker
+    if _engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        url = async_database_url(DATABASE_URL)
+        _engine = create_async_engine(url, **_async_engine_options(url))
+        # Niente lazy load in asincrono: gli oggetti restano validi dopo il commit
+        _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False, autoflush=False)
+        logger.info(f"✅ Async database engine ready ({_engine.dialect.name}+{_engine.dialect.driver})")
+    return _engine
+
+
+def AsyncSessionLocal():
+    get_async_engine()
+    return _sessionmaker()
+
+
+async def dispose_async_engine():
+    global _engine, _sessionmaker
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _sessionmaker = None
+
+
+# Dependency for FastAPI routes (async path)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
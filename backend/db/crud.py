@@ -1,27 +1,63 @@
 import os
 import uuid
-from sqlalchemy.orm import Session
+import hashlib
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import Row
+from sqlalchemy.orm import Session, undefer
 from db.models import Report
 from datetime import datetime
 from typing import Optional, List
 
+STORAGE_FOLDER = "backend/storage"
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def _storage_path(filename: str) -> str:
+    os.makedirs(STORAGE_FOLDER, exist_ok=True)
+    return os.path.join(STORAGE_FOLDER, f"{uuid.uuid4()}_{filename}")
+
 # Save PDF to disk
 def save_pdf(filename: str, content: bytes) -> str:
-    folder = "backend/storage"
-    os.makedirs(folder, exist_ok=True)
-    file_id = f"{uuid.uuid4()}_{filename}"
-    path = os.path.join(folder, file_id)
+    path = _storage_path(filename)
     with open(path, "wb") as f:
         f.write(content)
     return path
 
+def _copy_and_hash(source, path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "wb") as out:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+# Stream an upload to disk, chunk by chunk, hashing it on the way
+async def save_upload(upload: UploadFile) -> tuple[str, str]:
+    """Store the upload in the PDF storage folder; return (path, SHA-256 hex digest)."""
+    path = _storage_path(upload.filename)
+    await upload.seek(0)
+    try:
+        digest = await run_in_threadpool(_copy_and_hash, upload.file, path)
+    except Exception:
+        delete_pdf(path)
+        raise
+    return path, digest
+
+# Remove a stored PDF whose report was not saved
+def delete_pdf(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
 # Insert report into DB
 def create_report(
     db, *,
     patient_cf, patient_name,
     report_type, report_date,
     file_path, extracted_text,
-    ai_diagnosis, ai_classification
+    ai_diagnosis, ai_classification,
+    structured_snapshot=None
 ):
     report = Report(
         patient_cf   = patient_cf,
@@ -32,6 +68,7 @@ def create_report(
         extracted_text = extracted_text,
         ai_diagnosis   = ai_diagnosis,
         ai_classification = ai_classification,
+        structured_snapshot = structured_snapshot,  # JSON (core/report_snapshot.py)
     )
     db.add(report); db.commit(); db.refresh(report)
     return report
@@ -50,7 +87,7 @@ def update_report_comparison(db: Session, report_id, comparison: dict):
 # Retrieve most recent report text for comparison by patient CF and title
 def get_most_recent_report_text(db: Session, patient_cf, report_type):
     latest = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.patient_cf == patient_cf, Report.report_type == report_type)
         .order_by(Report.report_date.desc())
         .first()
@@ -70,23 +107,38 @@ def save_feedback(db: Session, report_id, correct_diagnosis, correct_classificat
 
 # Export all labeled reports for training (with doctor labels)
 def get_labeled_reports(db: Session):
-    return db.query(Report).filter(Report.doctor_diagnosis.isnot(None)).all()
+    return (
+        db.query(Report)
+        .options(undefer(Report.extracted_text), undefer(Report.comparison_explanation))
+        .filter(Report.doctor_diagnosis.isnot(None))
+        .all()
+    )
 
 # Get most recent report by codice fiscale and title
 def get_most_recent_report_text_by_cf_and_title(db: Session, patient_cf: str, report_type: str):
     """Retrieve the most recent report text with the specified title for a patient"""
     latest = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.patient_cf == patient_cf, Report.report_type == report_type)
         .order_by(Report.report_date.desc())
         .first()
     )
     return latest.extracted_text if latest else None
 
+# Columns of a report listing: everything but the report body and the snapshot
+REPORT_SUMMARY_COLUMNS = (
+    Report.id, Report.patient_cf, Report.patient_name, Report.report_type, Report.report_date,
+    Report.ai_diagnosis, Report.ai_classification, Report.doctor_diagnosis, Report.doctor_classification,
+    Report.comparison_to_previous, Report.comparison_explanation, Report.created_at,
+)
+
 # Get all reports for a patient by codice fiscale with optional title filtering
-def get_patient_reports(db: Session, patient_cf: str, report_type: Optional[str] = None) -> List[Report]:
-    """Retrieve all reports for a patient by their codice fiscale with optional title filtering"""
-    query = db.query(Report).filter(Report.patient_cf == patient_cf)
+def get_patient_reports(db: Session, patient_cf: str, report_type: Optional[str] = None) -> List[Row]:
+    """
+    Retrieve all reports for a patient by their codice fiscale with optional title filtering.
+    Returns lightweight rows with the REPORT_SUMMARY_COLUMNS attributes (no extracted text).
+    """
+    query = db.query(*REPORT_SUMMARY_COLUMNS).filter(Report.patient_cf == patient_cf)
     
     if report_type:
         query = query.filter(Report.report_type == report_type)
@@ -97,7 +149,7 @@ def get_patient_reports(db: Session, patient_cf: str, report_type: Optional[str]
 def get_most_recent_report_text_by_title_only(db: Session, report_type: str):
     """Retrieve the most recent report text with the specified title, regardless of which patient it belongs to"""
     latest = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.report_type == report_type)
         .order_by(Report.report_date.desc())
         .first()
@@ -123,7 +175,7 @@ def get_most_recent_report_text_by_title(db: Session, patient_cf: str, report_ty
     don't contain hour information.
     """
     latest = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.patient_cf == patient_cf, Report.report_type == report_type)
         .order_by(
             Report.report_date.desc(),    # Sort by medical date first
@@ -141,7 +193,7 @@ def get_previous_report_text_by_title(db: Session, patient_cf: str, report_type:
     excluding the specified report ID (useful when comparing against the current report).
     """
     query = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.patient_cf == patient_cf, Report.report_type == report_type)
     )
     
@@ -156,6 +208,27 @@ def get_previous_report_text_by_title(db: Session, patient_cf: str, report_type:
     
     return latest.extracted_text if latest else None
 
+# Get the latest N reports of a title for a patient (newest first)
+def get_latest_reports_by_title(db: Session, patient_cf: str, report_type: str, limit: int = 2) -> List[Report]:
+    """
+    Retrieve at most `limit` most recent reports with exact matching report title for a
+    patient, newest first. The LIMIT reads the (patient_cf, report_type, report_date,
+    created_at, id) index backwards, so the cost does not grow with the patient's history.
+    The structured snapshot is loaded with the rows; the extracted text stays deferred.
+    """
+    return (
+        db.query(Report)
+        .options(undefer(Report.structured_snapshot))
+        .filter(Report.patient_cf == patient_cf, Report.report_type == report_type)
+        .order_by(
+            Report.report_date.desc(),
+            Report.created_at.desc(),
+            Report.id.desc()
+        )
+        .limit(limit)
+        .all()
+    )
+
 # Get chronological reports for comparison with dates
 def get_chronological_reports_by_title(db: Session, patient_cf: str, report_type: str):
     """
@@ -181,7 +254,7 @@ def get_most_recent_report_text_by_title_only(db: Session, report_type: str):
     Uses created_at timestamp to handle same-day reports correctly.
     """
     latest = (
-        db.query(Report)
+        db.query(Report.extracted_text)
         .filter(Report.report_type == report_type)
         .order_by(
             Report.report_date.desc(),    # Sort by medical date first
@@ -1,8 +1,8 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, Text
+from sqlalchemy import Column, String, DateTime, Text, Index
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, deferred
 
 Base = declarative_base()
 
@@ -18,7 +18,8 @@ class Report(Base):
     report_date = Column(DateTime, nullable=False)
 
     file_path = Column(Text, nullable=False)
-    extracted_text = Column(Text, nullable=False)
+    # Colonne di testo potenzialmente grandi: caricate solo quando servono (undefer o accesso)
+    extracted_text = deferred(Column(Text, nullable=False), group="body")
 
     ai_diagnosis = Column(Text, nullable=False)
     ai_classification = Column(String, nullable=False)
@@ -28,6 +29,16 @@ class Report(Base):
     doctor_comment = Column(Text, nullable=True)
 
     comparison_to_previous = Column(String, nullable=True)
-    comparison_explanation = Column(Text, nullable=True)
+    comparison_explanation = deferred(Column(Text, nullable=True))
+
+    # Snapshot strutturato (JSON, core/report_snapshot.py) usato per i confronti successivi
+    structured_snapshot = deferred(Column(Text, nullable=True), group="body")
 
     created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Indici per le query di crud: filtro per paziente e titolo (o solo titolo)
+    # con ordinamento cronologico report_date, created_at, id
+    __table_args__ = (
+        Index("ix_reports_patient_type_date", "patient_cf", "report_type", "report_date", "created_at", "id"),
+        Index("ix_reports_type_date", "report_type", "report_date", "created_at", "id"),
+    )
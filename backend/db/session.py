@@ -1,26 +1,162 @@
 # backend/db/session.py
 
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import time
+import logging
+from threading import Lock
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker, Session
 from db.models import Base
 
 from dotenv import load_dotenv
 load_dotenv()  # 👈 Load environment variables from .env
 
+logger = logging.getLogger(__name__)
+
 # Print DATABASE_URL for debug purposes
 print("✅ DATABASE_URL:", os.getenv("DATABASE_URL"))
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///backend/db/lexicare.db")
 
-# Handle SQLite connection args
-connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+# Pool di connessioni: dimensione, overflow, attesa massima per una connessione,
+# riciclo delle connessioni vecchie e verifica (pre-ping) prima dell'uso
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+
+# Durata della connessione di una sessione:
+#   request   - dalla prima query alla fine della richiesta (comportamento precedente)
+#   operation - rilasciata durante le attese su Ollama (release_connection) e
+#               ripresa alla query successiva, es. per le scritture
+DB_SESSION_SCOPE = os.getenv("DB_SESSION_SCOPE", "request").lower()
+
+
+class PoolStats:
+    """Checkout counters and wait times of the connection pool."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def checked_out(self):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def checked_in(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(1000 * self.wait_total / self.checkouts, 2) if self.checkouts else 0.0,
+                "wait_max_ms": round(1000 * self.wait_max, 2),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            pool_stats.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_stats.record_wait(time.perf_counter() - started)
+        return connection
+
+
+def _engine_options(url: str) -> dict:
+    # Handle SQLite connection args
+    if "sqlite" in url:
+        options = {"connect_args": {"check_same_thread": False}}
+        if ":memory:" in url or url.rstrip("/").endswith("sqlite:"):
+            # Database in memoria: una sola connessione, il pool di default va bene
+            return options
+    else:
+        options = {}
+    options.update(
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+    return options
+
 
 # Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.checked_out()
+
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_stats.checked_in()
+
+
+def pool_metrics() -> dict:
+    """Pool configuration and usage: checkouts, connections in use, overflow and checkout wait times."""
+    metrics = {"session_scope": DB_SESSION_SCOPE, **pool_stats.snapshot()}
+    if isinstance(engine.pool, QueuePool):
+        metrics.update(in_use=engine.pool.checkedout(), size=engine.pool.size(),
+                       overflow=max(0, engine.pool.overflow()),
+                       max_overflow=DB_MAX_OVERFLOW, idle=engine.pool.checkedin())
+    return metrics
+
+
+# Session factory (in modalità operation gli oggetti caricati restano validi dopo il rilascio)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine,
+                            expire_on_commit=DB_SESSION_SCOPE != "operation")
+
 
-# Session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def release_connection(db: Session):
+    """
+    With DB_SESSION_SCOPE=operation, end the session's read transaction so that its
+    connection goes back to the pool during a long wait (an Ollama call); the next
+    query takes a connection again. No-op in request scope or with pending changes.
+    """
+    if DB_SESSION_SCOPE != "operation" or not db.in_transaction():
+        return
+    if db.new or db.dirty or db.deleted:
+        logger.debug("Session has pending changes, keeping its connection")
+        return
+    db.commit()
 
 # Initialize database (create tables)
 def init_db():
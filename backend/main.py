@@ -8,20 +8,42 @@ from pathlib import Path
 backend_dir = Path(__file__).parent
 sys.path.insert(0, str(backend_dir))
 
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from api import analyze, feedback, export, ehr, analyze_fixed
-from db.session import init_db
+from core import llm_client
+from core.ai_engine import analysis_path_metrics
+from core.structured_output import structured_output_metrics
+from core.model_warmup import warmup, OLLAMA_WARMUP_GATE, OLLAMA_WARMUP_RETRY_SECONDS
+from db.session import init_db, pool_metrics
+from db.async_session import DB_ASYNC_ENABLED, get_async_engine, dispose_async_engine
 from dotenv import load_dotenv
 import uvicorn
 
 # Load environment variables
 load_dotenv()
 
+# Route che chiamano il modello: rifiutate finché non è caricato (OLLAMA_WARMUP_GATE)
+MODEL_GATED_PREFIXES = ("/api/analyze", "/analyze-fixed", "/api/ehr/analyze")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Carica il modello in background e lo tiene in memoria con ping keep_alive
+    warmup.start()
+    if DB_ASYNC_ENABLED:
+        # Crea subito l'engine asincrono: un driver mancante emerge all'avvio
+        get_async_engine()
+    yield
+    await warmup.stop()
+    await dispose_async_engine()
+
 app = FastAPI(
     title="LexiCare - Modulo di Supporto alle Decisioni",
     description="Sistema AI per analisi semantica di referti clinici (in italiano)",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Setup allowed origins
@@ -44,6 +66,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def require_warm_model(request: Request, call_next):
+    if OLLAMA_WARMUP_GATE and not warmup.ready and request.url.path.startswith(MODEL_GATED_PREFIXES):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Modello AI in caricamento, riprovare tra poco.", "model": warmup.status()},
+            headers={"Retry-After": str(int(OLLAMA_WARMUP_RETRY_SECONDS))},
+        )
+    return await call_next(request)
+
 # Initialize DB (create tables if needed)
 init_db()
 
@@ -58,6 +90,15 @@ app.include_router(ehr.router, prefix="/api/ehr", tags=["Integrazione EHR"])
 def read_root():
     return {"messaggio": "Benvenuto in LexiCare - sistema AI per referti clinici"}
 
+@app.get("/api/health")
+def health():
+    """Model readiness, Ollama client queue, DB pool and analysis counters; 503 until the model is loaded."""
+    body = {"status": "ok" if warmup.ready else "warming_up", "model": warmup.status(),
+            "llm_pool": llm_client.metrics(), "db_pool": pool_metrics(),
+            "lab_analysis_paths": analysis_path_metrics(),
+            "structured_output": structured_output_metrics()}
+    return JSONResponse(status_code=200 if warmup.ready else 503, content=body)
+
 # Run the server directly if this file is executed
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8009))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# scripts/benchmark_exam_title.py
+#
+# Micro-benchmark of the single-pass exam title matcher against the previous
+# implementation (one re.search per pattern, in priority order) on the sample PDFs.
+#
+# Usage: python scripts/benchmark_exam_title.py [--rounds N] [pdf ...]
+
+import os
+import re
+import sys
+import glob
+import time
+import argparse
+
+import fitz  # PyMuPDF
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from core.pdf_parser import EXAM_TITLE_PATTERNS, match_exam_title_pattern
+
+
+def legacy_match_exam_title(text: str):
+    """Previous behaviour: one full-text re.search per pattern."""
+    for pattern in EXAM_TITLE_PATTERNS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            return match.group(0)
+    return None
+
+
+def load_texts(paths):
+    texts = []
+    for path in paths:
+        with fitz.open(path) as doc:
+            texts.append((os.path.basename(path), "".join(page.get_text() for page in doc)))
+    return texts
+
+
+def bench(fn, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, text in texts:
+            fn(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pdfs", nargs="*")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    paths = args.pdfs or sorted(
+        glob.glob(os.path.join(ROOT, "*.pdf")) + glob.glob(os.path.join(ROOT, "backend", "backend", "storage", "*.pdf"))
+    )
+    texts = load_texts(paths)
+    # Caso peggiore: un referto lungo senza alcun titolo riconoscibile
+    texts.append(("no-title (synthetic)", "Nessun titolo riconoscibile in questa riga\n" * 2000))
+
+    mismatches = [name for name, text in texts if legacy_match_exam_title(text) != match_exam_title_pattern(text)]
+
+    legacy = bench(legacy_match_exam_title, texts, args.rounds)
+    compiled = bench(match_exam_title_pattern, texts, args.rounds)
+    calls = len(texts) * args.rounds
+
+    print(f"Documents: {len(texts)}  rounds: {args.rounds}")
+    print(f"legacy   : {legacy * 1e6 / calls:9.1f} µs/call")
+    print(f"compiled : {compiled * 1e6 / calls:9.1f} µs/call  ({legacy / compiled:.1f}x)")
+    print(f"Mismatches: {mismatches or 'none'}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# scripts/build_lab_values_corpus.py
+#
+# Regenerates tests/data/lab_values_corpus.json: the regression corpus for
+# extract_laboratory_values, built from the sample PDFs in the repository plus
+# a few synthetic layouts. Run it only when a change to the extraction output
+# is intended, and review the diff of the JSON file.
+
+import os
+import sys
+import json
+
+import fitz  # PyMuPDF
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from core.pdf_parser import extract_laboratory_values
+
+CORPUS_PATH = os.path.join(ROOT, "tests", "data", "lab_values_corpus.json")
+
+SAMPLE_PDFS = [
+    "report_2024_02_01.pdf",
+    "report_2024_05_01.pdf",
+    "report_2024_05_01_modified.pdf",
+    "backend/backend/storage/62cb278d-83be-4148-8b6c-2a2ed26db453_1907122220448610ODM_5d298ea87d27f1ac3151d6f4.pdf",
+]
+
+SYNTHETIC_TEXTS = {
+    "single_line_mixed_case": (
+        "Glucosio 95 mg/dl 70 - 110\n"
+        "BILIRUBINA TOTALE 1,2 * mg/dl\n"
+        "Ph\t6,0\n"
+        "creatinina: 0,9 mg/dl (0.5 - 1.2)\n"
+        "Nitriti: NEGATIVO\n"
+        "Data: 12/03/2024\n"
+        "Via Roma 12\n"
+        "HGB 13,5 g/dl\n"
+        "PROTEINA C REATTIVA\n"
+        "  2,3 *\n"
+        "mg/dl\n"
+        "0.0 - 0.5\n"
+        "Colore\n"
+        "GIALLO\n"
+        "Aspetto\n"
+        "Ph\n"
+        "5,5\n"
+    ),
+}
+
+
+def pdf_text(relative_path: str) -> str:
+    with fitz.open(os.path.join(ROOT, relative_path)) as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+def corpus_texts() -> dict:
+    texts = {path: pdf_text(path) for path in SAMPLE_PDFS}
+    # Referto lungo multi-pannello: tutti i campioni concatenati
+    texts["all_samples_concatenated"] = "\n".join(texts[path] for path in SAMPLE_PDFS)
+    texts.update(SYNTHETIC_TEXTS)
+    return texts
+
+
+def main():
+    corpus = {name: extract_laboratory_values(text) for name, text in corpus_texts().items()}
+    os.makedirs(os.path.dirname(CORPUS_PATH), exist_ok=True)
+    with open(CORPUS_PATH, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {len(corpus)} cases to {CORPUS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
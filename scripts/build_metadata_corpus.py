@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# scripts/build_metadata_corpus.py
+#
+# Regenerates tests/data/metadata_corpus.json: the regression corpus for
+# extract_metadata on the sample PDFs (full_text excluded). Run it only when a
+# change to the extracted fields is intended, and review the diff of the JSON file.
+
+import os
+import sys
+import json
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from core.pdf_parser import extract_metadata
+from build_lab_values_corpus import SAMPLE_PDFS
+
+CORPUS_PATH = os.path.join(ROOT, "tests", "data", "metadata_corpus.json")
+
+
+def metadata_without_text(relative_path: str) -> dict:
+    with open(os.path.join(ROOT, relative_path), "rb") as f:
+        meta = extract_metadata(f.read())
+    meta.pop("full_text")
+    return meta
+
+
+def main():
+    corpus = {path: metadata_without_text(path) for path in SAMPLE_PDFS}
+    os.makedirs(os.path.dirname(CORPUS_PATH), exist_ok=True)
+    with open(CORPUS_PATH, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {len(corpus)} cases to {CORPUS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
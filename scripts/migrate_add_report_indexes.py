@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the composite indexes of the reports table
+(db/models.py::Report.__table_args__) to an existing SQLite or PostgreSQL
+database. On PostgreSQL the indexes are built CONCURRENTLY, so uploads are
+not blocked while they are created.
+"""
+
+import os
+import sys
+
+# Add the backend directory to the path so we can import the app modules
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from sqlalchemy import create_engine, inspect, text
+from db.models import Report
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///backend/db/lexicare.db")
+
+
+def index_ddl(index, postgres: bool) -> str:
+    columns = ", ".join(column.name for column in index.columns)
+    concurrently = "CONCURRENTLY " if postgres else ""
+    return f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"
+
+
+def add_indexes(engine) -> list[str]:
+    """Create the missing indexes; returns the names of the created ones."""
+    postgres = engine.dialect.name == "postgresql"
+    existing = {ix["name"] for ix in inspect(engine).get_indexes("reports")}
+    created = []
+    # CREATE INDEX CONCURRENTLY non può essere eseguito in una transazione
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for index in sorted(Report.__table__.indexes, key=lambda ix: ix.name):
+            if index.name in existing:
+                print(f"✅ Index {index.name} already exists")
+                continue
+            print(f"🔄 Creating index {index.name}...")
+            conn.execute(text(index_ddl(index, postgres)))
+            created.append(index.name)
+        if postgres:
+            conn.execute(text("ANALYZE reports"))
+        else:
+            conn.execute(text("ANALYZE"))
+    return created
+
+
+if __name__ == "__main__":
+    print(f"🚀 Adding reports indexes ({DATABASE_URL})")
+    try:
+        created = add_indexes(create_engine(DATABASE_URL))
+        print(f"🎉 Migration completed: {len(created)} indexes created.")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Migration script to add the structured_snapshot column to the reports table
+(SQLite and PostgreSQL). With --backfill, snapshots of the existing reports are
+rebuilt from their stored text and AI diagnosis, without calling the model.
+"""
+
+import os
+import sys
+import argparse
+
+# Add the backend directory to the path so we can import the app modules
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from sqlalchemy import create_engine, inspect, text
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///backend/db/lexicare.db")
+BACKFILL_BATCH_SIZE = 200
+
+
+def add_column(engine) -> bool:
+    """Add the column if missing; returns True if it was added."""
+    columns = [c["name"] for c in inspect(engine).get_columns("reports")]
+    if "structured_snapshot" in columns:
+        print("✅ The structured_snapshot column already exists in the reports table.")
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE reports ADD COLUMN structured_snapshot TEXT"))
+    print("✅ Added structured_snapshot column to reports table.")
+    return True
+
+
+def backfill(engine) -> int:
+    """Build the snapshot of every report that has none; returns the number of updated reports."""
+    from core.report_snapshot import snapshot_from_text, dump_snapshot
+
+    updated = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, extracted_text, ai_diagnosis, ai_classification FROM reports "
+                "WHERE structured_snapshot IS NULL LIMIT :limit"
+            ), {"limit": BACKFILL_BATCH_SIZE}).fetchall()
+            if not rows:
+                return updated
+            for report_id, extracted_text, diagnosis, classification in rows:
+                snapshot = snapshot_from_text(extracted_text or "", diagnosis or "", classification or "")
+                conn.execute(text("UPDATE reports SET structured_snapshot = :snapshot WHERE id = :id"),
+                             {"snapshot": dump_snapshot(snapshot), "id": report_id})
+            updated += len(rows)
+            print(f"🔄 Snapshots built for {updated} reports...")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backfill", action="store_true",
+                        help="build the snapshot of the existing reports from their stored text")
+    args = parser.parse_args()
+
+    print(f"🚀 Adding structured_snapshot column ({DATABASE_URL})")
+    engine = create_engine(DATABASE_URL)
+    try:
+        add_column(engine)
+        if args.backfill:
+            print(f"🎉 Backfill completed: {backfill(engine)} reports updated.")
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        sys.exit(1)
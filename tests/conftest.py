@@ -1,5 +1,14 @@
 # tests/conftest.py
 
+import os
+
+# I test non devono leggere né scrivere la cache LLM persistente reale
+os.environ.setdefault("LLM_CACHE_ENABLED", "False")
+# Né la cache di estrazione: una voce vecchia nasconderebbe una regressione del parser
+os.environ.setdefault("EXTRACTION_CACHE_ENABLED", "False")
+# Nessun preriscaldamento del modello (e nessun blocco delle analisi) durante i test
+os.environ.setdefault("OLLAMA_WARMUP_ENABLED", "False")
+
 import pytest
 from fastapi.testclient import TestClient
 from backend.main import app
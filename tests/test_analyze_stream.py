@@ -0,0 +1,134 @@
+# tests/test_analyze_stream.py
+
+import asyncio
+import io
+import json
+import os
+import sys
+
+import ollama
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AI_JSON = json.dumps({"diagnosis": "Diagnosi non conclusiva", "classification": "lieve"})
+
+
+def parse_events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def _upload(*names):
+    files = []
+    for name in names:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            files.append(("files", (name, io.BytesIO(f.read()), "application/pdf")))
+    return files
+
+
+def test_stream_emits_metadata_tokens_and_results(client, tmp_path, monkeypatch):
+    analyze = sys.modules["api.analyze"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    stored = []
+
+    async def streamed(text):
+        for i in range(0, len(text), 8):
+            await asyncio.sleep(0)
+            yield {"response": text[i:i + 8], "message": {"content": text[i:i + 8]}}
+
+    async def fake_generate(self, model, prompt, stream=False, **kwargs):
+        assert stream
+        return streamed(AI_JSON)
+
+    async def fake_chat(self, model, messages, stream=False, **kwargs):
+        assert stream
+        return streamed(AI_JSON)
+
+    def fake_store(db, file_info, ai):
+        stored.append(file_info["metadata"]["report_date"])
+        return {"salvato": False, "situazione": "stabile"}
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", fake_generate)
+    monkeypatch.setattr(ollama.AsyncClient, "chat", fake_chat)
+    monkeypatch.setattr(analyze, "_store_analysis", fake_store)
+
+    response = client.post("/api/analyze/stream",
+                           files=_upload("report_2024_05_01.pdf", "report_2024_02_01.pdf"))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    names = [name for name, _ in events]
+    assert names.count("metadata") == 2
+    assert names[-1] == "done"
+    for filename in ("report_2024_05_01.pdf", "report_2024_02_01.pdf"):
+        of_file = [(name, data) for name, data in events if data.get("nome_file") == filename]
+        order = [name for name, _ in of_file]
+        assert order[0] == "metadata"
+        assert order.index("token") < order.index("diagnosis") < order.index("result")
+        # I token sono i frammenti JSON grezzi della risposta strutturata
+        assert "".join(data["testo"] for name, data in of_file if name == "token") == AI_JSON
+        assert "full_text" not in of_file[0][1]["metadata"]
+
+    results = [data for name, data in events if name == "result"]
+    assert [r["nome_file"] for r in results] == ["report_2024_02_01.pdf", "report_2024_05_01.pdf"]
+    assert stored == ["01/02/2024", "01/05/2024"]
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("category", ["radiology", "pathology"])
+def test_tokens_are_forwarded_for_every_report_category(monkeypatch, category):
+    ai_engine = sys.modules["core.ai_engine"]
+    sinks = []
+
+    def fake_generate(kind, model, prompt, schema, template, on_token=None, **kwargs):
+        sinks.append(on_token)
+        on_token(AI_JSON)
+        return schema(diagnosis="Diagnosi non conclusiva", classification="lieve")
+
+    monkeypatch.setattr(ai_engine, "generate_structured", fake_generate)
+    tokens = []
+    sink = tokens.append
+    text = "Esame eseguito con tecnica standard. Fegato di dimensioni nella norma, milza regolare."
+    ai_engine.analyze_laboratory_report({"report_category": category, "full_text": text}, on_token=sink)
+    assert sinks and all(s is sink for s in sinks)
+    assert tokens == [AI_JSON]
+
+
+
+def test_stream_batch_survives_client_disconnect(monkeypatch):
+    analyze = sys.modules["api.analyze"]
+    finished = []
+    release = asyncio.Event()
+
+    async def fake_save(upload):
+        return {"filename": "referto.pdf"}
+
+    async def fake_stream(saved_files, emit, debug):
+        emit("metadata", {"nome_file": "referto.pdf"})
+        await release.wait()
+        finished.append(asyncio.current_task() in analyze._stream_tasks)
+        emit("done", {"file_analizzati": 1})
+
+    monkeypatch.setattr(analyze, "_save_file", fake_save)
+    monkeypatch.setattr(analyze, "_stream_analysis", fake_stream)
+
+    async def scenario():
+        response = await analyze.analyze_documents_stream(files=[object()], debug=False)
+        body = response.body_iterator
+        assert (await body.__anext__()).startswith("event: metadata")
+        # Il client si disconnette: Starlette chiude il generatore
+        await body.aclose()
+        assert len(analyze._stream_tasks) == 1
+        producer = next(iter(analyze._stream_tasks))
+        release.set()
+        await producer
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert finished == [True]
+    assert not analyze._stream_tasks
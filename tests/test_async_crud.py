@@ -0,0 +1,207 @@
+# tests/test_async_crud.py
+#
+# I test delle query richiedono aiosqlite e greenlet; senza vengono saltati.
+
+import sys
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+CF, TITLE = "RSSMRA80A01H501U", "Ecografia addome"
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("postgresql://user:pw@localhost/lexicare", "postgresql+asyncpg://user:pw@localhost/lexicare"),
+    ("postgresql+psycopg2://user:pw@db/lexicare", "postgresql+asyncpg://user:pw@db/lexicare"),
+    ("sqlite:///backend/db/lexicare.db", "sqlite+aiosqlite:///backend/db/lexicare.db"),
+])
+def test_async_database_url(url, expected):
+    assert sys.modules["db.async_session"].async_database_url(url) == expected
+
+
+def test_async_database_url_rejects_unknown_dialects():
+    with pytest.raises(ValueError):
+        sys.modules["db.async_session"].async_database_url("mysql://user@localhost/lexicare")
+
+
+@pytest.fixture
+def async_session_factory(tmp_path):
+    pytest.importorskip("greenlet")
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    path = tmp_path / "async.db"
+    sync_engine = create_engine(f"sqlite:///{path}")
+    sys.modules["db.models"].Base.metadata.create_all(sync_engine)
+    sync_engine.dispose()
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    asyncio.run(engine.dispose())
+
+
+def _store_reports(path, count):
+    models = sys.modules["db.models"]
+    engine = create_engine(f"sqlite:///{path}")
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    reports = [
+        models.Report(patient_cf=CF, patient_name="Mario Rossi", report_type=TITLE,
+                      report_date=datetime(2024, 1, 1) + timedelta(days=day), file_path="/fake.pdf",
+                      extracted_text=f"Fegato 1{day} cm", ai_diagnosis="-", ai_classification="lieve",
+                      comparison_to_previous="stabile" if day else None)
+        for day in range(count)
+    ]
+    db.add_all(reports)
+    db.commit()
+    db.close()
+    engine.dispose()
+    return reports
+
+
+def test_async_crud_round_trip(async_session_factory, tmp_path):
+    async_crud = sys.modules["db.async_crud"]
+    reports = _store_reports(tmp_path / "async.db", 3)
+
+    async def scenario():
+        async with async_session_factory() as db:
+            assert await async_crud.save_feedback(db, reports[0].id, "Steatosi", "lieve", "ok")
+
+        async with async_session_factory() as db:
+            listing = await async_crud.get_patient_reports(db, CF, TITLE)
+            detail = await async_crud.get_patient_report(db, CF, reports[0].id)
+            other_patient = await async_crud.get_patient_report(db, "PZNT000000000000", reports[0].id)
+        return listing, detail, other_patient
+
+    listing, detail, other_patient = asyncio.run(scenario())
+    assert [row.id for row in listing] == [report.id for report in reversed(reports)]
+    assert listing[0].comparison_to_previous == "stabile"
+    assert detail.doctor_diagnosis == "Steatosi" and detail.extracted_text == "Fegato 10 cm"
+    assert other_patient is None
+
+
+def test_async_feedback_for_a_missing_report(async_session_factory):
+    import uuid
+    async_crud = sys.modules["db.async_crud"]
+
+    async def scenario():
+        async with async_session_factory() as db:
+            return await async_crud.save_feedback(db, uuid.uuid4(), "-", "lieve")
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_async_report_writes_and_latest_by_title(async_session_factory):
+    async_crud = sys.modules["db.async_crud"]
+
+    async def scenario():
+        async with async_session_factory() as db:
+            reports = []
+            for day in range(3):
+                reports.append(await async_crud.create_report(
+                    db, patient_cf=CF, patient_name="Mario Rossi", report_type=TITLE,
+                    report_date=datetime(2024, 1, 1) + timedelta(days=day), file_path="/fake.pdf",
+                    extracted_text=f"Fegato 1{day} cm", ai_diagnosis="-", ai_classification="lieve",
+                    structured_snapshot="{}",
+                ))
+            assert await async_crud.update_report_comparison(db, reports[-1].id,
+                                                             {"status": "peggioramento", "explanation": "x"})
+
+        async with async_session_factory() as db:
+            listing = await async_crud.get_patient_reports(db, CF, TITLE)
+            latest = await async_crud.get_latest_reports_by_title(db, CF, TITLE, limit=2, with_text=True)
+        return reports, listing, latest
+
+    reports, listing, latest = asyncio.run(scenario())
+    assert listing[0].id == reports[2].id and listing[0].comparison_to_previous == "peggioramento"
+    assert [report.id for report in latest] == [reports[2].id, reports[1].id]
+    assert latest[0].extracted_text == "Fegato 12 cm" and latest[0].structured_snapshot == "{}"
+
+
+def test_async_comparison_update_of_a_missing_report(async_session_factory):
+    import uuid
+    async_crud = sys.modules["db.async_crud"]
+
+    async def scenario():
+        async with async_session_factory() as db:
+            return await async_crud.update_report_comparison(db, uuid.uuid4(), {"status": "stabile"})
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_ehr_analyze_on_the_async_path(async_session_factory, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    ehr = sys.modules["api.ehr"]
+    _store_reports(tmp_path / "async.db", 1)
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    meta = {"full_text": "Fegato 15 cm", "codice_fiscale": CF, "patient_name": "Mario Rossi",
+            "report_type": TITLE, "report_date": "10/01/2024", "report_category": "radiology",
+            "laboratory_values": {}}
+    compared = []
+
+    async def parsed(path, digest):
+        return meta
+
+    def compare(older, newer):
+        compared.append((older["text"], newer["text"]))
+        return {"status": "peggioramento", "explanation": "Fegato aumentato."}
+
+    async def async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    monkeypatch.setattr(ehr, "DB_ASYNC_ENABLED", True)
+    monkeypatch.setattr(ehr, "parse_stored_pdf", parsed)
+    monkeypatch.setattr(ehr, "analyze_text_with_medgemma", lambda text: {"diagnosis": "Epatomegalia",
+                                                                        "classification": "moderato"})
+    monkeypatch.setattr(ehr, "compare_report_pair", compare)
+    # Il percorso sincrono non deve essere usato
+    monkeypatch.setattr(ehr, "_save_report", lambda *args: pytest.fail("sync save on the async path"))
+    app.dependency_overrides[ehr.get_ehr_db] = async_db
+    app.dependency_overrides[sys.modules["auth.api_auth"].get_api_key] = lambda: "test"
+    try:
+        response = TestClient(app).post("/api/ehr/analyze",
+                                        files=[("files", ("referto.pdf", b"%PDF-1.4 fake", "application/pdf"))])
+    finally:
+        app.dependency_overrides.clear()
+
+    result = response.json()["risultati"][0]
+    assert result["salvato"] and result["situazione"] == "peggioramento", result
+    assert compared == [("Fegato 10 cm", "Fegato 15 cm")]
+
+    async def stored():
+        async with async_session_factory() as db:
+            return await sys.modules["db.async_crud"].get_patient_reports(db, CF, TITLE)
+
+    newest = asyncio.run(stored())[0]
+    assert str(newest.id) == result["report_id"] and newest.comparison_to_previous == "peggioramento"
+
+
+def test_ehr_endpoints_on_the_async_path(async_session_factory, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    ehr = sys.modules["api.ehr"]
+    reports = _store_reports(tmp_path / "async.db", 2)
+
+    async def async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    monkeypatch.setattr(ehr, "DB_ASYNC_ENABLED", True)
+    app.dependency_overrides[ehr.get_ehr_db] = async_db
+    app.dependency_overrides[sys.modules["auth.api_auth"].get_api_key] = lambda: "test"
+    try:
+        client = TestClient(app)
+        listing = client.get(f"/api/ehr/patients/{CF}/reports").json()
+        detail = client.get(f"/api/ehr/patients/{CF}/reports/{reports[0].id}").json()
+        feedback = client.post("/api/ehr/feedback", json={"report_id": str(reports[1].id), "diagnosi_corretta": "Steatosi",
+                                                         "classificazione_corretta": "lieve"})
+    finally:
+        app.dependency_overrides.clear()
+    assert [report["id"] for report in listing] == [str(reports[1].id), str(reports[0].id)]
+    assert detail["extracted_text"] == "Fegato 10 cm"
+    assert feedback.status_code == 200
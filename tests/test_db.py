@@ -18,3 +18,50 @@ def test_create_report(db_session):
     )
     assert report.id is not None
     assert report.ai_diagnosis == "Polmonite"
+
+
+def test_listing_does_not_load_report_bodies(db_session):
+    from sqlalchemy import event
+
+    cf = uuid4().hex[:16].upper()
+    crud.create_report(
+        db=db_session, patient_cf=cf, patient_name="Mario Rossi", report_type="radiologia",
+        report_date=datetime.utcnow(), file_path="/fake/path/list.pdf", extracted_text="Testo " * 1000,
+        ai_diagnosis="Polmonite", ai_classification="moderato", structured_snapshot="{}",
+    )
+    statements = []
+    engine = db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        reports = crud.get_patient_reports(db_session, cf)
+        text = crud.get_most_recent_report_text_by_title(db_session, cf, "radiologia")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert [r.ai_diagnosis for r in reports] == ["Polmonite"]
+    assert text.startswith("Testo")
+    assert "extracted_text" not in statements[0] and "structured_snapshot" not in statements[0]
+    # Il solo testo, senza le altre colonne del referto
+    assert "ai_diagnosis" not in statements[1]
+
+
+def test_latest_reports_by_title_reads_only_the_last_ones(db_session):
+    cf = uuid4().hex[:16].upper()
+    for day in (3, 1, 5, 2, 4):
+        crud.create_report(
+            db=db_session, patient_cf=cf, patient_name="Mario Rossi", report_type="Esame urine",
+            report_date=datetime(2024, 1, day), file_path=f"/fake/path/{day}.pdf", extracted_text="-",
+            ai_diagnosis="-", ai_classification="lieve", structured_snapshot=f'{{"day": {day}}}',
+        )
+    # Stessa data del più recente, caricato dopo: viene prima
+    latest_upload = crud.create_report(
+        db=db_session, patient_cf=cf, patient_name="Mario Rossi", report_type="Esame urine",
+        report_date=datetime(2024, 1, 5), file_path="/fake/path/5b.pdf", extracted_text="-",
+        ai_diagnosis="-", ai_classification="lieve",
+    )
+
+    latest = crud.get_latest_reports_by_title(db_session, cf, "Esame urine", limit=2)
+    assert [r.id for r in latest][0] == latest_upload.id
+    assert [r.report_date.day for r in latest] == [5, 5]
+    assert latest[1].structured_snapshot == '{"day": 5}'
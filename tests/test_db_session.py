@@ -0,0 +1,105 @@
+# tests/test_db_session.py
+
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+def session_module():
+    return sys.modules["db.session"]
+
+
+def test_pool_metrics_count_checkouts():
+    session = session_module()
+    before = session.pool_metrics()
+
+    with session.engine.connect() as first, session.engine.connect() as second:
+        during = session.pool_metrics()
+    after = session.pool_metrics()
+
+    assert during["checkouts"] == before["checkouts"] + 2
+    assert during["in_use"] == before["in_use"] + 2
+    assert during["max_in_use"] >= during["in_use"]
+    assert after["in_use"] == before["in_use"]
+    assert {"size", "overflow", "idle", "wait_avg_ms", "wait_max_ms", "timeouts"} <= set(after)
+
+
+def test_checkout_timeout_is_recorded(tmp_path):
+    session = session_module()
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=session.InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    before = session.pool_stats.snapshot()["timeouts"]
+    try:
+        with engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                engine.connect()
+    finally:
+        engine.dispose()
+    stats = session.pool_stats.snapshot()
+    assert stats["timeouts"] == before + 1
+    assert stats["wait_max_ms"] >= 50
+
+
+def test_release_connection_in_operation_scope(monkeypatch):
+    session = session_module()
+    monkeypatch.setattr(session, "DB_SESSION_SCOPE", "operation")
+    db = session.SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        in_use = session.engine.pool.checkedout()
+        session.release_connection(db)
+        assert not db.in_transaction()
+        assert session.engine.pool.checkedout() == in_use - 1
+        # La query successiva riprende una connessione
+        assert db.execute(text("SELECT 1")).scalar() == 1
+    finally:
+        db.close()
+
+
+def test_release_connection_keeps_pending_changes(monkeypatch):
+    session = session_module()
+    models = sys.modules["db.models"]
+    monkeypatch.setattr(session, "DB_SESSION_SCOPE", "operation")
+    db = session.SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        db.add(models.Report(patient_cf="RSSMRA80A01H501U", patient_name="Test", report_type="radiologia",
+                             report_date=datetime.utcnow(), file_path="/fake.pdf", extracted_text="-",
+                             ai_diagnosis="-", ai_classification="lieve"))
+        session.release_connection(db)
+        assert db.in_transaction() and db.new
+    finally:
+        db.rollback()
+        db.close()
+
+
+def test_release_connection_is_a_noop_in_request_scope(monkeypatch):
+    session = session_module()
+    monkeypatch.setattr(session, "DB_SESSION_SCOPE", "request")
+    db = session.SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+        session.release_connection(db)
+        assert db.in_transaction()
+    finally:
+        db.close()
+
+
+def test_comparison_releases_before_the_model(monkeypatch):
+    comparator = sys.modules["core.comparator"]
+    events = []
+    monkeypatch.setattr(comparator, "_perform_comparison",
+                        lambda older, newer: events.append(("model", older, newer)) or {"status": "stabile"})
+    reports = [
+        SimpleNamespace(report_date=datetime(2024, 1, day), created_at=None, id=day,
+                        structured_snapshot=None, extracted_text=f"referto {day}")
+        for day in (3, 1, 2)
+    ]
+
+    result = comparator.compare_latest_reports(reports, release=lambda: events.append(("release",)))
+    assert result == {"status": "stabile"}
+    assert events == [("release",), ("model", "referto 2", "referto 3")]
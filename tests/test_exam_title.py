@@ -0,0 +1,57 @@
+# tests/test_exam_title.py
+
+import glob
+import os
+import random
+import re
+
+import fitz
+import pytest
+
+from backend.core.pdf_parser import EXAM_TITLE_PATTERNS, match_exam_title_pattern, extract_exam_title
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_PDFS = sorted(glob.glob(os.path.join(ROOT, "*.pdf")))
+
+
+def legacy_match(text):
+    for pattern in EXAM_TITLE_PATTERNS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            return match.group(0)
+    return None
+
+
+@pytest.mark.parametrize("pdf_path", SAMPLE_PDFS, ids=os.path.basename)
+def test_matches_legacy_on_sample_pdfs(pdf_path):
+    with fitz.open(pdf_path) as doc:
+        text = "".join(page.get_text() for page in doc)
+    assert match_exam_title_pattern(text) == legacy_match(text)
+
+
+@pytest.mark.parametrize("text", [
+    "Referto di AGOBIOPSIA epatica",                       # BIOPSIA dentro AGOBIOPSIA
+    "ANGIOTAC ADDOME con mdc",                             # TAC dentro ANGIOTAC
+    "eco-doppler e poi ECOCOLORDOPPLERGRAFIA CARDIACA",     # DOPPLER dentro un titolo più specifico
+    "Doppler venoso ... in fondo: Esame Istologico",       # priorità più alta più avanti nel testo
+    "markers tumorali e marker tumorale",
+    "Funzionalità   epatica\nCOAGULAZIONE",
+    "Nessun titolo riconoscibile",
+    "Straße ECOGRAFIA DELLA TIROIDE",                      # upper() cambia la lunghezza del testo
+])
+def test_matches_legacy_on_tricky_texts(text):
+    assert match_exam_title_pattern(text) == legacy_match(text)
+
+
+def test_matches_legacy_on_random_keyword_soup():
+    words = ["ESAME", "ECO", "DOPPLER", "TAC", "ADDOME", "CON", "MDC", "REFERTO", "DI", "ISTOLOGICO",
+             "BIOPSIA", "AGO", "RADIOGRAFIA", "DEL", "TORACE", "RISONANZA", "MAGNETICA", "ANGIO",
+             "PATOLOGICA", "EMOCROMO", "COMPLETO", "PAP", "TEST", "urine", "CHIMICO", "FISICO", "DELLE"]
+    rng = random.Random(1234)
+    for _ in range(500):
+        text = "".join(rng.choice(words) + rng.choice([" ", "", "\n", "  "]) for _ in range(rng.randint(1, 12)))
+        assert match_exam_title_pattern(text) == legacy_match(text), text
+
+
+def test_extract_exam_title_returns_title_case():
+    assert extract_exam_title("xxx\nESAME CHIMICO FISICO DELLE URINE\n") == "Esame Chimico Fisico Delle Urine"
@@ -0,0 +1,75 @@
+# tests/test_extraction_cache.py
+
+import time
+import hashlib
+
+from backend.core import extraction_cache
+from backend.core.sqlite_cache import SQLiteCache
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_bytes=40, version="1")
+    cache.set("a", {"v": "x" * 10})
+    cache.set("b", {"v": "y" * 10})
+    assert cache.get("a") == {"v": "x" * 10}  # "a" ora è la più recente
+
+    cache.set("c", {"v": "z" * 10})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_cache_version_change_invalidates_entries(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteCache(path, max_bytes=1024, version="1").set("k", {"full_text": "vecchio"})
+
+    assert SQLiteCache(path, max_bytes=1024, version="1").get("k") == {"full_text": "vecchio"}
+    assert SQLiteCache(path, max_bytes=1024, version="2").get("k") is None
+
+
+def test_extract_metadata_cached_skips_parsing_on_hit(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_extract_metadata_from_file(path):
+        calls.append(path)
+        return {"full_text": "testo", "codice_fiscale": "RSSMRA80A01H501U", "laboratory_values": {}}
+
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_ENABLED", True)
+    monkeypatch.setattr(extraction_cache, "_cache", SQLiteCache(str(tmp_path / "cache.db"), 1024 * 1024, "1"))
+    monkeypatch.setattr(extraction_cache, "extract_metadata_from_file", fake_extract_metadata_from_file)
+    pdf = tmp_path / "referto.pdf"
+    pdf.write_bytes(b"%PDF-1.4 stesso file")
+    digest = hashlib.sha256(pdf.read_bytes()).hexdigest()
+
+    first = extraction_cache.extract_metadata_cached_from_file(str(pdf), digest)
+    second = extraction_cache.extract_metadata_cached_from_file(str(pdf), digest)
+
+    assert first == second
+    assert calls == [str(pdf)]
+
+
+def test_cache_entries_expire_after_ttl(tmp_path, monkeypatch):
+    cache = SQLiteCache(str(tmp_path / "cache.db"), max_bytes=1024, version="1", ttl_seconds=60)
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("k") is None
+
+
+def test_degraded_ocr_results_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_ENABLED", True)
+    monkeypatch.setattr(extraction_cache, "_cache", SQLiteCache(str(tmp_path / "cache.db"), 1024 * 1024, "1"))
+
+    extraction_cache.store_cached_metadata("degradato", {"full_text": "", "ocr_failed_pages": [2]})
+    extraction_cache.store_cached_metadata("completo", {"full_text": "testo", "ocr_failed_pages": []})
+
+    assert extraction_cache.get_cached_metadata("degradato") is None
+    assert extraction_cache.get_cached_metadata("completo") == {"full_text": "testo", "ocr_failed_pages": []}
+
+
+def test_cache_version_includes_ocr_settings():
+    version = extraction_cache._cache.version
+    assert str(extraction_cache.OCR_DPI) in version and extraction_cache.OCR_LANG in version
@@ -0,0 +1,80 @@
+# tests/test_lab_delta.py
+
+import os
+import sys
+
+import pytest
+
+from backend.core.lab_delta import compare_lab_reports, compare_lab_values, overall_status, parse_reference
+from backend.core.pdf_parser import extract_metadata_from_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def lab(value, unit="mg/dl", reference="0 - 10", abnormal=False):
+    return {"value": value, "unit": unit, "reference": reference, "abnormal": abnormal}
+
+
+def report_text(name):
+    return extract_metadata_from_file(os.path.join(ROOT, name))["full_text"]
+
+
+def test_parse_reference_formats():
+    assert parse_reference("0 - 10") == (0.0, 10.0)
+    assert parse_reference("0,0 - 1,5") == (0.0, 1.5)
+    assert parse_reference("1.15 - 0.88") == (0.88, 1.15)
+    assert parse_reference("creatinina: 0,9 mg/dl (0.5 - 1.2)") == (0.5, 1.2)
+    assert parse_reference("< 5") == (None, 5.0)
+    assert parse_reference("ASSENTE") is None
+
+
+def test_changes_are_judged_against_the_reference_range():
+    previous = {"Proteine": lab("15"), "Glucosio": lab("90", reference="70 - 110"),
+                "CALCIO": lab("8,0", reference="8.8 - 10.2"), "Colore": lab("GIALLO", "", "")}
+    current = {"PROTEINE": lab("45", abnormal=True), "Glucosio": lab("105", reference="70 - 110"),
+               "CALCIO": lab("9,1", reference="8.8 - 10.2"), "Colore": lab("GIALLO", "", "")}
+
+    trends = {c["test"]: c["trend"] for c in compare_lab_values(previous, current)}
+    # Glucosio cambia ma resta nel range; CALCIO rientra nel range
+    assert trends == {"PROTEINE": "peggiorato", "Glucosio": "invariato",
+                      "CALCIO": "migliorato", "Colore": "invariato"}
+
+
+def test_different_units_are_not_aligned():
+    changes = compare_lab_values({"Glucosio": lab("5", unit="mmol/l")}, {"Glucosio": lab("95")})
+    assert changes == []
+
+
+def test_qualitative_values_use_normal_terms():
+    changes = compare_lab_values({"Nitriti": lab("NEGATIVO", "", "")},
+                                 {"Nitriti": lab("POSITIVO", "", "", abnormal=True)})
+    assert changes[0]["trend"] == "peggiorato"
+
+
+@pytest.mark.parametrize("trends, status", [
+    (["invariato", "invariato"], "invariata"),
+    (["peggiorato", "invariato"], "peggiorata"),
+    (["migliorato", "migliorato", "peggiorato"], "migliorata"),
+])
+def test_overall_status(trends, status):
+    assert overall_status([{"trend": t, "deviation_change": 0.0} for t in trends]) == status
+
+
+def test_sample_reports():
+    old, new = report_text("report_2024_02_01.pdf"), report_text("report_2024_05_01.pdf")
+    result = compare_lab_reports(old, new)
+    assert result["status"] == "peggiorata"
+    assert "Proteine peggiorato: da 15 a 45 mg/dl" in result["explanation"]
+    assert compare_lab_reports(new, new)["status"] == "invariata"
+
+
+def test_fast_mode_skips_the_model(monkeypatch):
+    comparator = sys.modules["core.comparator"]
+    monkeypatch.setattr(comparator, "LAB_COMPARISON_MODE", "fast")
+    monkeypatch.setattr(comparator, "generate_structured",
+                        lambda *args, **kwargs: pytest.fail("the model must not be called"))
+
+    result = comparator._perform_comparison(report_text("report_2024_02_01.pdf"),
+                                            report_text("report_2024_05_01.pdf"))
+    assert result["status"] == "peggiorata"
+    assert result["lab_changes"]
@@ -0,0 +1,76 @@
+# tests/test_lab_triage.py
+
+import sys
+
+import pytest
+
+from backend.core.lab_delta import within_reference
+
+
+def lab(value, unit="mg/dl", reference="70 - 110", abnormal=False):
+    return {"value": value, "unit": unit, "reference": reference, "abnormal": abnormal, "category": "Biochimica"}
+
+
+def metadata(**values):
+    return {"report_type": "Esami ematochimici", "report_category": "laboratory", "laboratory_values": values}
+
+
+@pytest.mark.parametrize("data, normal", [
+    (lab("90"), True),
+    (lab("130"), False),                               # fuori range senza asterisco
+    (lab("95", abnormal=True), False),
+    (lab("ASSENTE", "", "ASSENTE"), True),
+    (lab("GIALLO PAGLIERINO", "", ""), True),
+    (lab("POSITIVO", "", ""), False),
+    (lab("12", "", ""), False),                        # nessun range: decide il modello
+])
+def test_within_reference(data, normal):
+    assert within_reference(data) is normal
+
+
+def test_normal_panel_skips_the_model(monkeypatch):
+    ai_engine = sys.modules["core.ai_engine"]
+    monkeypatch.setattr(ai_engine, "generate_structured",
+                        lambda *args, **kwargs: pytest.fail("the model must not be called"))
+    before = ai_engine.analysis_path_metrics().get("triage", 0)
+
+    result = ai_engine.analyze_laboratory_report(metadata(Glucosio=lab("90"), Colore=lab("GIALLO", "", "")))
+    assert result["analysis_path"] == "triage"
+    assert result["diagnosis"] == "Parametri di laboratorio nei limiti della norma"
+    assert result["classification"] == "lieve"
+    assert ai_engine.analysis_path_metrics()["triage"] == before + 1
+
+
+def test_abnormal_panel_escalates_to_the_model(monkeypatch):
+    ai_engine = sys.modules["core.ai_engine"]
+    calls = []
+
+    def fake_generate(kind, model, prompt, schema, template, **kwargs):
+        calls.append(template)
+        return schema(diagnosis="Iperglicemia (130 mg/dl)", classification="lieve")
+
+    monkeypatch.setattr(ai_engine, "generate_structured", fake_generate)
+    result = ai_engine.analyze_laboratory_report(metadata(Glucosio=lab("130"), Urea=lab("30", reference="10 - 50")))
+    assert calls == [ai_engine.LAB_ANALYSIS_TEMPLATE]
+    assert result["analysis_path"] == "llm"
+
+
+def test_triage_can_be_disabled(monkeypatch):
+    ai_engine = sys.modules["core.ai_engine"]
+    monkeypatch.setattr(ai_engine, "LAB_TRIAGE_ENABLED", False)
+    monkeypatch.setattr(ai_engine, "generate_structured",
+                        lambda kind, model, prompt, schema, template, **kw: schema(diagnosis="Nella norma",
+                                                                                   classification="lieve"))
+    assert ai_engine.analyze_laboratory_report(metadata(Glucosio=lab("90")))["analysis_path"] == "llm"
+
+
+def test_panel_without_ranges_escalates_to_the_model(monkeypatch):
+    ai_engine = sys.modules["core.ai_engine"]
+    monkeypatch.setattr(ai_engine, "generate_structured",
+                        lambda kind, model, prompt, schema, template, **kw: schema(diagnosis="Iperkaliemia",
+                                                                                   classification="grave"))
+    panel = metadata(Glucosio=lab("250", reference=""), Potassio=lab("7.1", "mEq/l", ""),
+                     Creatinina=lab("4.8", reference=""))
+    result = ai_engine.analyze_laboratory_report(panel)
+    assert result["analysis_path"] == "llm"
+    assert result["classification"] == "grave"
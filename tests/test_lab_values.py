@@ -0,0 +1,44 @@
+# tests/test_lab_values.py
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+from backend.core.pdf_parser import extract_laboratory_values
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS_PATH = os.path.join(ROOT, "tests", "data", "lab_values_corpus.json")
+
+
+def _load_corpus_builder():
+    spec = importlib.util.spec_from_file_location(
+        "build_lab_values_corpus", os.path.join(ROOT, "scripts", "build_lab_values_corpus.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+TEXTS = _load_corpus_builder().corpus_texts()
+
+with open(CORPUS_PATH, encoding="utf-8") as f:
+    EXPECTED = json.load(f)
+
+
+def test_corpus_covers_every_case():
+    assert set(EXPECTED) == set(TEXTS)
+
+
+@pytest.mark.parametrize("name", sorted(EXPECTED), ids=os.path.basename)
+def test_lab_values_match_regression_corpus(name):
+    assert extract_laboratory_values(TEXTS[name]) == EXPECTED[name]
+
+
+def test_known_test_prefix_prefers_list_order():
+    # "Bilirubina" precede "BILIRUBINA TOTALE" nella lista dei nomi noti
+    values = extract_laboratory_values("BILIRUBINA TOTALE 1,2\n0,8 *\nmg/dl\n0.2 - 1.1\n")
+    assert values["Bilirubina"]["value"] == "0,8"
+    assert values["Bilirubina"]["abnormal"] is True
+    assert values["Bilirubina"]["reference"] == "0.2 - 1.1"
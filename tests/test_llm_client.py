@@ -0,0 +1,91 @@
+# tests/test_llm_client.py
+
+import asyncio
+import threading
+
+import ollama
+import pytest
+
+from backend.core.llm_client import OllamaPool, LLMDeadlineExceeded
+
+
+def make_pool(**overrides):
+    params = dict(host="http://ollama.test:11434", max_parallel=2, max_connections=4,
+                  deadline=5, max_retries=2, retry_base=0.01)
+    params.update(overrides)
+    return OllamaPool(**params)
+
+
+def run_threads(fn, n):
+    threads = [threading.Thread(target=fn) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_semaphore_caps_parallel_calls(monkeypatch):
+    active, peak = [0], [0]
+
+    async def fake_generate(self, model, prompt, **kwargs):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.05)
+        active[0] -= 1
+        return {"response": prompt}
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", fake_generate)
+    pool = make_pool()
+
+    run_threads(lambda: pool.request("generate", model="m", prompt="p"), 6)
+
+    metrics = pool.metrics()
+    assert peak[0] == 2
+    assert metrics["calls"] == 6
+    assert metrics["max_queue_depth"] >= 4
+    assert metrics["waiting"] == 0 and metrics["active"] == 0
+
+
+def test_retryable_errors_are_retried(monkeypatch):
+    attempts = []
+
+    async def flaky_chat(self, model, messages, **kwargs):
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ollama.ResponseError("server busy", 503)
+        return {"message": {"content": "ok"}}
+
+    monkeypatch.setattr(ollama.AsyncClient, "chat", flaky_chat)
+    pool = make_pool()
+
+    assert pool.request("chat", model="m", messages=[])["message"]["content"] == "ok"
+    assert len(attempts) == 3
+    assert pool.metrics()["retries"] == 2
+
+
+def test_non_retryable_errors_fail_at_once(monkeypatch):
+    attempts = []
+
+    async def missing_model(self, model, prompt, **kwargs):
+        attempts.append(1)
+        raise ollama.ResponseError("model not found", 404)
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", missing_model)
+    pool = make_pool()
+
+    with pytest.raises(ollama.ResponseError):
+        pool.request("generate", model="m", prompt="p")
+    assert len(attempts) == 1
+    assert pool.metrics()["failures"] == 1
+
+
+def test_deadline_bounds_the_call(monkeypatch):
+    async def slow_generate(self, model, prompt, **kwargs):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", slow_generate)
+    pool = make_pool(max_retries=0)
+
+    with pytest.raises(LLMDeadlineExceeded):
+        pool.request("generate", deadline=0.1, model="m", prompt="p")
+    assert pool.metrics()["deadline_exceeded"] == 1
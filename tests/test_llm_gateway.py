@@ -0,0 +1,145 @@
+# tests/test_llm_gateway.py
+
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import threading
+
+import ollama
+import pytest
+
+from backend.core import ai_engine
+from backend.core.ai_engine import analyze_text_with_medgemma
+
+# Stesso modulo usato da ai_engine (l'app lo importa come "core.llm_gateway")
+llm_gateway = sys.modules["core.llm_gateway"]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+AI_JSON = json.dumps({"diagnosis": "Diagnosi non conclusiva", "classification": "lieve"})
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    async def fake_generate(self, model, prompt, **kwargs):
+        calls.append(prompt)
+        await asyncio.sleep(0.1)
+        return {"response": AI_JSON, "prompt_eval_count": 10, "eval_count": 5}
+
+    async def fake_chat(self, model, messages, **kwargs):
+        calls.append(messages)
+        await asyncio.sleep(0.1)
+        return {"message": {"content": AI_JSON}, "prompt_eval_count": 10, "eval_count": 5}
+
+    # Le chiamate passano dal client condiviso di llm_client
+    monkeypatch.setattr(ollama.AsyncClient, "generate", fake_generate)
+    monkeypatch.setattr(ollama.AsyncClient, "chat", fake_chat)
+    return calls
+
+
+def in_request(fn):
+    """Run fn in a fresh context with its own ledger, as a request would."""
+    def run():
+        ledger = llm_gateway.start_ledger()
+        return fn(), ledger
+    return contextvars.copy_context().run(run)
+
+
+def test_identical_prompts_in_a_request_hit_the_model_once(model_calls):
+    (first, second), ledger = in_request(lambda: (analyze_text_with_medgemma("referto"),
+                                                  analyze_text_with_medgemma("referto")))
+    assert first == second
+    assert len(model_calls) == 1
+    summary = ledger.summary()
+    assert [e["source"] for e in summary["entries"]] == ["model", "request_cache"]
+    assert summary["prompt_tokens"] == 10 and summary["completion_tokens"] == 5
+    assert summary["entries"][0]["prompt_hash"] == summary["entries"][1]["prompt_hash"]
+
+
+def test_identical_in_flight_calls_are_coalesced(model_calls):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(llm_gateway.generate("m", "stesso prompt")))
+               for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(model_calls) == 1
+    assert len(results) == 3
+
+
+def test_different_prompts_and_errors_are_not_shared(model_calls, monkeypatch):
+    async def failing_generate(self, model, prompt, **kwargs):
+        raise ConnectionError("Ollama non raggiungibile")
+
+    monkeypatch.setattr(llm_gateway.llm_client.pool, "max_retries", 0)
+
+    def calls():
+        llm_gateway.generate("m", "uno")
+        llm_gateway.generate("m", "due")
+        monkeypatch.setattr(ollama.AsyncClient, "generate", failing_generate)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                llm_gateway.generate("m", "tre")
+
+    _, ledger = in_request(calls)
+    entries = ledger.summary()["entries"]
+    assert len(model_calls) == 2
+    assert [e["source"] for e in entries] == ["model"] * 4
+    assert entries[-1]["error"] == "Ollama non raggiungibile"
+
+
+@pytest.fixture
+def persistent_cache(tmp_path, monkeypatch):
+    cache = llm_gateway.SQLiteCache(str(tmp_path / "llm.db"), max_bytes=1024 * 1024, version="1")
+    monkeypatch.setattr(llm_gateway, "_persistent_cache", cache)
+    monkeypatch.setattr(llm_gateway, "LLM_CACHE_ENABLED", True)
+    return cache
+
+
+def test_persistent_cache_serves_later_requests(model_calls, persistent_cache):
+    first, _ = in_request(lambda: analyze_text_with_medgemma("referto"))
+    second, ledger = in_request(lambda: analyze_text_with_medgemma("referto"))
+
+    assert first == second
+    assert len(model_calls) == 1
+    entry = ledger.summary()["entries"][0]
+    assert entry["source"] == "persistent_cache"
+    assert entry["template"] == ai_engine.TEXT_ANALYSIS_TEMPLATE
+    assert entry["prompt_tokens"] == 0
+
+
+def test_persistent_cache_is_keyed_by_model_and_template(model_calls, persistent_cache):
+    llm_gateway.generate("m", "prompt", template="t:v1")
+    llm_gateway.chat("m", [{"role": "user", "content": "prompt"}], template="t:v1")
+    assert llm_gateway.generate("m", "prompt", template="t:v1")["response"] == AI_JSON
+    assert llm_gateway.chat("m", [{"role": "user", "content": "prompt"}], template="t:v1")["message"]["content"] == AI_JSON
+    assert len(model_calls) == 2
+
+    llm_gateway.generate("m", "prompt", template="t:v2")
+    llm_gateway.generate("altro", "prompt", template="t:v1")
+    assert len(model_calls) == 4
+
+
+def test_debug_response_exposes_ledger(client, tmp_path, monkeypatch, model_calls):
+    analyze = sys.modules["api.analyze"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(analyze, "_store_analysis", lambda db, file_info, ai: {"salvato": False})
+
+    with open(os.path.join(ROOT, "report_2024_02_01.pdf"), "rb") as f:
+        pdf = f.read()
+    files = [("files", (f"copia{i}.pdf", io.BytesIO(pdf), "application/pdf")) for i in range(2)]
+
+    plain = client.post("/api/analyze/", files=files)
+    assert "llm_ledger" not in plain.json()
+
+    files = [("files", (f"copia{i}.pdf", io.BytesIO(pdf), "application/pdf")) for i in range(2)]
+    ledger = client.post("/api/analyze/?debug=true", files=files).json()["llm_ledger"]
+    assert ledger["calls"] == 2
+    assert ledger["model_calls"] == 1
+    assert ledger["deduplicated"] == 1
@@ -0,0 +1,57 @@
+# tests/test_metadata_pipeline.py
+
+import json
+import os
+
+import pytest
+
+from backend.core import pdf_parser
+from backend.core.pdf_parser import extract_metadata, METADATA_FIELDS
+from backend.core.report_text import ReportText
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+with open(os.path.join(ROOT, "tests", "data", "metadata_corpus.json"), encoding="utf-8") as f:
+    EXPECTED = json.load(f)
+
+
+class FakeDoc:
+    metadata = {}
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("pdf_path", sorted(EXPECTED), ids=os.path.basename)
+def test_metadata_matches_regression_corpus(pdf_path):
+    with open(os.path.join(ROOT, pdf_path), "rb") as f:
+        meta = extract_metadata(f.read())
+    assert list(meta) == METADATA_FIELDS
+    meta.pop("full_text")
+    assert meta == EXPECTED[pdf_path]
+
+
+def test_report_text_views_are_shared():
+    report = ReportText("  Glucosio \nHGB 13,5\r\nx")
+    assert ReportText.of(report) is report
+    assert report.upper_lines is report.upper_lines
+    assert report.stripped_lines == ["Glucosio", "HGB 13,5", "x"]
+    assert report.upper_lines == ["GLUCOSIO", "HGB 13,5", "X"]
+    assert report.splitlines == ["  Glucosio ", "HGB 13,5", "x"]
+
+
+def test_failing_extractor_uses_fallback(monkeypatch):
+    def broken(report, doc):
+        raise ValueError("boom")
+
+    monkeypatch.setattr(pdf_parser, "extract_text_from_pdf", lambda file_bytes: ("Glucosio\n95\n", FakeDoc()))
+    monkeypatch.setattr(pdf_parser, "METADATA_EXTRACTORS", [
+        (extractor, fallback, description) if extractor is not pdf_parser._extract_lab_values
+        else (broken, fallback, description)
+        for extractor, fallback, description in pdf_parser.METADATA_EXTRACTORS
+    ])
+
+    meta = extract_metadata(b"")
+    assert meta["laboratory_values"] == {}
+    assert meta["report_category"] == "laboratory"
+    assert list(meta) == METADATA_FIELDS
@@ -0,0 +1,63 @@
+# tests/test_model_warmup.py
+
+import sys
+import asyncio
+
+import ollama
+
+from backend.core.model_warmup import ModelWarmup, STATE_LOADING, STATE_READY, STATE_UNAVAILABLE
+
+
+def make_warmup():
+    return ModelWarmup(model="medgemma-test", enabled=True, interval=60, retry_seconds=1)
+
+
+def test_ping_loads_the_model_with_keep_alive(monkeypatch):
+    calls = []
+
+    async def fake_generate(self, model, prompt, **kwargs):
+        calls.append((model, prompt, kwargs.get("keep_alive")))
+        return {"response": "", "done_reason": "load"}
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", fake_generate)
+    warmup = make_warmup()
+    assert not warmup.ready
+
+    assert asyncio.run(warmup.ping())
+    assert warmup.state == STATE_READY and warmup.ready
+    assert calls == [("medgemma-test", "", sys.modules["core.llm_client"].OLLAMA_KEEP_ALIVE)]
+    assert warmup.status()["load_seconds"] is not None
+
+
+def test_unreachable_server_keeps_the_gate_closed(monkeypatch):
+    async def refused(self, model, prompt, **kwargs):
+        raise ConnectionError("connection refused")
+
+    monkeypatch.setattr(ollama.AsyncClient, "generate", refused)
+    monkeypatch.setattr(sys.modules["core.llm_client"].pool, "max_retries", 0)
+    warmup = make_warmup()
+
+    assert not asyncio.run(warmup.ping())
+    assert warmup.state == STATE_UNAVAILABLE and not warmup.ready
+    assert "connection refused" in warmup.status()["last_error"]
+
+
+def test_analysis_is_rejected_until_the_model_is_ready(client, monkeypatch):
+    warmup = sys.modules["core.model_warmup"].warmup
+    monkeypatch.setattr(warmup, "state", STATE_LOADING)
+
+    response = client.post("/api/analyze/", files=[("files", ("r.pdf", b"%PDF-1.4", "application/pdf"))])
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert client.get("/api/health").json()["status"] == "warming_up"
+    ehr = client.post("/api/ehr/analyze", files=[("files", ("r.pdf", b"%PDF-1.4", "application/pdf"))])
+    assert ehr.status_code == 503 and ehr.headers["Retry-After"]
+    # Le route che non usano il modello (anche EHR) restano disponibili
+    assert client.get("/api/ehr/report-types").status_code != 503
+    # Le route che non usano il modello restano disponibili
+    assert client.get("/").status_code == 200
+
+    monkeypatch.setattr(warmup, "state", STATE_READY)
+    health = client.get("/api/health")
+    assert health.status_code == 200
+    assert health.json()["model"]["ready"]
@@ -0,0 +1,71 @@
+# tests/test_ocr_engine.py
+
+import fitz
+from backend.core import ocr_engine
+
+
+def test_format_ocr_pages_uses_page_markers():
+    text = ocr_engine.format_ocr_pages([(1, "prima"), (2, "seconda")])
+    assert text == "\n--- PAGINA 1 ---\nprima\n--- PAGINA 2 ---\nseconda"
+
+
+def _make_pdf(page_texts):
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        if text:
+            page.insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def test_ocr_pages_keeps_order_and_skips_failed_pages(monkeypatch):
+    calls = iter(["testo pagina 1", RuntimeError("Tesseract process timeout"), "testo pagina 3"])
+
+    def fake_ocr_image(png_bytes, lang, timeout):
+        assert png_bytes.startswith(b"\x89PNG")
+        result = next(calls)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(ocr_engine, "_ocr_image", fake_ocr_image)
+
+    doc = fitz.open(stream=_make_pdf(["uno", "due", "tre"]), filetype="pdf")
+    result = ocr_engine.ocr_pages(doc, [1, 2, 3], workers=1, dpi=50)
+
+    assert result == [(1, "testo pagina 1"), (2, ""), (3, "testo pagina 3")]
+
+
+def test_per_page_mode_only_ocrs_pages_without_text_layer(monkeypatch):
+    from backend.core import pdf_parser
+
+    requested = []
+
+    def fake_ocr_pages(doc, page_numbers):
+        requested.extend(page_numbers)
+        return [(n, f"testo OCR della pagina scansionata {n}") for n in page_numbers]
+
+    monkeypatch.setattr(pdf_parser, "OCR_MODE", "page")
+    monkeypatch.setattr(pdf_parser, "ocr_pages", fake_ocr_pages)
+
+    born_digital = "\n".join(["Referto di laboratorio con text layer completo."] * 5)
+    text, doc = pdf_parser.extract_text_from_pdf(_make_pdf([born_digital, ""]))
+
+    assert requested == [2]
+    assert text.count("Referto di laboratorio con text layer completo.") == 5
+    assert text.endswith("\n--- PAGINA 2 ---\ntesto OCR della pagina scansionata 2")
+
+
+def test_failed_pages_are_tracked(monkeypatch):
+    def fake_ocr(png_bytes, lang, timeout):
+        if b"fail" in png_bytes:
+            raise RuntimeError("TesseractError: timeout")
+        return "testo"
+
+    monkeypatch.setattr(ocr_engine, "_ocr_image", fake_ocr)
+    monkeypatch.setattr(ocr_engine, "render_page_png", lambda page, dpi: b"fail" if page.number == 1 else b"ok")
+    doc = fitz.open(stream=_make_pdf(["", "", ""]), filetype="pdf")
+
+    with ocr_engine.track_ocr_failures() as failed:
+        ocr_engine.ocr_pages(doc, [1, 2, 3], workers=1, dpi=50)
+    assert failed == [2]
@@ -0,0 +1,168 @@
+# tests/test_pipeline.py
+
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+
+from backend.core import pipeline
+from backend.core.pdf_parser import extract_metadata_from_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_run_db_respects_concurrency_limit(monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(pipeline, "_db_executor", ThreadPoolExecutor(max_workers=2))
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def work():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    async def main():
+        await asyncio.gather(*(pipeline.run_db(work) for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak[0] == 2
+
+
+def test_parse_stored_pdf_in_process_pool(monkeypatch):
+    monkeypatch.setattr(pipeline, "get_cached_metadata", lambda digest: None)
+    monkeypatch.setattr(pipeline, "store_cached_metadata", lambda digest, meta: None)
+    monkeypatch.setattr(pipeline, "ANALYZE_PARSE_WORKERS", 1)
+    pdf_path = os.path.join(ROOT, "report_2024_02_01.pdf")
+
+    meta = asyncio.run(pipeline.parse_stored_pdf(pdf_path, "digest"))
+    assert meta == extract_metadata_from_file(pdf_path)
+
+
+def _upload(*names):
+    files = []
+    for name in names:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            files.append(("files", (name, io.BytesIO(f.read()), "application/pdf")))
+    return files
+
+
+def test_saves_follow_chronological_order(client, tmp_path, monkeypatch):
+    # L'app importa i moduli come "api.analyze" / "db.crud" (backend/ in sys.path)
+    analyze = sys.modules["api.analyze"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    stored = []
+
+    def fake_ai(meta, full_text):
+        return {"diagnosis": "ok", "classification": "normale"}
+
+    def fake_store(db, file_info, ai):
+        stored.append(file_info["metadata"]["report_date"])
+        return {"salvato": False, "filename": file_info["filename"]}
+
+    monkeypatch.setattr(analyze, "_run_ai_analysis", fake_ai)
+    monkeypatch.setattr(analyze, "_store_analysis", fake_store)
+
+    response = client.post("/api/analyze/", files=_upload("report_2024_05_01.pdf", "report_2024_02_01.pdf"))
+    assert response.status_code == 200
+    assert stored == ["01/02/2024", "01/05/2024"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_ai_calls_of_a_batch_run_concurrently(client, tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    analyze = sys.modules["api.analyze"]
+    app_pipeline = sys.modules["core.pipeline"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(app_pipeline, "_llm_executor", ThreadPoolExecutor(max_workers=3))
+    stored = []
+
+    def slow_ai(meta, full_text):
+        time.sleep(0.3)
+        if meta["report_date"] == "01/02/2024":
+            raise RuntimeError("modello non disponibile")
+        return {"diagnosis": "ok", "classification": "normale"}
+
+    def fake_store(db, file_info, ai):
+        stored.append(file_info["filename"])
+        return {"salvato": False, "filename": file_info["filename"]}
+
+    monkeypatch.setattr(analyze, "_run_ai_analysis", slow_ai)
+    monkeypatch.setattr(analyze, "_store_analysis", fake_store)
+
+    start = time.perf_counter()
+    response = client.post("/api/analyze/", files=_upload(
+        "report_2024_05_01.pdf", "report_2024_02_01.pdf", "report_2024_05_01_modified.pdf"))
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert elapsed < 0.8  # sequenziale: almeno 0.9 s
+    messages = [r.get("messaggio", "") for r in response.json()["risultati"]]
+    assert sum("Errore nell'analisi AI" in m for m in messages) == 1
+    assert stored == ["report_2024_05_01.pdf", "report_2024_05_01_modified.pdf"]
+
+
+def test_comparison_runs_in_the_llm_stage(client, tmp_path, monkeypatch):
+    analyze = sys.modules["api.analyze"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    threads = {}
+
+    def compare():
+        threads["compare"] = threading.current_thread().name
+        return {"status": "stabile", "explanation": "Quadro invariato."}
+
+    def fake_store(db, file_info, ai):
+        threads["store"] = threading.current_thread().name
+        file_info["comparison"] = (None, compare)
+        return {"salvato": False, "filename": file_info["filename"]}
+
+    monkeypatch.setattr(analyze, "_run_ai_analysis", lambda meta, full_text: {"diagnosis": "ok", "classification": "normale"})
+    monkeypatch.setattr(analyze, "_store_analysis", fake_store)
+
+    response = client.post("/api/analyze/", files=_upload("report_2024_02_01.pdf"))
+    assert response.status_code == 200
+    [result] = response.json()["risultati"]
+    assert result["situazione"] == "stabile"
+    assert threads["store"].startswith("db") and threads["compare"].startswith("llm")
+
+
+def test_llm_stage_defaults_to_the_server_parallelism():
+    if "ANALYZE_LLM_CONCURRENCY" in os.environ:
+        return
+    from backend.core.llm_client import OLLAMA_MAX_PARALLEL
+    assert pipeline.ANALYZE_LLM_CONCURRENCY == OLLAMA_MAX_PARALLEL
+
+
+def test_ehr_analyze_runs_through_the_pipeline_stages(client, tmp_path, monkeypatch):
+    from backend.main import app
+    ehr = sys.modules["api.ehr"]
+    monkeypatch.setattr(sys.modules["db.crud"], "STORAGE_FOLDER", str(tmp_path))
+    threads = {}
+
+    def recorded(stage, fn):
+        def call(*args, **kwargs):
+            threads[stage] = threading.current_thread().name
+            return fn(*args, **kwargs)
+        return call
+
+    monkeypatch.setattr(ehr, "analyze_text_with_medgemma",
+                        recorded("analysis", lambda text: {"diagnosis": "ok", "classification": "normale"}))
+    monkeypatch.setattr(ehr, "compare_report_pair",
+                        recorded("comparison", lambda older, newer: {"status": "stabile", "explanation": "Quadro invariato."}))
+    monkeypatch.setattr(ehr, "_save_report", recorded("save", ehr._save_report))
+    app.dependency_overrides[sys.modules["auth.api_auth"].get_api_key] = lambda: "test"
+    try:
+        response = client.post("/api/ehr/analyze", files=_upload("report_2024_05_01.pdf", "report_2024_05_01.pdf"))
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    first, second = response.json()["risultati"]
+    assert first["salvato"] and second["salvato"]
+    assert second["situazione"] == "stabile"
+    assert threads["analysis"].startswith("llm") and threads["comparison"].startswith("llm")
+    assert threads["save"].startswith("db")
@@ -0,0 +1,58 @@
+# tests/test_prompt_builder.py
+
+import sys
+
+from backend.core.prompt_builder import (OMISSION_MARKER, build_comparison_context, estimate_tokens,
+                                         fit_report_text, strip_boilerplate)
+
+HEADER = "UOC RADIOLOGIA - PRESIDIO OSPEDALIERO CENTRALE"
+
+
+def test_strip_boilerplate_drops_admin_lines_and_page_markers():
+    text = (f"\n--- PAGINA 1 ---\n{HEADER}\nTel. 081 1234567\nSig. ROSSI MARIO\n"
+            "Fegato di dimensioni   regolari.\n\n"
+            f"\n--- PAGINA 2 ---\n{HEADER}\nRefertato il 01/02/2024\nCONCLUSIONI:\nSteatosi epatica lieve.\n")
+    assert strip_boilerplate(text).split("\n") == [
+        HEADER, "Fegato di dimensioni regolari.", "CONCLUSIONI:", "Steatosi epatica lieve.",
+    ]
+
+
+def test_budget_keeps_clinical_sections_first():
+    findings = [f"Reperto descrittivo numero {i} senza rilievi particolari." for i in range(200)]
+    text = "\n".join(["ECOGRAFIA ADDOME", *findings, "CONCLUSIONI:", "Colelitiasi.", "Steatosi epatica."])
+
+    fitted = fit_report_text(text, budget_tokens=100)
+    lines = fitted.split("\n")
+    assert estimate_tokens(fitted) <= 100
+    assert lines[:2] == ["ECOGRAFIA ADDOME", findings[0]]
+    assert lines[-4:] == [OMISSION_MARKER, "CONCLUSIONI:", "Colelitiasi.", "Steatosi epatica."]
+
+
+def test_short_reports_are_unchanged():
+    text = "Glucosio: 95 mg/dl (70 - 110)\nProteine: 45 * mg/dl (0 - 10)"
+    assert fit_report_text(text, budget_tokens=2500) == text
+
+
+def test_comparison_splits_the_budget():
+    long_report = "\n".join(f"Riga di referto {i} con contenuto clinico descrittivo." for i in range(300))
+    previous, new = build_comparison_context(long_report, "Proteine: 45 * mg/dl", "comparison:test",
+                                             budget_tokens=400)
+    assert estimate_tokens(previous) <= 200
+    assert new == "Proteine: 45 * mg/dl"
+
+
+def test_lab_exclusions_keep_their_original_patterns():
+    # Le righe amministrative sono condivise con il parser: le esclusioni dei valori
+    # di laboratorio devono restare identiche
+    from backend.core import pdf_parser, prompt_builder
+
+    assert prompt_builder.ADMIN_BOILERPLATE_PATTERNS is sys.modules["core.pdf_parser"].ADMIN_BOILERPLATE_PATTERNS
+    assert pdf_parser.LAB_EXCLUDE_PATTERNS[:7] == [
+        r'\b(A\.S\.L\.|OSPEDALE|PATOLOGIA|CLINICA|DIRETTORE|VIALE|NAPOLI|TEL\.|EMAIL)\b',
+        r'(lab\.ospmare@libero\.it|081-18775094|Metamorfosi)',
+        r'(Cod\.|Sig\.|Provenienza|C\.F\.|Nosologico|D\.Nasc\.)',
+        r'(Accettato il|Refertato il|ESAME|RISULTATO|UNITA)',
+        r'(IL T\.S\.L\.B\.|IL SANITARIO RESPONSABILE|Pag\.)',
+        r'(ESAME CHIMICO FISICO|ESAME EMOCROMOCITOMETRICO|FORMULA LEUCOCITARIA)',
+        r'(SEDIMENTO:|fine referto|\.\.\.|§S§)',
+    ]
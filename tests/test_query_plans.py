@@ -0,0 +1,136 @@
+# tests/test_query_plans.py
+#
+# Le query di crud sui referti devono usare gli indici composti di Report.
+# Ogni funzione viene eseguita su un database di prova, le SELECT emesse sono
+# catturate e se ne controlla il piano (EXPLAIN QUERY PLAN su SQLite, EXPLAIN su
+# PostgreSQL con le scansioni sequenziali disabilitate). Il caso PostgreSQL viene
+# eseguito solo se TEST_POSTGRES_URL punta a un database di prova.
+
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from backend.db import crud
+
+CF, TITLE = "RSSMRA80A01H501U", "Esame urine chimico fisico"
+REPORT_DATE = datetime(2024, 1, 10)
+URINE_TEXT = "Proteine 15 mg/dl\nGlucosio 90 mg/dl"
+
+PATIENT_INDEX, TITLE_INDEX = "ix_reports_patient_type_date", "ix_reports_type_date"
+# Lettura di un referto per chiave primaria (es. il duplicato trovato)
+PRIMARY_KEY_PLANS = ("sqlite_autoindex_reports_1 (id=?)", "reports_pkey")
+
+# (nome, funzione, indice atteso, l'ordinamento è servito dall'indice)
+CASES = [
+    ("get_most_recent_report_text_by_title", lambda db: crud.get_most_recent_report_text_by_title(db, CF, TITLE),
+     PATIENT_INDEX, True),
+    ("get_latest_reports_by_title", lambda db: crud.get_latest_reports_by_title(db, CF, TITLE, limit=2),
+     PATIENT_INDEX, True),
+    ("get_chronological_reports_by_title", lambda db: crud.get_chronological_reports_by_title(db, CF, TITLE),
+     PATIENT_INDEX, True),
+    ("get_most_recent_report_by_title", lambda db: crud.get_most_recent_report_by_title(db, CF, TITLE),
+     PATIENT_INDEX, True),
+    ("get_previous_report_text_by_title",
+     lambda db: crud.get_previous_report_text_by_title(db, CF, TITLE, exclude_report_id=uuid.uuid4()),
+     PATIENT_INDEX, True),
+    ("get_most_recent_report_text_by_title_only",
+     lambda db: crud.get_most_recent_report_text_by_title_only(db, TITLE),
+     TITLE_INDEX, True),
+    ("get_most_recent_report_text", lambda db: crud.get_most_recent_report_text(db, CF, TITLE), PATIENT_INDEX, True),
+    ("get_patient_reports[title]", lambda db: crud.get_patient_reports(db, CF, TITLE), PATIENT_INDEX, True),
+    # Solo il filtro sul paziente: l'indice seleziona le righe, l'ordinamento per data è a parte
+    ("get_patient_reports", lambda db: crud.get_patient_reports(db, CF), PATIENT_INDEX, False),
+    ("check_duplicate_report", lambda db: sys.modules["api.analyze"].check_duplicate_report(
+        db, {"report_type": TITLE, "codice_fiscale": CF, "report_date": REPORT_DATE}, URINE_TEXT),
+     PATIENT_INDEX, True),
+]
+
+
+def _engines():
+    yield pytest.param("sqlite", id="sqlite")
+    yield pytest.param("postgresql", id="postgresql", marks=pytest.mark.skipif(
+        not os.getenv("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL not set"))
+
+
+@pytest.fixture(scope="module", params=list(_engines()))
+def engine(request, tmp_path_factory):
+    models = sys.modules["db.models"]
+    if request.param == "sqlite":
+        url = f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}"
+    else:
+        url = os.environ["TEST_POSTGRES_URL"]
+    engine = create_engine(url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    db = sessionmaker(bind=engine)()
+    # Qualche paziente e titolo diverso, perché l'indice sia selettivo
+    for i in range(200):
+        db.add(models.Report(
+            patient_cf=CF if i % 20 == 0 else f"PZNT{i:012d}", patient_name="Test",
+            report_type=TITLE if i % 2 == 0 else f"Titolo {i % 7}",
+            report_date=REPORT_DATE + timedelta(days=i), file_path="/fake.pdf",
+            extracted_text=URINE_TEXT, ai_diagnosis="-", ai_classification="lieve",
+        ))
+    db.commit()
+    db.close()
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE reports")
+    yield engine
+    if engine.dialect.name == "postgresql":
+        models.Base.metadata.drop_all(engine)
+    engine.dispose()
+
+
+def captured_selects(engine, fn) -> list:
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "reports" in statement:
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", capture)
+    db = sessionmaker(bind=engine)()
+    try:
+        fn(db)
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", capture)
+    return statements
+
+
+def query_plan(engine, statement, parameters) -> str:
+    with engine.connect() as conn:
+        if engine.dialect.name == "sqlite":
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+            return "\n".join(row[-1] for row in rows)
+        # Con poche righe il planner preferirebbe comunque la scansione sequenziale
+        conn.exec_driver_sql("SET enable_seqscan = off")
+        rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters).fetchall()
+        return "\n".join(row[0] for row in rows)
+
+
+@pytest.mark.parametrize("name, fn, index, sorted_by_index", CASES, ids=[case[0] for case in CASES])
+def test_crud_queries_use_an_index(engine, name, fn, index, sorted_by_index):
+    statements = captured_selects(engine, fn)
+    assert statements, f"{name} issued no query on reports"
+
+    for statement, parameters in statements:
+        plan = query_plan(engine, statement, parameters)
+        if any(pk in plan for pk in PRIMARY_KEY_PLANS):
+            continue
+        assert index in plan, f"{name} does not use {index}:\n{plan}"
+        if engine.dialect.name == "sqlite":
+            assert "SCAN reports" not in plan.replace("SCAN reports USING", ""), plan
+            if sorted_by_index:
+                assert "TEMP B-TREE" not in plan, f"{name} sorts outside the index:\n{plan}"
+        else:
+            assert "Seq Scan" not in plan, plan
+            if sorted_by_index:
+                assert "Sort" not in plan, f"{name} sorts outside the index:\n{plan}"
@@ -0,0 +1,148 @@
+# tests/test_report_snapshot.py
+
+import os
+import sys
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.main import app
+from backend.core.report_snapshot import (build_snapshot, compare_measurements, dump_snapshot,
+                                          extract_radiology_measurements, load_snapshot)
+from backend.core.pdf_parser import extract_metadata_from_file
+from backend.db import crud
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RADIOLOGY_OLD = "ECOGRAFIA ADDOME. Fegato di dimensioni aumentate (diametro 16 cm). Milza 11 cm. Nodulo di 8 mm al lobo destro."
+RADIOLOGY_NEW = "ECOGRAFIA ADDOME. Fegato di dimensioni aumentate (diametro 18 cm). Milza 110 mm. Nodulo di 12 mm al lobo destro."
+
+
+def lab_snapshot(name):
+    meta = extract_metadata_from_file(os.path.join(ROOT, name))
+    return build_snapshot(meta, {"diagnosis": "Proteinuria", "classification": "lieve"}, meta["full_text"])
+
+
+def radiology_snapshot(text, classification):
+    return build_snapshot({"report_category": "radiology"}, {"diagnosis": "Epatomegalia",
+                                                              "classification": classification}, text)
+
+
+def test_lab_snapshot_keeps_only_the_compared_fields():
+    snapshot = lab_snapshot("report_2024_05_01.pdf")
+    assert snapshot["report_category"] == "laboratory"
+    assert set(snapshot["laboratory_values"]["Proteine"]) == {"value", "unit", "reference", "abnormal"}
+    assert "measurements" not in snapshot
+    assert load_snapshot(dump_snapshot(snapshot)) == snapshot
+
+
+def test_radiology_measurements():
+    measurements = extract_radiology_measurements(RADIOLOGY_NEW)
+    assert measurements == {"fegato": {"value": 18.0, "unit": "cm"}, "milza": {"value": 110.0, "unit": "mm"},
+                            "nodulo": {"value": 12.0, "unit": "mm"}}
+
+    trends = {c["name"]: c["trend"] for c in compare_measurements(extract_radiology_measurements(RADIOLOGY_OLD),
+                                                                  measurements)}
+    # 11 cm e 110 mm sono la stessa misura
+    assert trends == {"fegato": "aumentata", "milza": "invariata", "nodulo": "aumentata"}
+
+
+def test_unusable_snapshots_are_ignored():
+    assert load_snapshot(None) is None
+    assert load_snapshot("not json") is None
+    assert load_snapshot('{"version": 0}') is None
+
+
+def test_lab_snapshots_are_compared_without_the_model(monkeypatch):
+    comparator = sys.modules["core.comparator"]
+    monkeypatch.setattr(comparator, "LAB_COMPARISON_MODE", "fast")
+    monkeypatch.setattr(comparator, "generate_structured",
+                        lambda *args, **kwargs: pytest.fail("the model must not be called"))
+
+    result = comparator._perform_snapshot_comparison(lab_snapshot("report_2024_02_01.pdf"),
+                                                     lab_snapshot("report_2024_05_01.pdf"))
+    assert result["status"] == "peggiorata"
+    assert "Proteine peggiorato: da 15 a 45 mg/dl" in result["explanation"]
+
+
+def test_radiology_snapshots_prompt_only_the_summaries(monkeypatch):
+    comparator = sys.modules["core.comparator"]
+    prompts = []
+
+    def fake_generate(kind, model, prompt, schema, template, **kwargs):
+        prompts.append(prompt)
+        return schema(status="peggiorata", explanation="Fegato aumentato da 16 a 18 cm.")
+
+    monkeypatch.setattr(comparator, "generate_structured", fake_generate)
+    result = comparator._perform_snapshot_comparison(radiology_snapshot(RADIOLOGY_OLD, "lieve"),
+                                                     radiology_snapshot(RADIOLOGY_NEW, "moderato"))
+    assert result["status"] == "peggiorata"
+    assert "fegato: 16 cm -> 18 cm (aumentata)" in prompts[0]
+    assert RADIOLOGY_OLD not in prompts[0]
+
+
+def test_radiology_fallback_uses_the_classification(monkeypatch):
+    comparator = sys.modules["core.comparator"]
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("ollama down")
+
+    monkeypatch.setattr(comparator, "generate_structured", unavailable)
+    result = comparator._perform_snapshot_comparison(radiology_snapshot(RADIOLOGY_OLD, "lieve"),
+                                                     radiology_snapshot(RADIOLOGY_NEW, "moderato"))
+    assert result["status"] == "peggiorata"
+    assert "fegato da 16 cm a 18 cm" in result["explanation"]
+
+
+def test_chronological_comparison_uses_stored_snapshots(db_session, monkeypatch):
+    comparator = sys.modules["core.comparator"]
+    monkeypatch.setattr(comparator, "LAB_COMPARISON_MODE", "fast")
+    monkeypatch.setattr(comparator, "_perform_comparison",
+                        lambda *args: pytest.fail("the report texts must not be compared"))
+
+    cf, title = "SNPSHT80A01H501U", f"Esame urine {uuid.uuid4()}"
+    for name, date in (("report_2024_02_01.pdf", datetime(2024, 2, 1)), ("report_2024_05_01.pdf", datetime(2024, 5, 1))):
+        crud.create_report(
+            db=db_session, patient_cf=cf, patient_name="Test", report_type=title, report_date=date,
+            file_path=f"/fake/{name}", extracted_text="testo non usato", ai_diagnosis="Proteinuria",
+            ai_classification="lieve", structured_snapshot=dump_snapshot(lab_snapshot(name)),
+        )
+
+    result = comparator._perform_comparison_chronological(db_session, cf, title, "testo non usato", "testo non usato")
+    assert result["status"] == "peggiorata"
+
+
+def test_ehr_ingestion_stores_the_snapshot(monkeypatch):
+    ehr = sys.modules["api.ehr"]
+    cf = uuid.uuid4().hex[:16].upper()
+    meta = {"full_text": RADIOLOGY_NEW, "codice_fiscale": cf, "patient_name": "Mario Rossi",
+            "report_type": "Ecografia addome", "report_date": "10/01/2024", "report_category": "radiology",
+            "laboratory_values": {}}
+    async def parsed(path, digest):
+        return meta
+
+    monkeypatch.setattr(ehr, "parse_stored_pdf", parsed)
+    monkeypatch.setattr(ehr, "analyze_text_with_medgemma",
+                        lambda text: {"diagnosis": "Epatomegalia", "classification": "moderato"})
+    # Primo referto del paziente: nessun confronto, quindi nessuna chiamata al modello
+    monkeypatch.setattr(ehr, "compare_report_pair", lambda older, newer: pytest.fail("nothing to compare"))
+    app.dependency_overrides[sys.modules["auth.api_auth"].get_api_key] = lambda: "test"
+    try:
+        response = TestClient(app).post("/api/ehr/analyze",
+                                        files=[("files", ("referto.pdf", b"%PDF-1.4 fake", "application/pdf"))])
+    finally:
+        app.dependency_overrides.clear()
+    result = response.json()["risultati"][0]
+    assert result["salvato"], result
+
+    db = sys.modules["db.session"].SessionLocal()
+    try:
+        report = db.get(sys.modules["db.models"].Report, uuid.UUID(result["report_id"]))
+        snapshot = load_snapshot(report.structured_snapshot)
+        crud.delete_pdf(report.file_path)
+    finally:
+        db.close()
+    assert snapshot["diagnosis"] == "Epatomegalia"
+    assert snapshot["measurements"]["fegato"] == {"value": 18.0, "unit": "cm"}
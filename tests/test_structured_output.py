@@ -0,0 +1,95 @@
+# tests/test_structured_output.py
+
+import json
+import sys
+
+import pytest
+
+from backend.core.ai_engine import analyze_text_with_medgemma
+from backend.core.comparator import _perform_comparison
+from backend.core.structured_output import Diagnosis, StructuredOutputError, parse_structured
+
+# I moduli usati da ai_engine e comparator (l'app li importa come "core.*")
+llm_gateway = sys.modules["core.llm_gateway"]
+structured_output = sys.modules["core.structured_output"]
+
+VALID = json.dumps({"diagnosis": "Cistite acuta", "classification": "lieve"})
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """Model replies served in order; records the prompts and format options it was called with."""
+    queue, calls = [], []
+
+    def fake_generate(model, prompt, template=None, on_token=None, **kwargs):
+        calls.append({"prompt": prompt, "template": template, **kwargs})
+        return {"response": queue.pop(0)}
+
+    monkeypatch.setattr(llm_gateway, "generate", fake_generate)
+    monkeypatch.setattr(structured_output, "_metrics", {})
+    return queue, calls
+
+
+def test_parse_tolerates_fences_and_surrounding_text():
+    assert parse_structured(f"```json\n{VALID}\n```", Diagnosis).diagnosis == "Cistite acuta"
+    assert parse_structured(f"Ecco il risultato: {VALID} Fine.", Diagnosis).classification == "lieve"
+    with pytest.raises(StructuredOutputError):
+        parse_structured('{"diagnosis": ""}', Diagnosis)
+
+
+def test_valid_response_needs_no_repair(replies):
+    queue, calls = replies
+    queue.append(VALID)
+
+    assert analyze_text_with_medgemma("referto") == {"diagnosis": "Cistite acuta", "classification": "lieve"}
+    assert len(calls) == 1
+    assert calls[0]["format"] == Diagnosis.model_json_schema()
+    metrics = structured_output.structured_output_metrics()
+    template = calls[0]["template"]
+    assert metrics[template]["calls"] == 1 and metrics[template]["parse_failure_rate"] == 0.0
+
+
+def test_invalid_response_is_repaired_once(replies):
+    queue, calls = replies
+    queue.extend(["La diagnosi è cistite acuta", VALID])
+
+    assert analyze_text_with_medgemma("referto")["diagnosis"] == "Cistite acuta"
+    assert len(calls) == 2
+    assert "La diagnosi è cistite acuta" in calls[1]["prompt"]
+    metrics = structured_output.structured_output_metrics()[calls[0]["template"]]
+    assert metrics["parse_failures"] == 1 and metrics["repaired"] == 1
+
+
+def test_comparison_falls_back_when_repair_fails(replies):
+    queue, calls = replies
+    queue.extend(["non JSON", "ancora non JSON"])
+
+    result = _perform_comparison("Glucosio 90 mg/dl", "Glucosio 140 mg/dl")
+    assert len(calls) == 2
+    assert result["status"]
+    metrics = structured_output.structured_output_metrics()[calls[0]["template"]]
+    assert metrics["failed"] == 1 and metrics["parse_failure_rate"] == 1.0
+
+
+def test_repair_counters_are_reported_by_health(replies, client):
+    queue, calls = replies
+    queue.extend(["La diagnosi è cistite acuta", VALID])
+    analyze_text_with_medgemma("referto")
+
+    health = client.get("/api/health").json()
+    counters = health["structured_output"][calls[0]["template"]]
+    assert counters["calls"] == 1 and counters["parse_failures"] == 1 and counters["repaired"] == 1
+
+
+def test_tokens_are_the_raw_json_fragments(monkeypatch):
+    def fake_generate(model, prompt, template=None, on_token=None, **kwargs):
+        for i in range(0, len(VALID), 5):
+            on_token(VALID[i:i + 5])
+        return {"response": VALID}
+
+    monkeypatch.setattr(llm_gateway, "generate", fake_generate)
+    tokens = []
+    result = structured_output.generate_structured("generate", "medgemma", "referto", structured_output.Diagnosis,
+                                                   "test:v1", on_token=tokens.append)
+    assert "".join(tokens) == VALID and tokens[0] == '{"dia'
+    assert result.diagnosis == "Cistite acuta"
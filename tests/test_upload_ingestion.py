@@ -0,0 +1,57 @@
+# tests/test_upload_ingestion.py
+
+import asyncio
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+from fastapi import UploadFile
+
+from backend.db import crud
+from backend.core.pdf_parser import extract_metadata, extract_metadata_from_file
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    # L'app importa crud come "db.crud" (backend/ in sys.path): va ridiretto anche quello
+    for module in (crud, sys.modules.get("db.crud")):
+        if module is not None:
+            monkeypatch.setattr(module, "STORAGE_FOLDER", str(tmp_path))
+            monkeypatch.setattr(module, "UPLOAD_CHUNK_SIZE", 7)
+    return tmp_path
+
+
+def test_save_upload_streams_and_hashes(storage):
+    data = b"%PDF-1.4 " + os.urandom(1000)
+    upload = UploadFile(file=io.BytesIO(data), filename="referto.pdf")
+
+    path, digest = asyncio.run(crud.save_upload(upload))
+
+    assert os.path.dirname(path) == str(storage)
+    assert path.endswith("_referto.pdf")
+    assert digest == hashlib.sha256(data).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+    crud.delete_pdf(path)
+    crud.delete_pdf(path)  # già rimosso: nessun errore
+    assert os.listdir(storage) == []
+
+
+def test_extract_metadata_from_file_matches_bytes():
+    pdf_path = os.path.join(ROOT, "report_2024_02_01.pdf")
+    with open(pdf_path, "rb") as f:
+        from_bytes = extract_metadata(f.read())
+    assert extract_metadata_from_file(pdf_path) == from_bytes
+
+
+def test_unsaved_upload_is_removed_from_storage(client, storage):
+    file = ("files", ("test.pdf", io.BytesIO(b"%PDF-1.4 fake content"), "application/pdf"))
+    response = client.post("/api/analyze/", files=[file])
+    assert response.status_code == 200
+    assert response.json()["risultati"][0]["salvato"] is False
+    assert os.listdir(storage) == []